@@ -3,3 +3,6 @@ from typing import Final
 
 OPEN_API_TITLE: Final = "API Hub"
 OPEN_API_DESCRIPTION: Final = "Demo API over Postgres database built with FastAPI."
+
+EMBEDDING_DIM: Final = 2048
+PHASH_BANDS: Final = 4
@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import config
+from app.core.embeder import model_version
+from app.core.preprocess import CROP_SIZE, RESIZE_SIZE
+from app.core.redispool import AsyncRedisClient
+
+
+def content_hasher() -> "hashlib.blake2b":
+    """Incremental form of :func:`content_key`, for uploads read in chunks."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_key(data: bytes) -> str:
+    """Fast content hash of the raw upload bytes."""
+    hasher = content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def features_namespace(dtype: str) -> str:
+    """Prefix of cache keys, which changes with anything cached features depend on.
+
+    Entries of another model version, inference backend, decode or
+    preprocessing setting or cache precision are not found, rather than
+    being stored as embeddings of the current model.
+    """
+    settings = "|".join([
+        model_version(),
+        config.embedder.backend,
+        f"reduce={config.decode.reduce}",
+        f"input={RESIZE_SIZE}/{CROP_SIZE}",
+        dtype,
+    ])
+    return hashlib.blake2b(settings.encode(), digest_size=8).hexdigest() + ":"
+
+
+@dataclass
+class ImageFeatures:
+    """Everything the service derives from image content."""
+
+    phash: int
+    embedding: np.ndarray
+
+    def to_bytes(self, dtype: str) -> bytes:
+        return struct.pack(">q", self.phash) + self.embedding.astype(dtype).tobytes()
+
+    @classmethod
+    def from_bytes(cls, value: bytes, dtype: str) -> "ImageFeatures":
+        (phash,) = struct.unpack_from(">q", value)
+        embedding = np.frombuffer(value, dtype=dtype, offset=8).astype(np.float32)
+        return cls(phash=phash, embedding=embedding)
+
+
+class LRUBytesCache:
+    """In-process LRU of byte strings bounded by their total size."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        previous = self._items.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+
+class EmbeddingCache:
+    """Two-tier cache of :class:`ImageFeatures` keyed by :func:`content_key`.
+
+    Repeated uploads of the same bytes (e.g. ``/images/check`` followed by
+    ``/images/load``) skip decode, pHash and the forward pass. Lookups go to
+    the local LRU first, then to Redis; Redis hits are promoted to the local
+    tier. Redis failures are logged and treated as misses. The Redis tier is
+    only used once the shared client has been initialized by the app lifespan.
+    Keys of both tiers are prefixed with :func:`features_namespace`.
+
+    Half precision entries are :attr:`lossless` no more, so they only serve
+    searches; stored embeddings are computed anew.
+    """
+
+    redis_prefix = "emb:"
+
+    def __init__(
+        self,
+        enabled: bool,
+        local_max_bytes: int,
+        redis_enabled: bool,
+        redis_ttl: int,
+        dtype: str,
+    ) -> None:
+        self.enabled = enabled
+        self.redis_enabled = redis_enabled
+        self.redis_ttl = redis_ttl
+        self.dtype = dtype
+        self.local = LRUBytesCache(local_max_bytes)
+        self.counters = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "redis_errors": 0,
+        }
+
+    @property
+    def namespace(self) -> str:
+        return features_namespace(self.dtype)
+
+    @property
+    def lossless(self) -> bool:
+        """Whether cached embeddings are the float32 ones the model returned."""
+        return np.dtype(self.dtype) == np.float32
+
+    @property
+    def use_redis(self) -> bool:
+        return self.redis_enabled and AsyncRedisClient.is_initialized()
+
+    async def get(self, key: str) -> Optional[ImageFeatures]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[ImageFeatures]]:
+        """Look up several keys, with a single MGET for local misses."""
+        if not self.enabled:
+            return [None] * len(keys)
+        namespace = self.namespace
+        keys = [namespace + key for key in keys]
+        values = [self.local.get(key) for key in keys]
+        self.counters["local_hits"] += sum(value is not None for value in values)
+
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing and self.use_redis:
+            try:
+                found = await AsyncRedisClient.mget([self.redis_prefix + keys[i] for i in missing])
+            except Exception:
+                logging.warning("Embedding cache lookup in Redis failed", exc_info=True)
+                self.counters["redis_errors"] += 1
+                found = [None] * len(missing)
+            for i, value in zip(missing, found):
+                if value is not None:
+                    self.counters["redis_hits"] += 1
+                    self.local.put(keys[i], value)
+                    values[i] = value
+
+        self.counters["misses"] += sum(value is None for value in values)
+        return [
+            ImageFeatures.from_bytes(value, self.dtype) if value is not None else None
+            for value in values
+        ]
+
+    async def put(self, key: str, features: ImageFeatures) -> None:
+        await self.put_many({key: features})
+
+    async def put_many(self, items: Mapping[str, ImageFeatures]) -> None:
+        """Store several entries, with a single Redis pipeline."""
+        if not self.enabled:
+            return
+        namespace = self.namespace
+        values = {namespace + key: features.to_bytes(self.dtype) for key, features in items.items()}
+        for key, value in values.items():
+            self.local.put(key, value)
+        if self.use_redis:
+            try:
+                await AsyncRedisClient.set_many(
+                    {self.redis_prefix + key: value for key, value in values.items()},
+                    ex=self.redis_ttl,
+                )
+            except Exception:
+                logging.warning("Embedding cache store in Redis failed", exc_info=True)
+                self.counters["redis_errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "local_entries": len(self.local),
+            "local_bytes": self.local.size,
+            "local_evictions": self.local.evictions,
+        }
+
+
+embedding_cache = EmbeddingCache(
+    enabled=config.cache.enabled,
+    local_max_bytes=config.cache.local_max_bytes,
+    redis_enabled=config.cache.redis_enabled,
+    redis_ttl=config.cache.redis_ttl,
+    dtype=config.cache.dtype,
+)
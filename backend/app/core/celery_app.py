@@ -0,0 +1,26 @@
+from celery import Celery
+
+from app.core.config import config
+
+celery_app = Celery(
+    "difmag",
+    broker=config.celery.broker_url,
+    backend=config.celery.result_backend,
+    include=["app.tasks.images"],
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    task_always_eager=config.celery.task_always_eager,
+    # Eager tasks store their results too, so status polling works the same
+    task_store_eager_result=True,
+    task_track_started=True,
+    # An upload is only acknowledged once stored: a crashed worker
+    # leaves the task in the queue instead of losing it
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=config.celery.prefetch_multiplier,
+    result_expires=config.celery.result_expires,
+)
@@ -1,9 +1,202 @@
-import torch
-import torch.nn.functional as F
-import torchvision.models as models
-import torchvision.transforms as T
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 
-resnet = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V2)
-resnet.eval()
-feature_extractor = torch.nn.Sequential(*list(resnet.children())[:-1])
+from app.core.config import config
+from app.core.metrics import INFERENCE_BATCH_SIZE, timed
+from app.core.preprocess import CROP_SIZE, InputBatcher
+
+# torch is imported together with the model, so that importing the app
+# (API and Celery workers, jobs) does not pay for it
+if TYPE_CHECKING:
+    import torch
+
+    from app.core.inference import Model
+
+
+class BatchingEmbedder:
+    """Micro-batching inference engine for the feature extractor.
+
+    Callers from any thread submit preprocessed images, uint8 arrays of
+    shape ``[224, 224, 3]`` (see :func:`app.core.preprocess.to_model_input`).
+    A single worker thread collects pending images until
+    ``max_batch_size`` of them are queued or ``max_wait_ms`` has passed since
+    the first one arrived, normalizes them into one batch, runs one forward
+    pass and resolves every caller's future with its own ``[2048]`` embedding.
+
+    Instead of a ``model`` a ``loader`` may be given, which the worker
+    thread calls before its first batch, so that callers (and the event
+    loop awaiting :meth:`aembed`) only wait on their futures while the
+    model loads. A failed load fails the pending batch and is retried
+    with the next one. :meth:`warmup` loads the model ahead of the first
+    request.
+    """
+
+    def __init__(
+        self,
+        model: Optional["Model"] = None,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        loader: Optional[Callable[[], "Model"]] = None,
+    ) -> None:
+        if model is None and loader is None:
+            raise ValueError("Either model or loader is required")
+        self.model = model
+        self.loader = loader
+        # Set once the model is loaded, whichever call triggered the load
+        self.ready = model is not None
+        self.load_seconds: Optional[float] = None
+        self.load_error: Optional[str] = None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+
+    def start(self) -> None:
+        """Start the worker thread if it is not running yet, without waiting for the model."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="embedder", daemon=True
+                )
+                self._thread.start()
+
+    def warmup(self) -> None:
+        """Load the model and run one forward pass, blocking until done."""
+        start = time.perf_counter()
+        try:
+            self.embed(np.zeros((CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8))
+        except Exception:
+            logging.exception("Embedder warmup failed")
+            raise
+        logging.info("Embedder is warm in %.2fs", time.perf_counter() - start)
+
+    def submit(self, image: np.ndarray) -> Future:
+        """Queue one image, return a future of its embedding."""
+        self.start()
+        future: Future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def embed(self, image: np.ndarray) -> "torch.Tensor":
+        """Embed one image, blocking until its batch is processed."""
+        return self.submit(image).result()
+
+    async def aembed(self, image: np.ndarray) -> "torch.Tensor":
+        """Embed one image without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(image))
+
+    def embed_batch(self, images: Sequence[np.ndarray]) -> List["torch.Tensor"]:
+        """Embed several images, sharing batches with other callers."""
+        futures = [self.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "images": self.images,
+            "avg_batch_size": self.images / self.batches if self.batches else 0.0,
+        }
+
+    def forward(self, batch: "torch.Tensor") -> "torch.Tensor":
+        """Run the model on a ``[N, 3, H, W]`` batch, return ``[N, 2048]``."""
+        import torch
+
+        with torch.inference_mode():
+            return self.model(batch).flatten(1)
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future]]:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    items.append(self._queue.get(timeout=timeout))
+                else:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # Skip callers that gave up while waiting for the batch
+        return [item for item in items if item[1].set_running_or_notify_cancel()]
+
+    def _load(self) -> None:
+        start = time.perf_counter()
+        try:
+            self.model = self.loader()
+        except Exception as exc:
+            self.load_error = str(exc)
+            raise
+        self.load_seconds = time.perf_counter() - start
+        self.load_error = None
+        self.ready = True
+        logging.info("Embedder model loaded in %.2fs", self.load_seconds)
+
+    def _run(self) -> None:
+        batcher = InputBatcher()
+        while True:
+            items = self._collect()
+            if not items:
+                continue
+            try:
+                if self.model is None:
+                    self._load()
+                batch = batcher([image for image, _ in items])
+                with timed("forward"):
+                    embeddings = self.forward(batch)
+            except Exception as exc:
+                logging.exception("Embedding batch of %d failed", len(items))
+                for _, future in items:
+                    future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.images += len(items)
+            if config.metrics.enabled:
+                INFERENCE_BATCH_SIZE.observe(len(items))
+            for (_, future), emb in zip(items, embeddings):
+                future.set_result(emb)
+
+
+# Name of the weights the feature extractor is built from
+MODEL_NAME = "resnet50-imagenet1k-v2"
+
+
+def model_version() -> str:
+    """Version of the embeddings produced with the current configuration."""
+    if config.embedder.version:
+        return config.embedder.version
+    # Exported fp32 backends match the eager model, the quantized one does not
+    return f"{MODEL_NAME}-int8" if config.embedder.backend == "int8" else MODEL_NAME
+
+
+def load_model() -> "Model":
+    """Feature extractor run by the configured inference backend."""
+    import torch
+
+    from app.core.inference import load_backend
+
+    if config.embedder.num_threads > 0:
+        torch.set_num_threads(config.embedder.num_threads)
+    return load_backend(
+        config.embedder.backend,
+        config.embedder.artifact_dir,
+        config.embedder.num_threads,
+    )
+
+
+embedder = BatchingEmbedder(
+    max_batch_size=config.embedder.max_batch_size,
+    max_wait_ms=config.embedder.max_wait_ms,
+    loader=load_model,
+)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, TypeVar
+
+from fastapi import HTTPException
+
+from app.core.config import config
+from app.core.metrics import observe
+
+T = TypeVar("T")
+
+
+class CPUExecutor:
+    """Bounded thread pool for CPU-bound request work.
+
+    PIL decode, pHash and torch release the GIL for most of their work,
+    so a thread pool sized to the cores keeps them parallel without
+    copying images between processes. Requests enter the pipeline through
+    :meth:`slot`, which rejects them with 503 once ``max_in_flight``
+    requests are already inside, instead of letting them queue unbounded
+    and starve cheap endpoints like ``/health``.
+    """
+
+    def __init__(self, max_workers: int, max_in_flight: int) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight
+        self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="cpu")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.started = 0
+        self.rejected = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Admit one request into the pipeline or reject it with 503."""
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, retry later",
+                headers={"Retry-After": "1"},
+            )
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run ``fn(*args)`` on the pool and await its result."""
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def task() -> T:
+            wait = time.perf_counter() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.started += 1
+                self.wait_seconds_total += wait
+                self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            observe("executor_wait", wait)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.completed += 1
+
+        return await asyncio.wrap_future(self._pool.submit(task))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "wait_seconds_avg": self.wait_seconds_total / self.started if self.started else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+cpu_executor = CPUExecutor(
+    max_workers=config.executor.max_workers,
+    max_in_flight=config.executor.max_in_flight,
+)
@@ -0,0 +1,126 @@
+"""Inference backends of the feature extractor.
+
+The embedder calls its model with a ``[N, 3, 224, 224]`` float tensor and
+flattens the output to ``[N, 2048]``. Besides the eager module, the model
+can be a TorchScript or ``torch.compile`` version of it, or an ONNX export
+run by ONNX Runtime, in fp32 or statically quantized to int8. Artifacts of
+the exported backends are produced by ``python -m app.jobs.export_model``.
+"""
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import torch
+import torch.nn.functional as F
+
+from app.core.config import config
+
+Model = Callable[[torch.Tensor], torch.Tensor]
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8")
+
+ARTIFACTS = {
+    "torchscript": "resnet50_features.ts",
+    "onnx": "resnet50_features.onnx",
+    "int8": "resnet50_features.int8.onnx",
+}
+
+WEIGHTS_FILE = "resnet50_imagenet1k_v2.pth"
+
+
+def artifact_path(backend: str, artifact_dir: str) -> Path:
+    return Path(artifact_dir) / ARTIFACTS[backend]
+
+
+def build_feature_extractor(weights_path: str = "", mmap: bool = True) -> torch.nn.Module:
+    """ResNet-50 without its classification head, in eval mode.
+
+    With ``weights_path`` the network is created on the ``meta`` device and
+    its parameters are assigned straight from the checkpoint, skipping the
+    random initialization. ``mmap`` maps the checkpoint instead of reading
+    it: the weights stay in the page cache, shared by all worker processes
+    of the host. Without a path torchvision's ImageNet weights are used,
+    downloaded into ``$TORCH_HOME`` on first use.
+    """
+    import torchvision.models as models
+
+    if weights_path:
+        state = torch.load(weights_path, map_location="cpu", mmap=mmap, weights_only=True)
+        with torch.device("meta"):
+            resnet = models.resnet50()
+        resnet.load_state_dict(state, assign=True)
+    else:
+        resnet = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V2)
+    resnet.eval()
+    return torch.nn.Sequential(*list(resnet.children())[:-1])
+
+
+class OnnxModel:
+    """ONNX export of the feature extractor run by ONNX Runtime on CPU.
+
+    ``InferenceSession.run`` is thread-safe and releases the GIL.
+    """
+
+    def __init__(self, path: Path, num_threads: int = 0) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise RuntimeError("onnx and int8 backends require onnxruntime") from exc
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        (output,) = self.session.run(None, {self.input_name: batch.contiguous().numpy()})
+        return torch.from_numpy(output)
+
+
+def load_backend(
+    backend: str,
+    artifact_dir: str,
+    num_threads: int = 0,
+    model: Optional[torch.nn.Module] = None,
+) -> Model:
+    """Return the feature extractor run by ``backend``.
+
+    The eager ``model`` is built from ``embedder.weights_path`` unless
+    given; exported backends do not need it.
+    """
+    if backend in ("eager", "compile") and model is None:
+        model = build_feature_extractor(config.embedder.weights_path, config.embedder.mmap_weights)
+    if backend == "eager":
+        return model
+    if backend == "compile":
+        # Compiled on the first call, needs a C++ compiler at runtime
+        return torch.compile(model)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported inference backend: {backend}")
+
+    path = artifact_path(backend, artifact_dir)
+    if not path.exists():
+        raise RuntimeError(
+            f"{path} not found, export it with "
+            f"`python -m app.jobs.export_model --backend {backend}`"
+        )
+    if backend == "torchscript":
+        # Stored frozen; the MKLDNN rewrites of optimize_for_inference
+        # cannot be serialized, so they are applied on load
+        return torch.jit.optimize_for_inference(torch.jit.load(str(path)))
+    return OnnxModel(path, num_threads)
+
+
+def compare_outputs(reference: Model, candidate: Model, batch: torch.Tensor) -> Dict[str, float]:
+    """Cosine similarity between embeddings of ``batch`` by two backends."""
+    with torch.inference_mode():
+        expected = reference(batch).flatten(1)
+        actual = candidate(batch).flatten(1)
+    similarity = F.cosine_similarity(expected, actual)
+    return {
+        "min_cosine": similarity.min().item(),
+        "mean_cosine": similarity.mean().item(),
+    }
@@ -0,0 +1,196 @@
+"""Image decode and model input preprocessing.
+
+Images are decoded by :func:`decode_image`, resized and cropped by
+:func:`to_model_input` on the CPU executor, and handed to the embedder as
+``[224, 224, 3]`` uint8 arrays. The embedder converts a whole batch into
+the normalized float input at once with :class:`InputBatcher`. This is the
+torchvision ``Resize(256) -> CenterCrop(224) -> ToTensor -> Normalize``
+chain: the uint8 pixels are identical, the float values equal up to
+rounding.
+"""
+import io
+import threading
+import time
+from typing import IO, TYPE_CHECKING, Any, Dict, Optional, Sequence, Union
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import config
+
+if TYPE_CHECKING:
+    import torch
+
+# Shorter side of the image fed to the center crop
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+
+# ImageNet statistics expected by the feature extractor
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def to_model_input(image: Image.Image) -> np.ndarray:
+    """Resize the shorter side of an RGB image to 256 and center-crop 224.
+
+    Output sizes and crop offsets are computed as by torchvision, and
+    PIL's antialiased bilinear resize is the one torchvision calls.
+    """
+    width, height = image.size
+    if width <= height:
+        size = (RESIZE_SIZE, int(RESIZE_SIZE * height / width))
+    else:
+        size = (int(RESIZE_SIZE * width / height), RESIZE_SIZE)
+    if size != image.size:
+        image = image.resize(size, Image.BILINEAR)
+    left = int(round((size[0] - CROP_SIZE) / 2.0))
+    top = int(round((size[1] - CROP_SIZE) / 2.0))
+    return np.asarray(image.crop((left, top, left + CROP_SIZE, top + CROP_SIZE)))
+
+
+class InputBatcher:
+    """Turns uint8 ``[H, W, 3]`` images into a normalized ``[N, 3, H, W]`` batch.
+
+    Images are copied into a reused uint8 staging buffer, converted to
+    float and transposed to channels-first in one copy, then normalized in
+    place by a single ``addcmul``: ``x * 1 / (255 * std) - mean / std``.
+    Buffers hold the largest batch seen so far, smaller batches use their
+    leading slice. The returned tensor is only valid until the next call,
+    so a batcher belongs to one thread.
+    """
+
+    def __init__(self, size: int = CROP_SIZE) -> None:
+        import torch
+
+        self.size = size
+        std = torch.tensor(STD).view(1, 3, 1, 1)
+        self.scale = 1 / (255 * std)
+        self.shift = -torch.tensor(MEAN).view(1, 3, 1, 1) / std
+        self._staging = np.empty((0, size, size, 3), dtype=np.uint8)
+        self._batch = torch.empty(0, 3, size, size)
+
+    def __call__(self, images: Sequence[np.ndarray]) -> "torch.Tensor":
+        import torch
+
+        count = len(images)
+        if count > len(self._staging):
+            self._staging = np.empty((count, self.size, self.size, 3), dtype=np.uint8)
+            self._batch = torch.empty(count, 3, self.size, self.size)
+        staging, batch = self._staging[:count], self._batch[:count]
+        for i, image in enumerate(images):
+            staging[i] = image
+        batch.copy_(torch.from_numpy(staging).permute(0, 3, 1, 2))
+        return torch.addcmul(self.shift, batch, self.scale, out=batch)
+
+
+def transform(image: Image.Image) -> "torch.Tensor":
+    """Convert an RGB image into a normalized ``[3, 224, 224]`` float tensor.
+
+    For code outside the embedder (export, benchmarks), which feeds the
+    model directly.
+    """
+    return InputBatcher()([to_model_input(image)])[0]
+
+
+class ImageTooLarge(ValueError):
+    """Upload exceeds the byte or pixel budget of the decode stage."""
+
+
+# Raised by PIL for uploads that are not images (UnidentifiedImageError is an
+# OSError), are truncated or corrupt (OSError) or have malformed headers
+# (SyntaxError)
+DECODE_ERRORS = (OSError, SyntaxError)
+
+
+class DecodeStats:
+    """Counters of :func:`decode_image` calls."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.images = 0
+        self.rejected = 0
+        self.reduced = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    def record(self, seconds: float, reduced: bool) -> None:
+        with self._lock:
+            self.images += 1
+            self.reduced += reduced
+            self.seconds_total += seconds
+            self.seconds_max = max(self.seconds_max, seconds)
+
+    def reject(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "images": self.images,
+                "rejected": self.rejected,
+                "reduced": self.reduced,
+                "seconds_avg": self.seconds_total / self.images if self.images else 0.0,
+                "seconds_max": self.seconds_max,
+            }
+
+
+decode_stats = DecodeStats()
+
+
+def _stream_size(fileobj: IO[bytes]) -> Optional[int]:
+    if not fileobj.seekable():
+        return None
+    position = fileobj.tell()
+    size = fileobj.seek(0, io.SEEK_END)
+    fileobj.seek(position)
+    return size - position
+
+
+def decode_image(source: Union[bytes, IO[bytes]]) -> Image.Image:
+    """Decode an upload into an RGB image only as large as the pipeline needs.
+
+    Both the CNN input (shorter side resized to ``RESIZE_SIZE``) and pHash
+    (32x32) are computed from the returned image. JPEGs are decoded in
+    draft mode, where libjpeg scales by 1/2, 1/4 or 1/8 within the DCT, so
+    a 48 MP photo is never materialized at full size. Other formats are
+    decoded fully and reduced by an integer factor right away. Either way
+    the shorter side stays at least ``RESIZE_SIZE``.
+
+    Raises:
+        ImageTooLarge: The upload is over ``decode.max_bytes`` or its
+            header declares more than ``decode.max_pixels`` pixels.
+        OSError, SyntaxError: The upload is not an image or is truncated
+            or corrupt (see ``DECODE_ERRORS``).
+    """
+    start = time.perf_counter()
+    fileobj = io.BytesIO(source) if isinstance(source, bytes) else source
+    size = len(source) if isinstance(source, bytes) else _stream_size(fileobj)
+    if size is not None and size > config.decode.max_bytes:
+        decode_stats.reject()
+        raise ImageTooLarge(f"Image of {size} bytes exceeds the limit of {config.decode.max_bytes}")
+
+    # Only the header is read here. PIL rejects headers of more than twice
+    # Image.MAX_IMAGE_PIXELS pixels by itself, before the check below
+    try:
+        image = Image.open(fileobj)
+    except Image.DecompressionBombError as exc:
+        decode_stats.reject()
+        raise ImageTooLarge(str(exc)) from exc
+    width, height = image.size
+    if width * height > config.decode.max_pixels:
+        decode_stats.reject()
+        raise ImageTooLarge(
+            f"Image of {width}x{height} pixels exceeds the limit of {config.decode.max_pixels}"
+        )
+
+    reduce = config.decode.reduce
+    if reduce and image.format == "JPEG":
+        image.draft("RGB", (RESIZE_SIZE, RESIZE_SIZE))
+    image = image.convert("RGB")
+    factor = min(image.size) // RESIZE_SIZE
+    if reduce and factor >= 2:
+        image = image.reduce(factor)
+
+    decode_stats.record(time.perf_counter() - start, reduced=image.size != (width, height))
+    return image
@@ -1,28 +1,95 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence
+
 import redis.asyncio as aioredis
 from redis.asyncio import Redis
-import logging
+
 from app.core.config import config
 
+
+class RedisStats:
+    """
+    Счётчики команд Redis, выполненных через хелперы AsyncRedisClient.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.errors = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    @contextmanager
+    def measure(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.commands += 1
+                self.seconds_total += elapsed
+                self.seconds_max = max(self.seconds_max, elapsed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "commands": self.commands,
+                "errors": self.errors,
+                "latency_ms_avg": self.seconds_total / self.commands * 1000 if self.commands else 0.0,
+                "latency_ms_max": self.seconds_max * 1000,
+            }
+
+
 class AsyncRedisClient:
-    _client: Redis = None
+    """
+    Общий Redis-клиент процесса.
+
+    Пул соединений создаётся один раз в lifespan приложения (initialize)
+    и закрывается при остановке (close). Значения возвращаются как bytes,
+    чтобы в Redis можно было хранить бинарные данные (эмбеддинги).
+    """
+    _client: Optional[Redis] = None
+    stats = RedisStats()
 
     @classmethod
     async def initialize(cls) -> Redis:
         """
         Инициализирует Redis-клиент, если это еще не сделано.
+        Соединения открываются лениво, при первой команде.
         """
         if cls._client is None:
-            cls._client = await aioredis.from_url(
-                config.celery.CELERY_BROKER_URL,
-                max_connections=30,
-                encoding="utf8",
-                decode_responses=True,
-                socket_connect_timeout=15,
-                socket_timeout=15,
+            cls._client = aioredis.from_url(
+                config.redis.url,
+                max_connections=config.redis.max_connections,
+                socket_connect_timeout=config.redis.socket_connect_timeout,
+                socket_timeout=config.redis.socket_timeout,
+                health_check_interval=config.redis.health_check_interval,
             )
             logging.info("AsyncRedisClient is initialized.")
         return cls._client
 
+    @classmethod
+    def is_initialized(cls) -> bool:
+        return cls._client is not None
+
+    @classmethod
+    async def close(cls) -> None:
+        """
+        Закрывает пул соединений.
+        """
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+            logging.info("AsyncRedisClient is closed.")
+
     @classmethod
     async def get_client(cls) -> Redis:
         """
@@ -30,11 +97,52 @@ class AsyncRedisClient:
         """
         return await cls.initialize()
 
+    @classmethod
+    async def get(cls, key: str) -> Optional[bytes]:
+        client = await cls.get_client()
+        with cls.stats.measure():
+            return await client.get(key)
+
+    @classmethod
+    async def mget(cls, keys: Sequence[str]) -> List[Optional[bytes]]:
+        """
+        Получает значения нескольких ключей одной командой MGET.
+        """
+        if not keys:
+            return []
+        client = await cls.get_client()
+        with cls.stats.measure():
+            return await client.mget(keys)
+
+    @classmethod
+    async def set_many(cls, mapping: Mapping[str, bytes], ex: Optional[int] = None) -> None:
+        """
+        Записывает несколько ключей одним пайплайном (без транзакции).
+        """
+        if not mapping:
+            return
+        client = await cls.get_client()
+        with cls.stats.measure():
+            async with client.pipeline(transaction=False) as pipe:
+                for key, value in mapping.items():
+                    pipe.set(key, value, ex=ex)
+                await pipe.execute()
+
+    @classmethod
+    async def ping(cls) -> float:
+        """
+        Проверяет доступность Redis, возвращает время ответа в секундах.
+        """
+        client = await cls.get_client()
+        start = time.perf_counter()
+        with cls.stats.measure():
+            await client.ping()
+        return time.perf_counter() - start
+
+
 # Функция для использования Redis клиента в FastAPI через Depends
 async def get_redis_client() -> Redis:
     """
     Зависимость для FastAPI: возвращает Redis клиент через Depends.
     """
-    client = await AsyncRedisClient.get_client()
-    logging.info("AsyncRedisClient is being used in a FastAPI request.")
-    return client
+    return await AsyncRedisClient.get_client()
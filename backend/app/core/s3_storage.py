@@ -1,10 +1,148 @@
+import asyncio
+import hashlib
+import hmac
 import os
+import threading
+import time
 import urllib.parse
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 
+from app.core.config import config
+
+# Максимум ключей в одном запросе DeleteObjects
+DELETE_BATCH_SIZE = 1000
+
+# Максимальный срок действия presigned URL с подписью SigV4 (7 дней)
+MAX_PRESIGN_EXPIRATION = 7 * 24 * 3600
+
+T = TypeVar("T")
+
+
+class PresignedUrlCache:
+    """
+    Кэш presigned URL на GET объектов с подписью SigV4, вычисляемой локально.
+
+    generate_presigned_url проходит весь конвейер запроса botocore
+    (около 300 мкс на ссылку). Здесь подпись считается напрямую по
+    алгоритму SigV4: схема, хост и путь бакета берутся из одной ссылки,
+    подписанной botocore, ключ подписи кэшируется на сутки.
+
+    Время подписи выравнивается по окнам длиной refresh секунд, а ссылка
+    действует expiration + refresh секунд от начала окна, то есть не меньше
+    expiration от момента выдачи. Все запросы (и все процессы) в одном окне
+    получают одну и ту же ссылку на объект: она берётся из кэша с ключом
+    (s3_key, окно истечения), а браузер может кэшировать сам файл.
+    """
+
+    probe_key = "__presign_probe__"
+
+    def __init__(self, manager: "S3Manager", refresh: int = 300, max_entries: int = 10000):
+        """
+        :param manager: S3Manager, чьи клиент и учётные данные используются для подписи.
+        :param refresh: Длина окна выравнивания в секундах.
+        :param max_entries: Максимальное число ссылок в кэше (LRU).
+        """
+        self.manager = manager
+        self.refresh = refresh
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._prefix: Optional[str] = None
+        self._signing_key: Tuple[Optional[tuple], bytes] = (None, b"")
+
+    def _url_prefix(self) -> str:
+        # Адрес бакета (virtual-host или path-style) определяет botocore
+        if self._prefix is None:
+            probe = self.manager.s3_client.generate_presigned_url(
+                ClientMethod="get_object",
+                Params={"Bucket": self.manager.bucket_name, "Key": self.probe_key},
+            )
+            self._prefix = probe[:probe.index(self.probe_key)]
+        return self._prefix
+
+    def _key_for(self, secret: str, date: str, region: str) -> bytes:
+        cached, key = self._signing_key
+        if cached != (secret, date, region):
+            key = ("AWS4" + secret).encode()
+            for part in (date, region, "s3", "aws4_request"):
+                key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+            self._signing_key = ((secret, date, region), key)
+        return key
+
+    def sign(self, s3_key: str, signed_at: datetime, expires_in: int) -> str:
+        """
+        Подписать ссылку на объект s3_key, выданную в момент signed_at (UTC)
+        и действующую expires_in секунд.
+        """
+        credentials = self.manager.credentials()
+        region = self.manager.s3_client.meta.region_name
+        amz_date = signed_at.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        scope = f"{date}/{region}/s3/aws4_request"
+
+        url = self._url_prefix() + urllib.parse.quote(s3_key, safe="/~")
+        parsed = urllib.parse.urlsplit(url)
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{credentials.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires_in),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if credentials.token:
+            params["X-Amz-Security-Token"] = credentials.token
+        query = "&".join(
+            f"{urllib.parse.quote(name, safe='-_.~')}={urllib.parse.quote(value, safe='-_.~')}"
+            for name, value in sorted(params.items())
+        )
+        canonical = f"GET\n{parsed.path}\n{query}\nhost:{parsed.netloc}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical.encode()).hexdigest(),
+        ])
+        key = self._key_for(credentials.secret_key, date, region)
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return f"{url}?{query}&X-Amz-Signature={signature}"
+
+    def get_many(self, s3_keys: Sequence[str], expiration: int) -> List[str]:
+        """
+        Ссылки на объекты s3_keys, действующие не меньше expiration секунд.
+        """
+        expiration = min(expiration, MAX_PRESIGN_EXPIRATION - self.refresh)
+        window = int(time.time()) // self.refresh * self.refresh
+        expires_at = window + self.refresh + expiration
+        signed_at = datetime.fromtimestamp(window, timezone.utc)
+        urls = []
+        with self._lock:
+            for s3_key in s3_keys:
+                url = self._items.get((s3_key, expires_at))
+                if url is None:
+                    self.misses += 1
+                    url = self.sign(s3_key, signed_at, expires_at - window)
+                    self._items[(s3_key, expires_at)] = url
+                    if len(self._items) > self.max_entries:
+                        self._items.popitem(last=False)
+                else:
+                    self.hits += 1
+                    self._items.move_to_end((s3_key, expires_at))
+                urls.append(url)
+        return urls
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._items)}
+
 
 class S3Manager:
     """
@@ -21,6 +159,13 @@ class S3Manager:
         endpoint_url: Optional[str] = None,
         default_acl: str = "private",
         expiration: int = 3600,
+        max_pool_connections: int = 10,
+        connect_timeout: float = 60,
+        read_timeout: float = 60,
+        max_attempts: int = 3,
+        transfer_config: Optional[TransferConfig] = None,
+        url_refresh: int = 300,
+        url_cache_size: int = 10000,
     ):
         """
         :param bucket_name: Название S3-бакета.
@@ -31,77 +176,90 @@ class S3Manager:
         :param endpoint_url: Необязательный кастомный endpoint (например, для S3-совместимых сервисов).
         :param default_acl: ACL (права доступа) по умолчанию при загрузке, например "private" или "public-read".
         :param expiration: Время жизни генерируемых ссылок (presigned URLs) в секундах.
+        :param max_pool_connections: Размер пула HTTP-соединений клиента, общего для всех потоков.
+        :param connect_timeout: Таймаут установки соединения в секундах.
+        :param read_timeout: Таймаут чтения ответа в секундах.
+        :param max_attempts: Число попыток запроса (режим повторов "standard").
+        :param transfer_config: Параметры многопоточных upload_file/upload_fileobj/download_file.
+        :param url_refresh: Окно, в течение которого для объекта выдаётся одна и та же ссылка, в секундах.
+        :param url_cache_size: Число ссылок в кэше PresignedUrlCache.
         """
         self.bucket_name = bucket_name
         self.region_name = region_name
         self.default_acl = default_acl
         self.expiration = expiration
+        self.max_pool_connections = max_pool_connections
+        self.transfer_config = transfer_config or TransferConfig()
 
-        session = boto3.Session(
+        self.session = session = boto3.Session(
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
             aws_session_token=aws_session_token,
             region_name=region_name
         )
 
+        # Один клиент на менеджер: он потокобезопасен, а пул соединений
+        # должен быть не меньше числа потоков, которые к нему обращаются
         self.s3_client = session.client(
             "s3",
             endpoint_url=endpoint_url,
-            config=Config(signature_version="s3v4")
-        )
-        self.s3_resource = session.resource(
-            "s3",
-            endpoint_url=endpoint_url,
-            config=Config(signature_version="s3v4")
+            config=Config(
+                signature_version="s3v4",
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                retries={"mode": "standard", "max_attempts": max_attempts},
+                tcp_keepalive=True,
+            )
         )
-        self.bucket = self.s3_resource.Bucket(bucket_name)
+        self.url_cache = PresignedUrlCache(self, url_refresh, url_cache_size)
 
-    def upload_file(self, file_path: str, s3_key: str) -> str:
+    def upload_file(self, file_path: str, s3_key: str, presign: bool = True) -> str:
         """
         Загрузить локальный файл file_path в S3 с ключом s3_key.
-        Возвращает публичную (или presigned) ссылку на загруженный объект.
+        Большие файлы загружаются частями в несколько потоков (см. transfer_config).
         
         :param file_path: Путь к локальному файлу.
         :param s3_key: Ключ в S3 (например, 'folder/myfile.jpg').
-        :return: Ссылка (presigned URL), по которой можно скачать файл.
+        :param presign: Вернуть presigned URL; иначе возвращается сам s3_key.
+        :return: Ссылка (presigned URL), по которой можно скачать файл, или ключ.
         """
         # Загружаем файл в S3
         self.s3_client.upload_file(
             Filename=file_path,
             Bucket=self.bucket_name,
             Key=s3_key,
-            ExtraArgs={"ACL": self.default_acl}
+            ExtraArgs={"ACL": self.default_acl},
+            Config=self.transfer_config,
         )
+        return self.get_presigned_url(s3_key) if presign else s3_key
 
-        # Генерируем временную ссылку на скачивание
-        presigned_url = self.s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": self.bucket_name, "Key": s3_key},
-            ExpiresIn=self.expiration
-        )
-        return presigned_url
-
-    def upload_fileobj(self, fileobj, s3_key: str) -> str:
+    def upload_fileobj(self, fileobj, s3_key: str, presign: bool = True) -> str:
         """
         Загрузить file-like объект (например, BytesIO) прямо в S3.
-        Возвращает presigned URL.
         
         :param fileobj: Открытый файловый объект (например, UploadFile.file в FastAPI).
         :param s3_key: Ключ в S3.
-        :return: Presigned URL.
+        :param presign: Вернуть presigned URL; иначе возвращается сам s3_key.
+        :return: Presigned URL или ключ.
         """
         self.s3_client.upload_fileobj(
             Fileobj=fileobj,
             Bucket=self.bucket_name,
             Key=s3_key,
-            ExtraArgs={"ACL": self.default_acl}
+            ExtraArgs={"ACL": self.default_acl},
+            Config=self.transfer_config,
         )
-        presigned_url = self.s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": self.bucket_name, "Key": s3_key},
-            ExpiresIn=self.expiration
-        )
-        return presigned_url
+        return self.get_presigned_url(s3_key) if presign else s3_key
+
+    def multipart_upload(self, s3_key: str) -> "S3MultipartUpload":
+        """
+        Начать потоковую загрузку объекта с ключом s3_key по частям.
+
+        :param s3_key: Ключ в S3.
+        :return: Объект S3MultipartUpload.
+        """
+        return S3MultipartUpload(self, s3_key)
 
     def get_presigned_url(self, s3_key: str, expiration: Optional[int] = None) -> str:
         """
@@ -110,15 +268,29 @@ class S3Manager:
         :param expiration: Время жизни ссылки в секундах (если не задано, берём self.expiration).
         :return: Presigned URL.
         """
+        return self.presign_urls([s3_key], expiration)[0]
+
+    def presign_urls(self, s3_keys: Sequence[str], expiration: Optional[int] = None) -> List[str]:
+        """
+        Получить presigned URL сразу для нескольких объектов (например, для списка совпадений).
+        Ссылки берутся из url_cache и действуют не меньше expiration секунд.
+
+        :param s3_keys: Ключи объектов.
+        :param expiration: Минимальное время жизни ссылок в секундах (по умолчанию self.expiration).
+        :return: Presigned URL в порядке ключей.
+        """
         if expiration is None:
             expiration = self.expiration
+        return self.url_cache.get_many(s3_keys, expiration)
 
-        presigned_url = self.s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": self.bucket_name, "Key": s3_key},
-            ExpiresIn=expiration
-        )
-        return presigned_url
+    def credentials(self):
+        """
+        Текущие учётные данные сессии (обновляются, если они временные).
+        """
+        credentials = self.session.get_credentials()
+        if credentials is None:
+            raise RuntimeError("No AWS credentials found for S3 URL signing")
+        return credentials.get_frozen_credentials()
 
     def get_filename_from_url(self, url: str) -> str:
         """
@@ -149,6 +321,31 @@ class S3Manager:
 
         return path
 
+    def read_object(self, s3_key: str) -> bytes:
+        """
+        Прочитать объект S3 целиком в память.
+
+        :param s3_key: Ключ объекта в бакете.
+        :return: Содержимое объекта.
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+        with response["Body"] as body:
+            return body.read()
+
+    def read_objects(self, s3_keys: Sequence[str], max_workers: Optional[int] = None) -> List[bytes]:
+        """
+        Прочитать несколько объектов параллельно, в порядке ключей.
+
+        :param s3_keys: Ключи объектов.
+        :param max_workers: Число потоков (по умолчанию max_pool_connections).
+        :return: Содержимое объектов.
+        """
+        if len(s3_keys) <= 1:
+            return [self.read_object(s3_key) for s3_key in s3_keys]
+        workers = min(len(s3_keys), max_workers or self.max_pool_connections)
+        with ThreadPoolExecutor(workers, thread_name_prefix="s3-read") as pool:
+            return list(pool.map(self.read_object, s3_keys))
+
     def download_file(self, url: str, local_path: str) -> None:
         """
         Скачать файл из S3 (presigned или обычная ссылка) в локальный путь local_path.
@@ -160,7 +357,8 @@ class S3Manager:
         self.s3_client.download_file(
             Bucket=self.bucket_name,
             Key=s3_key,
-            Filename=local_path
+            Filename=local_path,
+            Config=self.transfer_config,
         )
 
     def delete_file(self, url: str) -> None:
@@ -174,3 +372,237 @@ class S3Manager:
             Bucket=self.bucket_name,
             Key=s3_key
         )
+
+
+    def delete_objects(self, s3_keys: Sequence[str]) -> List[str]:
+        """
+        Удалить несколько объектов запросами DeleteObjects, по 1000 ключей в каждом.
+
+        :param s3_keys: Ключи объектов.
+        :return: Ключи, которые удалить не удалось.
+        """
+        failed = []
+        for start in range(0, len(s3_keys), DELETE_BATCH_SIZE):
+            batch = s3_keys[start:start + DELETE_BATCH_SIZE]
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": s3_key} for s3_key in batch], "Quiet": True},
+            )
+            failed.extend(error["Key"] for error in response.get("Errors", []))
+        return failed
+
+class S3MultipartUpload:
+    """
+    Загрузка объекта в S3 частями, по мере поступления данных.
+    Multipart upload создаётся только при первой части; если все данные
+    уместились в одну часть, объект записывается одним put_object.
+    Все части, кроме последней, должны быть не меньше 5 МиБ.
+    Методы блокирующие.
+    """
+
+    def __init__(self, manager: S3Manager, s3_key: str):
+        """
+        :param manager: S3Manager, через клиент которого идёт загрузка.
+        :param s3_key: Ключ в S3.
+        """
+        self.manager = manager
+        self.s3_key = s3_key
+        self.upload_id: Optional[str] = None
+        self.parts: List[dict] = []
+
+    def upload_part(self, data: bytes) -> None:
+        """
+        Загрузить очередную (не последнюю) часть объекта.
+
+        :param data: Содержимое части.
+        """
+        client = self.manager.s3_client
+        if self.upload_id is None:
+            response = client.create_multipart_upload(
+                Bucket=self.manager.bucket_name,
+                Key=self.s3_key,
+                ACL=self.manager.default_acl,
+            )
+            self.upload_id = response["UploadId"]
+        number = len(self.parts) + 1
+        response = client.upload_part(
+            Bucket=self.manager.bucket_name,
+            Key=self.s3_key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def complete(self, data: bytes = b"") -> str:
+        """
+        Загрузить последнюю часть и завершить загрузку.
+
+        :param data: Содержимое последней части (может быть пустым).
+        :return: Ключ загруженного объекта.
+        """
+        client = self.manager.s3_client
+        if self.upload_id is None:
+            client.put_object(
+                Bucket=self.manager.bucket_name,
+                Key=self.s3_key,
+                Body=data,
+                ACL=self.manager.default_acl,
+            )
+            return self.s3_key
+        if data:
+            self.upload_part(data)
+        client.complete_multipart_upload(
+            Bucket=self.manager.bucket_name,
+            Key=self.s3_key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        return self.s3_key
+
+    def abort(self) -> None:
+        """
+        Отменить загрузку: уже загруженные части удаляются из бакета.
+        """
+        if self.upload_id is not None:
+            self.manager.s3_client.abort_multipart_upload(
+                Bucket=self.manager.bucket_name,
+                Key=self.s3_key,
+                UploadId=self.upload_id,
+            )
+            self.upload_id = None
+
+
+class AsyncS3Manager:
+    """
+    Асинхронная обёртка над S3Manager для кода в event loop.
+    Вызовы boto3 выполняются в собственном пуле потоков размером с пул
+    соединений клиента: запросы к S3 не занимают общий пул
+    run_in_threadpool и не ждут свободного соединения.
+    """
+
+    def __init__(self, manager: S3Manager, max_workers: Optional[int] = None):
+        """
+        :param manager: S3Manager, через клиент которого идут запросы.
+        :param max_workers: Размер пула потоков (по умолчанию max_pool_connections менеджера).
+        """
+        self.manager = manager
+        self._pool = ThreadPoolExecutor(
+            max_workers or manager.max_pool_connections, thread_name_prefix="s3"
+        )
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Выполнить блокирующий вызов fn(*args) в пуле S3.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def read_object(self, s3_key: str) -> bytes:
+        return await self.run(self.manager.read_object, s3_key)
+
+    async def read_objects(self, s3_keys: Sequence[str]) -> List[bytes]:
+        """
+        Прочитать несколько объектов параллельно, в порядке ключей.
+        Одновременно выполняется не больше запросов, чем потоков в пуле.
+        """
+        return list(await asyncio.gather(*[self.read_object(s3_key) for s3_key in s3_keys]))
+
+    async def upload_fileobj(self, fileobj, s3_key: str, presign: bool = True) -> str:
+        return await self.run(self.manager.upload_fileobj, fileobj, s3_key, presign)
+
+    async def delete_objects(self, s3_keys: Sequence[str]) -> List[str]:
+        """
+        Удалить несколько объектов; запросы по 1000 ключей идут параллельно.
+
+        :return: Ключи, которые удалить не удалось.
+        """
+        batches = [
+            s3_keys[start:start + DELETE_BATCH_SIZE]
+            for start in range(0, len(s3_keys), DELETE_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(*[
+            self.run(self.manager.delete_objects, batch) for batch in batches
+        ])
+        return [s3_key for failed in results for s3_key in failed]
+
+    async def get_presigned_url(self, s3_key: str, expiration: Optional[int] = None) -> str:
+        return (await self.presign_urls([s3_key], expiration))[0]
+
+    async def presign_urls(self, s3_keys: Sequence[str], expiration: Optional[int] = None) -> List[str]:
+        # Подпись считается локально, но получение учётных данных может идти в сеть
+        return await self.run(self.manager.presign_urls, s3_keys, expiration)
+
+    def multipart_upload(self, s3_key: str) -> "AsyncS3MultipartUpload":
+        return AsyncS3MultipartUpload(self, self.manager.multipart_upload(s3_key))
+
+    def close(self) -> None:
+        """
+        Остановить пул потоков, дождавшись начатых запросов.
+        """
+        self._pool.shutdown(wait=True)
+
+
+class AsyncS3MultipartUpload:
+    """
+    S3MultipartUpload, методы которого выполняются в пуле AsyncS3Manager.
+    """
+
+    def __init__(self, storage: AsyncS3Manager, upload: S3MultipartUpload):
+        self.storage = storage
+        self.upload = upload
+        self.s3_key = upload.s3_key
+
+    async def upload_part(self, data: bytes) -> None:
+        await self.storage.run(self.upload.upload_part, data)
+
+    async def complete(self, data: bytes = b"") -> str:
+        return await self.storage.run(self.upload.complete, data)
+
+    async def abort(self) -> None:
+        await self.storage.run(self.upload.abort)
+
+
+@lru_cache(maxsize=None)
+def get_s3_manager() -> S3Manager:
+    """
+    Общий S3Manager процесса, настроенный по config.s3.
+    boto3-клиент потокобезопасен, поэтому его можно использовать из любых потоков.
+    """
+    if not config.s3.bucket:
+        raise RuntimeError("S3 storage is not configured (MYAPI_S3__BUCKET is empty)")
+    return S3Manager(
+        bucket_name=config.s3.bucket,
+        region_name=config.s3.region,
+        aws_access_key_id=config.s3.access_key_id,
+        aws_secret_access_key=config.s3.secret_access_key,
+        endpoint_url=config.s3.endpoint_url,
+        expiration=config.s3.url_expiration,
+        max_pool_connections=config.s3.max_pool_connections,
+        connect_timeout=config.s3.connect_timeout,
+        read_timeout=config.s3.read_timeout,
+        max_attempts=config.s3.max_attempts,
+        url_refresh=config.s3.url_refresh,
+        url_cache_size=config.s3.url_cache_size,
+        transfer_config=TransferConfig(
+            multipart_threshold=config.s3.part_size,
+            multipart_chunksize=config.s3.part_size,
+            max_concurrency=config.s3.transfer_concurrency,
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_async_s3_manager() -> AsyncS3Manager:
+    """
+    Общий AsyncS3Manager процесса поверх get_s3_manager().
+    """
+    return AsyncS3Manager(get_s3_manager())
+
+
+def close_s3() -> None:
+    """
+    Остановить пул потоков общего AsyncS3Manager, если он создавался.
+    """
+    if get_async_s3_manager.cache_info().currsize:
+        get_async_s3_manager().close()
+        get_async_s3_manager.cache_clear()
@@ -1,15 +1,18 @@
+from contextlib import asynccontextmanager
 from typing import Iterator
 
-from sqlalchemy import create_engine
+from pgvector.asyncpg import register_vector
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import (
     Session,
     sessionmaker,
 )
-from typing import AsyncGenerator
-from sqlalchemy import AsyncAdaptedQueuePool
+from typing import AsyncGenerator, AsyncIterator
+from sqlalchemy import AsyncAdaptedQueuePool, NullPool
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.core.config import config
+from app.core.metrics import timed
 
 sengine = create_engine(config.database.dsn)
 # create session factory to generate new database sessions
@@ -38,3 +41,80 @@ def create_session() -> Iterator[Session]:
         raise
     finally:
         session.close()
+
+
+aengine = create_async_engine(
+    config.database.async_dsn,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=config.database.pool_size,
+    max_overflow=config.database.max_overflow,
+    pool_timeout=config.database.pool_timeout,
+    pool_recycle=config.database.pool_recycle,
+    pool_pre_ping=config.database.pool_pre_ping,
+)
+
+
+@event.listens_for(aengine.sync_engine, "connect")
+def register_vector_types(dbapi_connection, connection_record):
+    dbapi_connection.run_async(register_vector)
+
+
+AsyncSessionFactory = async_sessionmaker(
+    bind=aengine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+async def create_async_session() -> AsyncGenerator[AsyncSession, None]:
+    """Create new async database session.
+
+    Yields:
+        Async database session.
+    """
+
+    session = AsyncSessionFactory()
+
+    try:
+        yield session
+        with timed("commit"):
+            await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+# Context manager version of ``create_async_session``, used where a session
+# must outlive the request handler, e.g. inside a streaming response body
+async_session_scope = asynccontextmanager(create_async_session)
+
+
+# Celery tasks and jobs run every call in a new event loop (``asyncio.run``),
+# while pooled asyncpg connections are bound to the loop that opened them.
+# Their engine therefore opens a fresh connection per session.
+task_engine = create_async_engine(config.database.async_dsn, poolclass=NullPool)
+event.listen(task_engine.sync_engine, "connect", register_vector_types)
+
+TaskSessionFactory = async_sessionmaker(
+    bind=task_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+@asynccontextmanager
+async def task_session_scope() -> AsyncIterator[AsyncSession]:
+    """Async database session for code running outside the API event loop."""
+
+    session = TaskSessionFactory()
+
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -0,0 +1,191 @@
+"""Single-pass reading of multipart image uploads.
+
+``UploadFile`` parameters make FastAPI parse the whole form before the
+endpoint runs, spooling the file to disk, after which it is read again
+to decode and a third time by boto3 to stage it to S3. :func:`receive_upload`
+parses the request body as it arrives instead: every chunk of the file
+field goes into an incremental :func:`~app.core.cache.content_hasher`,
+into the buffer kept for decoding (if any) and into an S3 multipart
+upload (if any), so a staged upload holds at most one part in memory.
+Uploads over ``decode.max_bytes`` are rejected with 413, from
+``Content-Length`` before the body is read when the client sends it.
+"""
+import asyncio
+import io
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.core.cache import content_hasher
+from app.core.config import config
+from app.core.s3_storage import AsyncS3MultipartUpload
+
+# Room for the multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+@dataclass
+class Upload:
+    """The file field of a request, as read by :func:`receive_upload`."""
+
+    filename: str
+    size: int
+    key: str
+    data: Optional[bytes] = None
+    s3_key: Optional[str] = None
+
+
+def check_content_length(request: Request, limit: int) -> None:
+    """Reject a request whose declared body size is over ``limit`` with 413."""
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > limit:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request body of {length} bytes exceeds the limit of {limit}",
+        )
+
+
+class _FieldReader:
+    """Collects one field of a multipart body from ``MultipartParser`` callbacks.
+
+    The parser only calls back from ``write``; the data received for the
+    field is left in ``pieces`` for the caller to take after each call.
+    """
+
+    def __init__(self, field: str) -> None:
+        self.field = field.encode()
+        self.header_field = b""
+        self.header_value = b""
+        self.headers = {}
+        self.in_field = False
+        self.found = False
+        self.filename = ""
+        self.pieces: List[bytes] = []
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        # Only the first part of the field is read
+        self.in_field = options.get(b"name") == self.field and not self.found
+        if self.in_field:
+            self.found = True
+            self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_field:
+            self.pieces.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        self.in_field = False
+
+
+async def receive_upload(
+    request: Request,
+    field: str = "file",
+    keep: bool = True,
+    stage: Optional[Callable[[str], AsyncS3MultipartUpload]] = None,
+) -> Upload:
+    """Read the file ``field`` of a multipart request body in one pass.
+
+    Args:
+        request: Request with a ``multipart/form-data`` body.
+        field: Name of the file field, other fields are skipped.
+        keep: Return the content in ``Upload.data``, for decoding.
+        stage: Called with the file name once the part headers are read,
+            returns the multipart upload the content is streamed to.
+            ``config.s3.part_size`` bytes are buffered per part.
+
+    Raises:
+        HTTPException: 413 if the file is over ``decode.max_bytes``,
+            422 if the body is not multipart or has no such field,
+            400 if it is malformed.
+            The staged upload, if any, is aborted, as it is when the
+            request is cancelled.
+    """
+    limit = config.decode.max_bytes
+    check_content_length(request, limit + MULTIPART_OVERHEAD)
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=422, detail="Expected a multipart/form-data body")
+
+    reader = _FieldReader(field)
+    parser = MultipartParser(options[b"boundary"], reader.callbacks())
+    hasher = content_hasher()
+    # Grown in place and returned without a copy by ``getvalue``
+    buffer = io.BytesIO()
+    part = bytearray()
+    size = 0
+    upload = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if reader.found and stage is not None and upload is None:
+                upload = stage(reader.filename)
+            pieces, reader.pieces = reader.pieces, []
+            for piece in pieces:
+                size += len(piece)
+                if size > limit:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Image of more than {limit} bytes exceeds the limit",
+                    )
+                hasher.update(piece)
+                if keep:
+                    buffer.write(piece)
+                if upload is not None:
+                    part += piece
+            if upload is not None and len(part) >= config.s3.part_size:
+                # Not reading the body meanwhile throttles the client to S3's
+                # pace; botocore sends the bytearray as is, without a copy
+                await upload.upload_part(part)
+                part.clear()
+        parser.finalize()
+        if not reader.found:
+            raise HTTPException(status_code=422, detail=f"Field '{field}' is required")
+        s3_key = None
+        if upload is not None:
+            s3_key = await upload.complete(part)
+    except BaseException as exc:
+        # Also on a client disconnect or cancellation, which raise
+        # CancelledError; shielded so that the parts are deleted even if
+        # the task is cancelled again meanwhile
+        if upload is not None:
+            await asyncio.shield(upload.abort())
+        if isinstance(exc, MultipartParseError):
+            raise HTTPException(status_code=400, detail=f"Malformed multipart body: {exc}")
+        raise
+
+    return Upload(
+        filename=reader.filename,
+        size=size,
+        key=hasher.hexdigest(),
+        data=buffer.getvalue() if keep else None,
+        s3_key=s3_key,
+    )
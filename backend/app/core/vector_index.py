@@ -0,0 +1,164 @@
+"""In-process exact vector search over the embeddings of one profile.
+
+:class:`ProfileIndex` keeps L2-normalized embeddings as one contiguous
+``float32`` or ``float16`` matrix, in anonymous memory or memory-mapped
+from an unlinked scratch file, and answers top-k by cosine similarity
+with a single matrix product and ``argpartition``, for one query or a
+batch of them. Unlike the HNSW and IVFFlat scans of pgvector the search
+is exact.
+
+Rows are appended into spare capacity, which doubles when full, and
+removals copy the surviving rows into a new matrix. Either way a search
+running in another thread keeps reading the consistent snapshot it
+started with, so only writers take the lock.
+"""
+import tempfile
+import threading
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+# float16 rows are widened to float32 in blocks of this many before the
+# product, NumPy has no BLAS kernel for half precision
+BLOCK_ROWS = 16384
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows (or a single vector) to unit length, zero vectors stay zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.float32(1e-12))
+
+
+class Snapshot(NamedTuple):
+    vectors: np.ndarray
+    ids: np.ndarray
+    current: np.ndarray
+
+
+class ProfileIndex:
+    """Normalized embeddings of a profile with their image ids.
+
+    ``current`` flags the rows embedded by the current model version, so
+    that re-embedded images can be told apart by the sync. ``max_id`` is
+    the highest id ever appended, the cursor of incremental syncs.
+    """
+
+    def __init__(self, dim: int, dtype: str = "float32", directory: str = "", capacity: int = 1024) -> None:
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.directory = directory
+        self.max_id = 0
+        self.synced_at = 0.0
+        self._lock = threading.Lock()
+        self._vectors = self._allocate(capacity)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._current = np.zeros(capacity, dtype=bool)
+        self._publish(0)
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        shape = (capacity, self.dim)
+        if not self.directory:
+            return np.empty(shape, dtype=self.dtype)
+        # The mapping outlives the unlinked file, which is freed with it;
+        # its pages can be written back and dropped under memory pressure
+        with tempfile.TemporaryFile(dir=self.directory) as fp:
+            return np.memmap(fp, dtype=self.dtype, mode="w+", shape=shape)
+
+    def _publish(self, size: int) -> None:
+        self._snapshot = Snapshot(self._vectors[:size], self._ids[:size], self._current[:size])
+
+    @property
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    @property
+    def size(self) -> int:
+        return len(self._snapshot.ids)
+
+    @property
+    def current_count(self) -> int:
+        return int(np.count_nonzero(self._snapshot.current))
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors.nbytes + self._ids.nbytes + self._current.nbytes
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray, current: np.ndarray) -> None:
+        """Add rows, normalizing ``vectors`` (``[n, dim]``)."""
+        if not len(ids):
+            return
+        vectors = normalize(vectors)
+        with self._lock:
+            size = self.size
+            end = size + len(ids)
+            if end > len(self._ids):
+                self._grow(max(end, 2 * len(self._ids)))
+            self._vectors[size:end] = vectors
+            self._ids[size:end] = ids
+            self._current[size:end] = current
+            self.max_id = max(self.max_id, int(np.max(ids)))
+            self._publish(end)
+
+    def _grow(self, capacity: int) -> None:
+        size = self.size
+        vectors = self._allocate(capacity)
+        vectors[:size] = self._vectors[:size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:size] = self._ids[:size]
+        current = np.zeros(capacity, dtype=bool)
+        current[:size] = self._current[:size]
+        self._vectors, self._ids, self._current = vectors, ids, current
+
+    def remove(self, ids: np.ndarray) -> int:
+        """Drop the rows of ``ids``, return the number removed."""
+        with self._lock:
+            snapshot = self._snapshot
+            keep = ~np.isin(snapshot.ids, ids)
+            size = int(np.count_nonzero(keep))
+            if size == len(keep):
+                return 0
+            capacity = len(self._ids)
+            vectors = self._allocate(capacity)
+            np.compress(keep, snapshot.vectors, axis=0, out=vectors[:size])
+            self._ids = np.zeros(capacity, dtype=np.int64)
+            np.compress(keep, snapshot.ids, out=self._ids[:size])
+            self._current = np.zeros(capacity, dtype=bool)
+            np.compress(keep, snapshot.current, out=self._current[:size])
+            self._vectors = vectors
+            self._publish(size)
+            return len(keep) - size
+
+    def search(self, query: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and cosine similarities of the ``limit`` nearest rows, nearest first."""
+        return self.search_many(query[None, :], limit)[0]
+
+    def search_many(self, queries: np.ndarray, limit: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """:meth:`search` for every row of ``queries`` (``[m, dim]``).
+
+        All queries are scored in one matrix product, so the rows are read
+        (and widened, for float16) once per batch rather than per query.
+        """
+        vectors, ids, _ = self._snapshot
+        if not len(ids) or limit <= 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))] * len(queries)
+        queries = normalize(queries)
+        if vectors.dtype == np.float32:
+            scores = vectors @ queries.T
+        else:
+            scores = np.empty((len(ids), len(queries)), dtype=np.float32)
+            for start in range(0, len(ids), BLOCK_ROWS):
+                block = vectors[start:start + BLOCK_ROWS].astype(np.float32)
+                np.matmul(block, queries.T, out=scores[start:start + len(block)])
+        results = []
+        for column in scores.T:
+            if limit < len(ids):
+                top = np.argpartition(-column, limit - 1)[:limit]
+            else:
+                top = np.arange(len(ids))
+            top = top[np.lexsort((ids[top], -column[top]))]
+            results.append((ids[top], column[top]))
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rows": self.size, "bytes": self.nbytes, "max_id": self.max_id}
@@ -0,0 +1,465 @@
+"""Group near-duplicate images of a profile into ``duplicate_groups``.
+
+Two images are duplicates if their pHashes differ by at most
+``search.phash_max_distance`` bits or their embeddings are at least
+``cluster.threshold`` similar; groups are the connected components of
+that relation, formed with union-find and identified by their smallest
+image id.
+
+A rebuild (the first run, ``--rebuild``, or a run with another threshold,
+pHash distance or model version than the stored groups) reads the
+profile in two keyset-paginated passes:
+
+1. ids and pHashes. Images with the same pHash band are compared
+   exactly, block by block, and pHash duplicates are joined; each pHash
+   group is then represented by its first image only.
+2. Embeddings of the representatives, L2-normalized into a matrix
+   memory-mapped from a scratch file (``cluster.scratch_dir``). Its upper
+   triangle of similarities is computed in ``cluster.block_rows`` square
+   blocks and every pair above the threshold is joined.
+
+Only the ids, pHashes and union-find arrays (about 40 bytes per image)
+and two blocks are held in memory, the embeddings stay on disk. The
+product is exact and quadratic in the number of representatives;
+``--method index`` instead searches the nearest ``cluster.neighbors``
+of every image through the search backend, as updates do.
+
+Later runs update the groups incrementally: images stored after the last
+run are searched for pHash duplicates, those without one for embedding
+duplicates, and their groups are joined with the groups of the matches::
+
+    python -m app.jobs.cluster --profile shop
+    python -m app.jobs.cluster --all --rebuild --threshold 0.97
+
+Rows of deleted images are pruned by updates, but a group held together
+by a deleted image only splits on the next rebuild. With
+``cluster.on_load`` updates are also queued as Celery tasks after loads.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.const import EMBEDDING_DIM, PHASH_BANDS
+from app.core.config import config
+from app.core.embeder import model_version
+from app.core.executor import cpu_executor
+from app.core.session import task_session_scope
+from app.core.vector_index import normalize
+from app.services.duplicates import DuplicateGroupDataManager
+from app.services.images import PHASH_BAND_BITS, ImageDataManager, ProfileDataManager
+
+# Rows of one page of ids, pHashes or embeddings
+PAGE_ROWS = 10_000
+
+
+class UnionFind:
+    """Disjoint sets of ``0..size-1`` joined by arrays of pairs.
+
+    Every set is rooted at its smallest element (``parent[i] <= i``), so
+    roots do not depend on the order of the joins.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, items: np.ndarray) -> np.ndarray:
+        roots = self.parent[items]
+        while True:
+            parents = self.parent[roots]
+            if np.array_equal(parents, roots):
+                # Path compression of the looked up elements only
+                self.parent[items] = roots
+                return roots
+            roots = parents
+
+    def union(self, a: np.ndarray, b: np.ndarray) -> None:
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        while len(a):
+            roots_a, roots_b = self.find(a), self.find(b)
+            apart = roots_a != roots_b
+            a, b = a[apart], b[apart]
+            roots_a, roots_b = roots_a[apart], roots_b[apart]
+            # The larger root of every pair stops being one, so this ends
+            np.minimum.at(self.parent, np.maximum(roots_a, roots_b), np.minimum(roots_a, roots_b))
+
+    def compress(self) -> None:
+        while True:
+            parents = self.parent[self.parent]
+            if np.array_equal(parents, self.parent):
+                return
+            self.parent = parents
+
+    def roots(self) -> np.ndarray:
+        """Root of every element."""
+        self.compress()
+        return self.parent
+
+
+class GroupUnion:
+    """Union-find over sparse image ids, rooted at the smallest id like :class:`UnionFind`."""
+
+    def __init__(self) -> None:
+        self.parent: Dict[int, int] = {}
+
+    def find(self, item: int) -> int:
+        parent = self.parent.setdefault(item, item)
+        while parent != item:
+            grandparent = self.parent[parent]
+            self.parent[item] = grandparent
+            item, parent = parent, grandparent
+        return item
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _band_runs(phashes: np.ndarray, band: int) -> Iterator[np.ndarray]:
+    """Positions of ``phashes`` sharing the ``band``-th band, one array per value."""
+    shift = np.uint64(64 - PHASH_BAND_BITS * (band + 1))
+    keys = (phashes >> shift) & np.uint64((1 << PHASH_BAND_BITS) - 1)
+    order = np.argsort(keys, kind="stable")
+    bounds = np.flatnonzero(np.diff(keys[order])) + 1
+    for run in np.split(order, bounds):
+        if len(run) > 1:
+            yield run
+
+
+def phash_pairs(phashes: np.ndarray, max_distance: int, block_rows: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Pairs of positions of distinct ``phashes`` within ``max_distance`` bits.
+
+    Hashes within fewer bits than there are bands share a band, as the
+    band indexes of the search rely on, so only hashes of the same band
+    value are compared. Pairs sharing several bands repeat.
+    """
+    if max_distance >= PHASH_BANDS:
+        logging.warning(
+            "pHash distance %d is not below %d bands, some pHash duplicates are missed",
+            max_distance, PHASH_BANDS,
+        )
+    for band in range(PHASH_BANDS):
+        for run in _band_runs(phashes, band):
+            for start in range(0, len(run), block_rows):
+                rows = run[start:start + block_rows]
+                for other in range(start, len(run), block_rows):
+                    cols = run[other:other + block_rows]
+                    close = np.bitwise_count(phashes[rows, None] ^ phashes[None, cols]) <= max_distance
+                    if other == start:
+                        close = np.triu(close, k=1)
+                    i, j = np.nonzero(close)
+                    if len(i):
+                        yield rows[i], cols[j]
+
+
+def similar_pairs(vectors: np.ndarray, threshold: float, block_rows: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Pairs of rows of normalized ``vectors`` at least ``threshold`` similar.
+
+    The upper triangle of ``vectors @ vectors.T`` is computed in square
+    blocks; half precision rows are widened block by block.
+    """
+    count = len(vectors)
+    for start in range(0, count, block_rows):
+        rows = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        for other in range(start, count, block_rows):
+            cols = rows if other == start else np.asarray(vectors[other:other + block_rows], dtype=np.float32)
+            similar = rows @ cols.T >= threshold
+            if other == start:
+                similar = np.triu(similar, k=1)
+            i, j = np.nonzero(similar)
+            if len(i):
+                yield i + start, j + other
+
+
+def scratch_matrix(rows: int, dim: int, dtype: str, directory: str) -> np.ndarray:
+    """Zeroed matrix memory-mapped from an unlinked scratch file."""
+    with tempfile.TemporaryFile(dir=directory or None) as fp:
+        return np.memmap(fp, dtype=dtype, mode="w+", shape=(max(rows, 1), dim))
+
+
+def join_phashes(union: UnionFind, phashes: np.ndarray, hashed: np.ndarray, max_distance: int, block_rows: int) -> None:
+    """Join the images of ``hashed`` positions whose pHashes are close."""
+    positions = np.flatnonzero(hashed)
+    # Equal hashes are joined directly, the bands only compare distinct ones
+    values, first, inverse = np.unique(phashes[positions], return_index=True, return_inverse=True)
+    union.union(positions, positions[first][inverse])
+    # Most band values hold a few hashes, their pairs are joined in bulk
+    pending: List[Tuple[np.ndarray, np.ndarray]] = []
+    size = 0
+    for i, j in phash_pairs(values, max_distance, block_rows):
+        pending.append((i, j))
+        size += len(i)
+        if size >= block_rows * block_rows:
+            union.union(*[positions[first[np.concatenate(side)]] for side in zip(*pending)])
+            pending, size = [], 0
+    if pending:
+        union.union(*[positions[first[np.concatenate(side)]] for side in zip(*pending)])
+
+
+async def read_phashes(profile_id: int, version: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Ids, pHashes (as ``uint64``) and has-pHash flags of the profile's images."""
+    ids: List[np.ndarray] = []
+    phashes: List[np.ndarray] = []
+    hashed: List[np.ndarray] = []
+    after_id = 0
+    async with task_session_scope() as session:
+        manager = ImageDataManager(session)
+        while True:
+            rows = await manager.get_phashes(profile_id, version, after_id, PAGE_ROWS)
+            await session.commit()
+            if not rows:
+                break
+            after_id = rows[-1].id
+            ids.append(np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows)))
+            phashes.append(np.fromiter(
+                (row.phash or 0 for row in rows), dtype=np.int64, count=len(rows)
+            ).view(np.uint64))
+            hashed.append(np.fromiter((row.phash is not None for row in rows), dtype=bool, count=len(rows)))
+    if not ids:
+        return np.empty(0, np.int64), np.empty(0, np.uint64), np.empty(0, bool)
+    return np.concatenate(ids), np.concatenate(phashes), np.concatenate(hashed)
+
+
+async def read_embeddings(profile_id: int, version: str, ids: np.ndarray, vectors: np.ndarray) -> None:
+    """Fill row ``k`` of ``vectors`` with the normalized embedding of ``ids[k]``.
+
+    ``ids`` are sorted; rows of images deleted since they were listed
+    stay zero and match nothing.
+    """
+    if not len(ids):
+        return
+    after_id, last_id = 0, int(ids[-1])
+    async with task_session_scope() as session:
+        manager = ImageDataManager(session)
+        while after_id < last_id:
+            rows = await manager.get_embeddings(profile_id, version, after_id=after_id, limit=PAGE_ROWS)
+            await session.commit()
+            if not rows:
+                break
+            after_id = rows[-1].id
+            page_ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+            positions = np.minimum(np.searchsorted(ids, page_ids), len(ids) - 1)
+            wanted = np.flatnonzero(
+                (ids[positions] == page_ids) & np.fromiter((row.current for row in rows), dtype=bool, count=len(rows))
+            )
+            if len(wanted):
+                vectors[positions[wanted]] = normalize(np.stack([rows[k].embedding for k in wanted]))
+
+
+def group_members(ids: np.ndarray, roots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Image ids and group ids of the images in groups of two or more."""
+    _, inverse, counts = np.unique(roots, return_inverse=True, return_counts=True)
+    grouped = np.flatnonzero(counts[inverse] > 1)
+    # Roots are the smallest positions of their sets and ``ids`` are sorted
+    return ids[grouped], ids[roots[grouped]]
+
+
+async def rebuild(profile_id: int, threshold: float, max_distance: int) -> dict:
+    """Rebuild the groups of the profile with the blocked similarity product."""
+    version = model_version()
+    block_rows = config.cluster.block_rows
+    ids, phashes, hashed = await read_phashes(profile_id, version)
+    union = UnionFind(len(ids))
+    await cpu_executor.run(join_phashes, union, phashes, hashed, max_distance, block_rows)
+    representatives = np.flatnonzero(union.roots() == np.arange(len(ids)))
+    logging.info(
+        "Profile %d: %d images, %d after joining pHash duplicates",
+        profile_id, len(ids), len(representatives),
+    )
+
+    vectors = scratch_matrix(len(representatives), EMBEDDING_DIM, config.cluster.dtype, config.cluster.scratch_dir)
+    await read_embeddings(profile_id, version, ids[representatives], vectors)
+
+    def join_similar() -> None:
+        for i, j in similar_pairs(vectors, threshold, block_rows):
+            union.union(representatives[i], representatives[j])
+
+    await cpu_executor.run(join_similar)
+    del vectors
+    image_ids, group_ids = group_members(ids, union.roots())
+
+    async with task_session_scope() as session:
+        manager = DuplicateGroupDataManager(session)
+        await manager.lock(profile_id)
+        await manager.replace_groups(profile_id, zip(image_ids.tolist(), group_ids.tolist()))
+        await manager.save_state(
+            profile_id, int(ids[-1]) if len(ids) else 0, threshold, max_distance, version
+        )
+    return {"images": len(ids), "grouped": len(image_ids), "groups": len(np.unique(group_ids))}
+
+
+async def update_page(
+    session: AsyncSession,
+    profile_id: int,
+    threshold: float,
+    max_distance: int,
+    version: str,
+    limit: int,
+) -> Optional[int]:
+    """Join the next ``limit`` images stored after the last run, return their number.
+
+    ``None`` means the stored groups are of other parameters (or there
+    are none) and the profile has to be rebuilt. Images with a stale
+    embedding are passed over.
+    """
+    groups = DuplicateGroupDataManager(session)
+    await groups.lock(profile_id)
+    state = await groups.get_state(profile_id)
+    if state is None or (state.threshold, state.phash_max_distance, state.model_version) != (
+        threshold, max_distance, version
+    ):
+        return None
+    images = ImageDataManager(session)
+    rows = await images.get_embeddings(profile_id, version, after_id=state.last_image_id, limit=limit)
+    if not rows:
+        return 0
+    current = [row for row in rows if row.current]
+
+    # Searches return the image itself too
+    neighbors = config.cluster.neighbors + 1
+    edges: List[Tuple[int, int]] = []
+    hashed = [row for row in current if row.phash is not None]
+    phash_matches = await images.get_phash_matches_batch(
+        [row.phash for row in hashed], profile_id, max_distance, neighbors
+    )
+    for row, matches in zip(hashed, phash_matches):
+        edges.extend((row.id, match.id) for match in matches if match.id != row.id)
+    joined = {a for a, _ in edges}
+    unmatched = [row for row in current if row.id not in joined]
+    vector_matches = await images.get_vector_distance_batch(
+        [np.asarray(row.embedding, dtype=np.float32) for row in unmatched], profile_id, threshold, neighbors
+    )
+    for row, matches in zip(unmatched, vector_matches):
+        edges.extend((row.id, match.id) for match in matches if match.id != row.id)
+
+    if edges:
+        await join_edges(groups, profile_id, edges)
+    await groups.save_state(profile_id, rows[-1].id, threshold, max_distance, version)
+    return len(rows)
+
+
+async def join_edges(groups: DuplicateGroupDataManager, profile_id: int, edges: List[Tuple[int, int]]) -> None:
+    """Join the images of ``edges`` and the groups they are in."""
+    nodes = sorted({image_id for edge in edges for image_id in edge})
+    known = await groups.get_group_ids(profile_id, nodes)
+    union = GroupUnion()
+    # Members of a group are joined through its group id, an image id too
+    for image_id, group_id in known.items():
+        union.union(image_id, group_id)
+    for a, b in edges:
+        union.union(a, b)
+    merged: Dict[int, List[int]] = {}
+    for group_id in set(known.values()):
+        root = union.find(group_id)
+        if root != group_id:
+            merged.setdefault(root, []).append(group_id)
+    for root, group_ids in merged.items():
+        await groups.merge_groups(profile_id, group_ids, root)
+    await groups.upsert_members(profile_id, {
+        image_id: union.find(image_id)
+        for image_id in nodes
+        if known.get(image_id) != union.find(image_id)
+    })
+
+
+async def update(profile_id: int, threshold: float, max_distance: int, limit: int) -> Optional[dict]:
+    """Join the images stored after the last run, page by page, then prune.
+
+    Every page is one transaction holding the profile's lock. ``None``
+    if the profile has to be rebuilt.
+    """
+    version = model_version()
+    images = 0
+    while True:
+        async with task_session_scope() as session:
+            count = await update_page(session, profile_id, threshold, max_distance, version, limit)
+        if count is None:
+            return None
+        if not count:
+            break
+        images += count
+    async with task_session_scope() as session:
+        groups = DuplicateGroupDataManager(session)
+        await groups.lock(profile_id)
+        pruned = await groups.prune(profile_id)
+    return {"images": images, "pruned": pruned}
+
+
+async def cluster_profile(
+    profile_id: int,
+    rebuild_groups: bool = False,
+    method: str = "matrix",
+    threshold: Optional[float] = None,
+    limit: int = 200,
+) -> dict:
+    """Update the groups of the profile, rebuilding them if needed or asked."""
+    threshold = config.cluster.threshold if threshold is None else threshold
+    max_distance = config.search.phash_max_distance
+    if not rebuild_groups:
+        result = await update(profile_id, threshold, max_distance, limit)
+        if result is not None:
+            return result
+    if method == "matrix":
+        return await rebuild(profile_id, threshold, max_distance)
+    if method != "index":
+        raise ValueError(f"Unsupported clustering method: {method}")
+    # Groups are rebuilt as one long update from scratch
+    async with task_session_scope() as session:
+        groups = DuplicateGroupDataManager(session)
+        await groups.lock(profile_id)
+        await groups.clear(profile_id)
+        await groups.save_state(profile_id, 0, threshold, max_distance, model_version())
+    return await update(profile_id, threshold, max_distance, limit)
+
+
+async def get_profile_ids(names: List[str]) -> List[int]:
+    async with task_session_scope() as session:
+        manager = ProfileDataManager(session)
+        if not names:
+            return [profile.id for profile in await manager.get_all_profiles()]
+        ids = []
+        for name in names:
+            profile = await manager.get_profile(name)
+            if profile is None:
+                raise SystemExit(f"Profile '{name}' not found")
+            ids.append(profile.id)
+        return ids
+
+
+async def cluster(args: argparse.Namespace) -> None:
+    for profile_id in await get_profile_ids(args.profile):
+        started = time.monotonic()
+        result = await cluster_profile(profile_id, args.rebuild, args.method, args.threshold, args.batch_size)
+        logging.info("Profile %d clustered in %.1fs: %s", profile_id, time.monotonic() - started, result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    profiles = parser.add_mutually_exclusive_group(required=True)
+    profiles.add_argument("--profile", action="append", default=[], help="Profile to cluster, repeatable.")
+    profiles.add_argument("--all", action="store_true", help="Cluster every profile.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the groups even if up to date.")
+    parser.add_argument("--method", choices=("matrix", "index"), default="matrix", help="How groups are rebuilt.")
+    parser.add_argument("--threshold", type=float, help="Overrides cluster.threshold.")
+    parser.add_argument("--block-rows", type=int, default=config.cluster.block_rows)
+    parser.add_argument("--batch-size", type=int, default=200, help="Images searched per update page.")
+    parser.add_argument("--nice", type=int, default=10, help="Niceness added to the process.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.nice:
+        os.nice(args.nice)
+    config.cluster.block_rows = args.block_rows
+    asyncio.run(cluster(args))
+
+
+if __name__ == "__main__":
+    main()
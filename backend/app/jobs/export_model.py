@@ -0,0 +1,175 @@
+"""Export the feature extractor for the non-eager inference backends.
+
+Writes the artifacts loaded by ``embedder.backend`` to
+``embedder.artifact_dir``, along with a local ResNet-50 checkpoint for
+``embedder.weights_path``, and checks each of them against the eager model:
+the export fails if the cosine similarity of any embedding drops below
+``--min-cosine`` (``--min-cosine-int8`` for the quantized model)::
+
+    python -m app.jobs.export_model
+    python -m app.jobs.export_model --backend int8 --calibration-dir samples/
+
+The int8 model is statically quantized (QDQ, per-channel weights), which
+needs representative inputs to calibrate activation ranges: pass a
+directory of typical images. Without one random tensors are used, which
+is enough to check the pipeline but not for production accuracy.
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import torch
+from PIL import Image
+
+from app.core.config import config
+from app.core.inference import (
+    WEIGHTS_FILE,
+    artifact_path,
+    build_feature_extractor,
+    compare_outputs,
+    load_backend,
+)
+from app.core.preprocess import transform
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+INPUT_SIZE = (3, 224, 224)
+
+
+def sample_batches(directory: str, count: int, batch_size: int = 8) -> Iterator[torch.Tensor]:
+    """Preprocessed images from ``directory``, or random tensors without it."""
+    if not directory:
+        for _ in range(0, count, batch_size):
+            yield torch.randn(batch_size, *INPUT_SIZE)
+        return
+    paths = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)[:count]
+    if not paths:
+        raise SystemExit(f"No images found in {directory}")
+    for start in range(0, len(paths), batch_size):
+        yield torch.stack([
+            transform(Image.open(path).convert("RGB")) for path in paths[start:start + batch_size]
+        ])
+
+
+def export_weights(path: Path) -> None:
+    """Save torchvision's ImageNet checkpoint in the mmap-able zip format."""
+    import torchvision.models as models
+
+    torch.save(models.ResNet50_Weights.IMAGENET1K_V2.get_state_dict(progress=False), path)
+
+
+def export_torchscript(model: torch.nn.Module, path: Path) -> None:
+    example = torch.randn(1, *INPUT_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    traced.save(str(path))
+
+
+def export_onnx(model: torch.nn.Module, path: Path, opset: int) -> None:
+    torch.onnx.export(
+        model,
+        (torch.randn(1, *INPUT_SIZE),),
+        str(path),
+        input_names=["input"],
+        output_names=["embedding"],
+        dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+
+
+def export_int8(onnx_path: Path, path: Path, calibration: List[torch.Tensor]) -> None:
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(CalibrationDataReader):
+        def __init__(self) -> None:
+            self.batches = iter(calibration)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {"input": batch.numpy()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = Path(tmp) / "prepared.onnx"
+        quant_pre_process(str(onnx_path), str(prepared))
+        quantize_static(
+            str(prepared),
+            str(path),
+            Reader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+
+
+def export(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    backends = ["weights", "torchscript", "onnx", "int8"] if args.backend == "all" else [args.backend]
+    model = build_feature_extractor(config.embedder.weights_path, config.embedder.mmap_weights)
+    weights_path = output_dir / WEIGHTS_FILE
+
+    onnx_path = artifact_path("onnx", str(output_dir))
+    for backend in backends:
+        path = weights_path if backend == "weights" else artifact_path(backend, str(output_dir))
+        logging.info("Exporting %s to %s", backend, path)
+        if backend == "weights":
+            export_weights(path)
+        elif backend == "torchscript":
+            export_torchscript(model, path)
+        elif backend == "onnx":
+            export_onnx(model, path, args.opset)
+        else:
+            if not onnx_path.exists():
+                export_onnx(model, onnx_path, args.opset)
+            calibration = list(sample_batches(args.calibration_dir, args.calibration_images))
+            export_int8(onnx_path, path, calibration)
+
+    parity_batch = torch.cat(list(sample_batches(args.calibration_dir, args.parity_images)))
+    report = {}
+    for backend in backends:
+        if backend == "weights":
+            candidate = build_feature_extractor(str(weights_path))
+        else:
+            candidate = load_backend(backend, str(output_dir), model=model)
+        report[backend] = compare_outputs(model, candidate, parity_batch)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["weights", "torchscript", "onnx", "int8", "all"], default="all")
+    parser.add_argument("--output-dir", default=config.embedder.artifact_dir)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--calibration-dir", default="", help="Images used for int8 calibration and parity.")
+    parser.add_argument("--calibration-images", type=int, default=64)
+    parser.add_argument("--parity-images", type=int, default=16)
+    parser.add_argument("--min-cosine", type=float, default=0.999)
+    parser.add_argument("--min-cosine-int8", type=float, default=0.99)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    failed = False
+    for backend, parity in export(args).items():
+        threshold = args.min_cosine_int8 if backend == "int8" else args.min_cosine
+        ok = parity["min_cosine"] >= threshold
+        failed |= not ok
+        logging.log(
+            logging.INFO if ok else logging.ERROR,
+            "%s parity: min cosine %.6f, mean %.6f (threshold %.3f)",
+            backend, parity["min_cosine"], parity["mean_cosine"], threshold,
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Re-embed stored images whose embedding is missing or stale.
+
+Images whose ``embedding_model_version`` differs from the current one
+(:func:`app.core.embeder.model_version`; rows stored before versioning
+have none) are read in ``id`` order with keyset pagination. Their
+originals are downloaded from S3 up to ``--prefetch`` pages ahead,
+decoded and embedded in batches, and written back with one
+``UPDATE ... FROM (VALUES ...)`` per page, along with the pHash of the
+new decode. Images without an S3 original cannot be re-embedded and are
+skipped, as are originals that fail to download or decode::
+
+    python -m app.jobs.reembed --dry-run
+    python -m app.jobs.reembed --checkpoint reembed.json --max-rate 20 \\
+        --api-stats-url http://backend:8000/stats
+
+The last ``id`` of every written page is saved to ``--checkpoint``; a
+restarted job resumes after it, unless the checkpoint is of another model
+version or ``--restart`` is given. Skipped images stay stale and are
+retried by the next full run.
+
+To leave room for online traffic the job runs niced, with
+``--threads`` inference threads, at most ``--max-rate`` images per
+second, and pauses while the API executor behind ``--api-stats-url``
+has more than ``--busy-fraction`` of its requests in flight.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.request
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import config
+from app.core.embeder import embedder, model_version
+from app.core.executor import cpu_executor
+from app.core.preprocess import decode_image, to_model_input
+from app.core.s3_storage import AsyncS3Manager, close_s3, get_async_s3_manager
+from app.core.session import task_session_scope
+from app.services.images import (
+    ImageDataManager,
+    ProfileDataManager,
+    compute_phash,
+    embedding_columns,
+    phash_to_hex,
+)
+
+
+@dataclass
+class Checkpoint:
+    """Progress of a run, saved after every written page."""
+
+    path: str
+    version: str
+    last_id: int = 0
+    updated: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+    @classmethod
+    def load(cls, path: str, version: str, restart: bool) -> "Checkpoint":
+        if restart or not os.path.exists(path):
+            return cls(path, version)
+        with open(path) as fp:
+            state = json.load(fp)
+        if state.get("version") != version:
+            logging.info("Checkpoint is of version %s, starting over", state.get("version"))
+            return cls(path, version)
+        state.pop("path", None)
+        return cls(path, **state)
+
+    def save(self) -> None:
+        # Written aside and renamed, so a crash never leaves a partial file
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as fp:
+            json.dump(asdict(self), fp)
+        os.replace(tmp, self.path)
+
+
+class Throttle:
+    """Keeps the job under ``max_rate`` images/s and out of a busy API's way."""
+
+    def __init__(self, max_rate: float, stats_url: str, busy_fraction: float, busy_sleep: float) -> None:
+        self.max_rate = max_rate
+        self.stats_url = stats_url
+        self.busy_fraction = busy_fraction
+        self.busy_sleep = busy_sleep
+        self.start = time.monotonic()
+        self.images = 0
+
+    def api_busy(self) -> bool:
+        try:
+            with urllib.request.urlopen(self.stats_url, timeout=2) as response:
+                executor = json.load(response)["executor"]
+        except (OSError, ValueError, KeyError):
+            # An unreachable API is not a busy one
+            logging.warning("Cannot read %s", self.stats_url, exc_info=True)
+            return False
+        return executor["in_flight"] >= self.busy_fraction * executor["max_in_flight"]
+
+    async def wait(self, images: int) -> None:
+        self.images += images
+        if self.max_rate > 0:
+            ahead = self.images / self.max_rate - (time.monotonic() - self.start)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+        if self.stats_url:
+            while await asyncio.to_thread(self.api_busy):
+                logging.info("API is busy, pausing for %.0fs", self.busy_sleep)
+                await asyncio.sleep(self.busy_sleep)
+                # Time spent paused does not count towards the rate
+                self.start += self.busy_sleep
+
+
+def prepare(data: bytes) -> Tuple[int, np.ndarray]:
+    image = decode_image(data)
+    return compute_phash(image), to_model_input(image)
+
+
+async def fetch_originals(storage: AsyncS3Manager, rows: list) -> list:
+    """Originals of the page's images, or the exception of their download."""
+    return await asyncio.gather(
+        *[storage.read_object(row.s3_key) for row in rows if row.s3_key],
+        return_exceptions=True,
+    )
+
+
+async def produce_pages(
+    queue: asyncio.Queue,
+    storage: AsyncS3Manager,
+    version: str,
+    after_id: int,
+    batch_size: int,
+    profile_id: Optional[int],
+) -> None:
+    """Queue pages of stale images, each with the download of its originals."""
+    cancelled = False
+    try:
+        async with task_session_scope() as session:
+            manager = ImageDataManager(session)
+            while True:
+                rows = await manager.get_stale_embeddings(version, after_id, batch_size, profile_id)
+                # No transaction is held open across pages
+                await session.commit()
+                if not rows:
+                    break
+                after_id = rows[-1].id
+                await queue.put((rows, asyncio.ensure_future(fetch_originals(storage, rows))))
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        # Unless the consumer is gone, it waits for the end of the pages
+        if not cancelled:
+            await queue.put(None)
+
+
+async def reembed_page(manager: ImageDataManager, rows: list, originals: list, checkpoint: Checkpoint) -> int:
+    """Embed and write back one page, return the number of updated images."""
+    stored = [row for row in rows if row.s3_key]
+    checkpoint.skipped += len(rows) - len(stored)
+
+    prepared = await asyncio.gather(
+        *[
+            cpu_executor.run(prepare, data)
+            for data in originals
+            if not isinstance(data, BaseException)
+        ],
+        return_exceptions=True,
+    )
+    prepared = iter(prepared)
+    ready: List[Tuple[object, int, np.ndarray]] = []
+    for row, data in zip(stored, originals):
+        result = data if isinstance(data, BaseException) else next(prepared)
+        if isinstance(result, BaseException):
+            checkpoint.failed += 1
+            logging.warning("Image %s (%s) is skipped: %s", row.id, row.s3_key, result)
+        else:
+            ready.append((row, *result))
+    if not ready:
+        return 0
+
+    embeddings = await asyncio.to_thread(embedder.embed_batch, [pixels for _, _, pixels in ready])
+    await manager.update_columns([
+        {
+            "id": row.id,
+            "profile_id": row.profile_id,
+            "phash": phash,
+            "hash": phash_to_hex(phash),
+            **embedding_columns(emb.numpy()),
+        }
+        for (row, phash, _), emb in zip(ready, embeddings)
+    ])
+    return len(ready)
+
+
+async def get_profile_id(name: Optional[str]) -> Optional[int]:
+    if not name:
+        return None
+    async with task_session_scope() as session:
+        profile = await ProfileDataManager(session).get_profile(name)
+    if profile is None:
+        raise SystemExit(f"Profile '{name}' not found")
+    return profile.id
+
+
+async def count_stale(args: argparse.Namespace) -> None:
+    version = model_version()
+    async with task_session_scope() as session:
+        counts = await ImageDataManager(session).count_stale_embeddings(
+            version, await get_profile_id(args.profile)
+        )
+    logging.info(
+        "%d images are not of version %s, %d of them have an S3 original",
+        counts["total"], version, counts["with_original"],
+    )
+
+
+async def reembed(args: argparse.Namespace) -> Checkpoint:
+    version = model_version()
+    profile_id = await get_profile_id(args.profile)
+    checkpoint = Checkpoint.load(args.checkpoint, version, args.restart)
+    logging.info("Re-embedding to version %s after id %d", version, checkpoint.last_id)
+    throttle = Throttle(args.max_rate, args.api_stats_url, args.busy_fraction, args.busy_sleep)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.prefetch)
+    producer = asyncio.create_task(produce_pages(
+        queue, get_async_s3_manager(), version, checkpoint.last_id, args.batch_size, profile_id,
+    ))
+    try:
+        async with task_session_scope() as session:
+            manager = ImageDataManager(session)
+            while (page := await queue.get()) is not None:
+                rows, downloads = page
+                updated = await reembed_page(manager, rows, await downloads, checkpoint)
+                await session.commit()
+                checkpoint.updated += updated
+                checkpoint.last_id = rows[-1].id
+                checkpoint.save()
+                logging.info(
+                    "Up to id %d: %d updated, %d skipped, %d failed",
+                    checkpoint.last_id, checkpoint.updated, checkpoint.skipped, checkpoint.failed,
+                )
+                await throttle.wait(len(rows))
+    except BaseException:
+        producer.cancel()
+        raise
+    # Raises the error that ended the pages early, if any
+    await producer
+    return checkpoint
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", help="Only re-embed images of this profile.")
+    parser.add_argument("--batch-size", type=int, default=config.embedder.max_batch_size)
+    parser.add_argument("--prefetch", type=int, default=2, help="Pages downloaded ahead.")
+    parser.add_argument("--checkpoint", default="reembed.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count stale images.")
+    parser.add_argument("--max-rate", type=float, default=0, help="Images per second, 0 is unlimited.")
+    parser.add_argument("--threads", type=int, default=1, help="Inference threads, 0 keeps embedder.num_threads.")
+    parser.add_argument("--nice", type=int, default=10, help="Niceness added to the process.")
+    parser.add_argument("--api-stats-url", default="", help="/stats of the API to yield to.")
+    parser.add_argument("--busy-fraction", type=float, default=0.5)
+    parser.add_argument("--busy-sleep", type=float, default=5.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.nice:
+        os.nice(args.nice)
+    if args.threads > 0:
+        config.embedder.num_threads = args.threads
+    if args.dry_run:
+        asyncio.run(count_stale(args))
+        return
+    try:
+        checkpoint = asyncio.run(reembed(args))
+    finally:
+        close_s3()
+    logging.info(
+        "Done: %d updated, %d skipped, %d failed",
+        checkpoint.updated, checkpoint.skipped, checkpoint.failed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from app.const import (
     OPEN_API_DESCRIPTION,
@@ -16,7 +19,15 @@ from sqlalchemy.orm import Session
 import uvicorn
 from pgvector.psycopg2 import register_vector
 from sqlalchemy import event
-from app.core.session import sengine
+from app.core.session import aengine, sengine
+from app.core.cache import embedding_cache
+from app.core.embeder import embedder
+from app.core.executor import cpu_executor
+from app.core.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, render, state_gauge
+from app.core.preprocess import decode_stats
+from app.core.redispool import AsyncRedisClient
+from app.core.s3_storage import close_s3, get_s3_manager
+from app.services.search import get_search_backend
 
 @event.listens_for(sengine, "connect")
 def connect(dbapi_connection, connection_record):
@@ -25,7 +36,24 @@ def connect(dbapi_connection, connection_record):
 
 APP_NAME = os.environ.get("APP_NAME", "app")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await AsyncRedisClient.initialize()
+    if config.embedder.warmup:
+        # Not awaited: /health answers while the model loads, /ready tells when it is warm
+        app.state.embedder_warmup = asyncio.get_running_loop().run_in_executor(None, embedder.warmup)
+    try:
+        yield
+    finally:
+        await AsyncRedisClient.close()
+        await aengine.dispose()
+        cpu_executor.shutdown()
+        close_s3()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title=OPEN_API_TITLE,
     description=OPEN_API_DESCRIPTION,
     version=__version__,
@@ -48,12 +76,57 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+# Read at scrape time, see app.core.metrics
+state_gauge("difmag_db_pool_size", "Connections kept open by the async pool.", aengine.pool.size)
+state_gauge("difmag_db_pool_checked_out", "Pooled connections in use.", aengine.pool.checkedout)
+state_gauge("difmag_db_pool_overflow", "Connections open above the pool size.", lambda: max(aengine.pool.overflow(), 0))
+state_gauge("difmag_executor_in_flight", "Requests inside the decode/embed pipeline.", lambda: cpu_executor.in_flight)
+state_gauge("difmag_executor_queued", "Calls waiting for a CPU executor thread.", lambda: cpu_executor.queued)
+state_gauge("difmag_inference_queue_depth", "Images waiting for a forward pass.", lambda: embedder.stats()["queue_depth"])
+state_gauge("difmag_embedder_ready", "Whether the model is loaded.", lambda: embedder.ready)
 api_router = APIRouter(prefix="/api")
 
 @app.get("/health")
 def healthcheck():
     return Response(status_code=200)
 
+@app.get("/ready")
+def readiness():
+    if embedder.ready:
+        return {"status": "ready", "load_seconds": embedder.load_seconds}
+    if embedder.load_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": embedder.load_error})
+    return JSONResponse(status_code=503, content={"status": "loading"})
+
+@app.get("/health/redis")
+async def redis_healthcheck():
+    try:
+        latency = await AsyncRedisClient.ping()
+    except Exception as exc:
+        logging.warning("Redis health check failed: %s", exc)
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": str(exc)})
+    return {"status": "ok", "latency_ms": latency * 1000}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    if not config.metrics.enabled:
+        return Response(status_code=404)
+    return Response(content=render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats")
+def stats():
+    return {
+        "executor": cpu_executor.stats(),
+        "embedder": embedder.stats(),
+        "decode": decode_stats.snapshot(),
+        "embedding_cache": embedding_cache.stats(),
+        "redis": AsyncRedisClient.stats.snapshot(),
+        "presigned_urls": get_s3_manager().url_cache.stats() if config.s3.bucket else None,
+        "search": get_search_backend().stats(),
+    }
+
 api_router.include_router(images.router)
 
 
@@ -1,11 +1,14 @@
-from sqlalchemy import Index, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, Index, ForeignKey, func
 from app.models.base import SQLModel
 from sqlalchemy.orm import (
     Mapped,
     mapped_column,
     relationship
 )
-from pgvector.sqlalchemy import Vector
+from app.models.types import BIT, HALFVEC, Vector
+from app.const import EMBEDDING_DIM
 
 class Profile(SQLModel):
     __tablename__ = "profiles"
@@ -16,15 +19,56 @@ class Profile(SQLModel):
 
 
 class ImageRecord(SQLModel):
+    """Stored image.
+
+    The table is list-partitioned by ``profile_id`` (one partition per
+    profile, see ``ProfileDataManager.create_partition``), hence the
+    composite primary key.
+    """
     __tablename__ = "images"
     __table_args__ = {"schema": "public"}
 
-    id: Mapped[int] = mapped_column("id", primary_key=True)
-    profile_id: Mapped[int] = mapped_column(ForeignKey("public.profiles.id", name="img2profile"))
+    id: Mapped[int] = mapped_column("id", primary_key=True, autoincrement=True)
+    profile_id: Mapped[int] = mapped_column(ForeignKey("public.profiles.id", name="img2profile"), primary_key=True, index=True)
     file_path: Mapped[str] = mapped_column("file_path") 
     hash: Mapped[str] = mapped_column("hash", nullable=True)
-    mbedding:Mapped[Vector] = mapped_column(Vector(2048))
+    s3_key: Mapped[str] = mapped_column("s3_key", nullable=True)
+    phash: Mapped[int] = mapped_column("phash", BigInteger, nullable=True)
+    mbedding:Mapped[Vector] = mapped_column(Vector(EMBEDDING_DIM), nullable=True)
+    mbedding_half: Mapped[HALFVEC] = mapped_column(HALFVEC(EMBEDDING_DIM), nullable=True)
+    mbedding_bin: Mapped[bytes] = mapped_column(BIT(EMBEDDING_DIM), nullable=True)
+    embedding_model_version: Mapped[str] = mapped_column("embedding_model_version", nullable=True)
 
     # __table_args__ = (
     #     Index("idx_images_hash", "hash", postgresql_using="smlarhash"),
     # )
+
+
+class DuplicateGroup(SQLModel):
+    """Membership of an image in a group of near-duplicates of its profile.
+
+    Only images with at least one duplicate have a row. ``group_id`` is
+    the smallest image id of the group; written by ``app.jobs.cluster``.
+    """
+    __tablename__ = "duplicate_groups"
+    __table_args__ = (
+        Index("ix__duplicate_groups__profile_id_group_id", "profile_id", "group_id"),
+        {"schema": "public"},
+    )
+
+    profile_id: Mapped[int] = mapped_column(ForeignKey("public.profiles.id", ondelete="CASCADE"), primary_key=True)
+    image_id: Mapped[int] = mapped_column("image_id", primary_key=True)
+    group_id: Mapped[int] = mapped_column("group_id")
+
+
+class DuplicateGroupState(SQLModel):
+    """Parameters and progress (``last_image_id``) of a profile's clustering."""
+    __tablename__ = "duplicate_group_state"
+    __table_args__ = {"schema": "public"}
+
+    profile_id: Mapped[int] = mapped_column(ForeignKey("public.profiles.id", ondelete="CASCADE"), primary_key=True)
+    last_image_id: Mapped[int] = mapped_column("last_image_id")
+    threshold: Mapped[float] = mapped_column("threshold")
+    phash_max_distance: Mapped[int] = mapped_column("phash_max_distance")
+    model_version: Mapped[str] = mapped_column("model_version")
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
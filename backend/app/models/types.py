@@ -0,0 +1,28 @@
+"""pgvector column types.
+
+pgvector's SQLAlchemy types always serialize bound values to text, while
+``pgvector.asyncpg.register_vector`` installs binary codecs that expect
+lists or NumPy arrays. With asyncpg the values are passed through as is,
+so that embeddings are sent in the binary format without a text round-trip.
+
+``BIT`` is re-exported as is: asyncpg encodes ``bytes`` into ``bit(n)``.
+"""
+from pgvector.sqlalchemy import BIT, HALFVEC as _HALFVEC, VECTOR as _VECTOR
+
+
+class Vector(_VECTOR):
+    cache_ok = True
+
+    def bind_processor(self, dialect):
+        if dialect.driver == "asyncpg":
+            return None
+        return super().bind_processor(dialect)
+
+
+class HALFVEC(_HALFVEC):
+    cache_ok = True
+
+    def bind_processor(self, dialect):
+        if dialect.driver == "asyncpg":
+            return None
+        return super().bind_processor(dialect)
@@ -1,35 +1,273 @@
+import asyncio
+import json
+from functools import partial
+from typing import AsyncIterator, List, Optional
 
-from fastapi import Depends, UploadFile
+from celery.result import AsyncResult
+from fastapi import Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.routing import APIRouter
-from sqlalchemy.orm import Session
-from app.services.images import ImageService, ProfileService
-from app.core.session import create_session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from app.services.images import ImageService, ProfileService, iter_upload_members
+from app.core.celery_app import celery_app
+from app.core.config import config
+from app.core.preprocess import ImageTooLarge
+from app.core.s3_storage import AsyncS3MultipartUpload, get_async_s3_manager
+from app.core.session import async_session_scope, create_async_session
+from app.core.uploads import check_content_length, receive_upload
+from app.schemas.images import BatchCheckResult, ImageGroup, ImageMatch, TaskStatus
+from app.services.duplicates import DuplicateGroupService
+from app.tasks.images import enqueue_clustering, enqueue_ingestion, staging_key
 
 router = APIRouter(prefix="/images", tags=['Image'])
 
+# Single image bodies are parsed by ``receive_upload`` in the endpoint,
+# so the form is documented here rather than through ``UploadFile``
+UPLOAD_REQUEST_BODY = {
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            }
+        }
+    },
+    "required": True,
+}
 
-@router.post("/load")
-def load_image(
-    file: UploadFile,
+
+def _stage_to_s3(profile_id: int, filename: str) -> AsyncS3MultipartUpload:
+    """Multipart upload a new upload to the profile is streamed to."""
+    return get_async_s3_manager().multipart_upload(staging_key(filename, profile_id))
+
+
+@router.post(
+    "/load",
+    responses={202: {"model": TaskStatus}},
+    openapi_extra={"requestBody": UPLOAD_REQUEST_BODY},
+)
+async def load_image(
+    request: Request,
+    profile: str,
+    enqueue: bool = False,
+    session: AsyncSession = Depends(create_async_session)
+):
+    """Load an image, or stage it to S3 and queue its ingestion if ``enqueue``.
+
+    The body is read once, as it arrives. Staged images are streamed to S3
+    in parts without being held in memory.
+    """
+    if enqueue and not config.s3.bucket:
+        raise HTTPException(status_code=503, detail="S3 storage is not configured")
+    service = ImageService(session)
+    profile_id = await service.get_profile_id(profile)
+
+    stage = None
+    if enqueue or (config.s3.store_uploads and config.s3.bucket):
+        stage = partial(_stage_to_s3, profile_id)
+    upload = await receive_upload(request, keep=not enqueue, stage=stage)
+
+    if not enqueue:
+        await service.store_image(
+            upload.data, upload.filename, profile_id, upload.s3_key, key=upload.key
+        )
+        await run_in_threadpool(enqueue_clustering, profile_id)
+        return
+    # The broker client is blocking
+    status = await run_in_threadpool(enqueue_ingestion, upload.s3_key, upload.filename, profile_id)
+    return JSONResponse(status_code=202, content=status.model_dump())
+
+
+@router.get("/tasks/{task_id}", response_model=TaskStatus)
+def get_task_status(task_id: str):
+    """Poll the state of a queued ingestion."""
+    result = AsyncResult(task_id, app=celery_app)
+    status = TaskStatus(task_id=task_id, status=result.state)
+    if result.successful():
+        status.result = result.result
+    elif result.failed():
+        status.detail = str(result.result)
+    return status
+
+
+@router.post(
+    "/check",
+    response_model=List[ImageMatch],
+    openapi_extra={"requestBody": UPLOAD_REQUEST_BODY},
+)
+async def check_image(
+    request: Request,
     profile: str,
-    session: Session = Depends(create_session)
+    threshhold: float,
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(create_async_session)
 ):
-    ImageService(session).create_image(file)
+    """Find stored images similar to the uploaded one.
+
+    pHash matches (similarity ``1 - distance / 64``) are returned without
+    running the model only if at least one reaches ``threshhold``.
+    """
+    upload = await receive_upload(request)
+    return await ImageService(session).check_image(
+        upload.data, profile, threshhold, limit, key=upload.key
+    )
+
+
+BATCH_CHECK_REQUEST_BODY = {
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "items": {"type": "string", "format": "binary"},
+                        "description": "Images to check.",
+                    },
+                    "s3_keys": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Keys of images in the S3 bucket to check.",
+                    },
+                },
+            }
+        }
+    },
+    "required": True,
+}
 
 
-@router.post("/check")
-def check_image(
-    file: UploadFile,
+@router.post(
+    "/check/batch",
+    response_model=List[BatchCheckResult],
+    openapi_extra={"requestBody": BATCH_CHECK_REQUEST_BODY},
+)
+async def check_images(
+    request: Request,
     profile: str,
     threshhold: float,
-    uniq_create: bool,
-    session: Session = Depends(create_session)
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(create_async_session)
 ):
-    return ImageService(session).check_image(file)
+    """Check a batch of images given as ``files`` and/or ``s3_keys``.
+
+    Results follow the order of the files, then of the keys; ``duplicate_of``
+    flags images duplicating an earlier one of the same batch.
+    """
+    check_content_length(request, config.ingest.max_request_bytes)
+    max_images = config.search.batch_max_images
+    form = await request.form(max_files=max_images, max_fields=max_images)
+    try:
+        uploads = [item for item in form.getlist("files") if isinstance(item, StarletteUploadFile)]
+        keys = [item for item in form.getlist("s3_keys") if isinstance(item, str)]
+        if not uploads and not keys:
+            raise HTTPException(status_code=400, detail="No files or s3_keys to check")
+        if len(uploads) + len(keys) > max_images:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {max_images} images can be checked at once",
+            )
+        if keys and not config.s3.bucket:
+            raise HTTPException(status_code=503, detail="S3 storage is not configured")
+
+        items = []
+        for upload in uploads:
+            if upload.size is not None and upload.size > config.decode.max_bytes:
+                error = ImageTooLarge(
+                    f"Image of {upload.size} bytes exceeds the limit of {config.decode.max_bytes}"
+                )
+                items.append((upload.filename, error))
+            else:
+                items.append((upload.filename, await upload.read()))
+        if keys:
+            storage = get_async_s3_manager()
+            blobs = await asyncio.gather(
+                *[storage.read_object(key) for key in keys], return_exceptions=True
+            )
+            for key, blob in zip(keys, blobs):
+                if isinstance(blob, Exception):
+                    blob = ValueError(f"Cannot read S3 object: {blob}")
+                items.append((key, blob))
+    finally:
+        await form.close()
+    return await ImageService(session).check_images(items, profile, threshhold, limit)
+
+
+BULK_REQUEST_BODY = {
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "items": {"type": "string", "format": "binary"},
+                        "description": "Images or zip/tar archives of images.",
+                    }
+                },
+                "required": ["files"],
+            }
+        }
+    },
+    "required": True,
+}
+
+
+@router.post(
+    "/bulk",
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    openapi_extra={"requestBody": BULK_REQUEST_BODY},
+)
+async def bulk_load_images(
+    request: Request,
+    profile: str,
+    session: AsyncSession = Depends(create_async_session)
+):
+    """Load a batch of images, streaming one NDJSON result line per image."""
+    check_content_length(request, config.ingest.max_request_bytes)
+    profile_id = await ImageService(session).get_profile_id(profile)
+    # The form is parsed here rather than through ``UploadFile`` parameters,
+    # since FastAPI closes those before a streaming body is sent
+    form = await request.form(max_files=config.ingest.max_files)
+    uploads = [item for item in form.getlist("files") if isinstance(item, StarletteUploadFile)]
+
+    async def stream() -> AsyncIterator[str]:
+        try:
+            items = (
+                member
+                for upload in uploads
+                for member in iter_upload_members(upload.filename, upload.file)
+            )
+            async with async_session_scope() as bulk_session:
+                async for result in ImageService(bulk_session).bulk_create_images(items, profile_id):
+                    yield json.dumps(result) + "\n"
+            await run_in_threadpool(enqueue_clustering, profile_id)
+        finally:
+            await form.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/duplicates", response_model=List[ImageGroup])
+async def get_duplicate_groups(
+    profile: str,
+    after: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(create_async_session)
+):
+    """Groups of near-duplicates found by ``app.jobs.cluster``, by ``group_id``.
+
+    Pass the last ``group_id`` of a page as ``after`` to get the next one.
+    """
+    return await DuplicateGroupService(session).get_groups(profile, after, limit)
+
 
 @router.post("/profiles")
-def create_profile(
+async def create_profile(
     name: str,
-    session: Session = Depends(create_session)
+    session: AsyncSession = Depends(create_async_session)
 ):
-    return ProfileService(session).get_profiles()
\ No newline at end of file
+    profile = await ProfileService(session).create_profile(name)
+    return profile.to_dict()
\ No newline at end of file
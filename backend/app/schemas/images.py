@@ -0,0 +1,45 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class ImageMatch(BaseModel):
+    """Stored image found to be similar to the checked one."""
+
+    id: int
+    file_path: str
+    similarity: float
+    hash_distance: Optional[int] = None
+    s3_key: Optional[str] = None
+    url: Optional[str] = None
+
+
+class BatchCheckResult(BaseModel):
+    """Matches of one image of a batch check.
+
+    ``duplicate_of`` is the ``index`` of the first earlier image of the
+    batch it duplicates; ``detail`` is set instead of matches for images
+    that could not be read or decoded.
+    """
+
+    index: int
+    file: str
+    matches: List[ImageMatch] = []
+    duplicate_of: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class ImageGroup(BaseModel):
+    """Group of near-duplicate images of a profile, ``group_id`` is its smallest image id."""
+
+    group_id: int
+    image_ids: List[int]
+
+
+class TaskStatus(BaseModel):
+    """State of an ingestion task."""
+
+    task_id: str
+    status: str
+    result: Optional[dict] = None
+    detail: Optional[str] = None
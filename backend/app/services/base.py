@@ -9,6 +9,7 @@ from sqlalchemy import (
     func,
     select,
 )
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import Executable
 
@@ -22,10 +23,21 @@ class SessionMixin:
         self.session = session
 
 
+class AsyncSessionMixin:
+    """Provides instance of async database session."""
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+
 class BaseService(SessionMixin):
     """Base class for application services."""
 
 
+class AsyncBaseService(AsyncSessionMixin):
+    """Base class for application services working over async session."""
+
+
 class BaseDataManager(SessionMixin):
     """Base data manager class responsible for operations over database."""
 
@@ -69,4 +81,36 @@ class BaseDataManager(SessionMixin):
 
         fn = getattr(getattr(func, model.schema()), model.table_name())
         stmt = select(fn(*args).table_valued(*model.fields()))
-        return self.get_all(select(model).from_statement(stmt))
\ No newline at end of file
+        return self.get_all(select(model).from_statement(stmt))
+
+
+class AsyncBaseDataManager(AsyncSessionMixin):
+    """Async counterpart of :class:`BaseDataManager`."""
+
+    async def add_one(self, model: Any) -> None:
+        self.session.add(model)
+        await self.session.commit()
+
+    async def add_all(self, models: Sequence[Any]) -> None:
+        self.session.add_all(models)
+        await self.session.flush()
+
+    async def delete_one(self, model: Any):
+        await self.session.delete(model)
+        await self.session.commit()
+
+    async def get_one(self, select_stmt: Executable) -> Any:
+        return await self.session.scalar(select_stmt)
+
+    async def get_all(self, select_stmt: Executable) -> List[Any]:
+        return list((await self.session.scalars(select_stmt)).all())
+
+    async def get_from_tvf(self, model: Type[SQLModel], *args: Any) -> List[Any]:
+        """Query from table valued function.
+
+        See :meth:`BaseDataManager.get_from_tvf`.
+        """
+
+        fn = getattr(getattr(func, model.schema()), model.table_name())
+        stmt = select(fn(*args).table_valued(*model.fields()))
+        return await self.get_all(select(model).from_statement(stmt))
@@ -0,0 +1,182 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, exists, func, insert, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+
+from app.models.images import DuplicateGroup, DuplicateGroupState, ImageRecord
+from app.schemas.images import ImageGroup
+from app.services.base import AsyncBaseDataManager, AsyncBaseService
+from app.services.images import ImageService
+
+# Rows written by one COPY/INSERT when groups are replaced
+WRITE_CHUNK_ROWS = 50_000
+
+
+class DuplicateGroupService(AsyncBaseService):
+    async def get_groups(self, profile: str, after: int, limit: int) -> List[ImageGroup]:
+        profile_id = await ImageService(self.session).get_profile_id(profile)
+        rows = await DuplicateGroupDataManager(self.session).get_groups(profile_id, after, limit)
+        return [ImageGroup(group_id=row.group_id, image_ids=row.image_ids) for row in rows]
+
+
+class DuplicateGroupDataManager(AsyncBaseDataManager):
+    """Groups of near-duplicates written by ``app.jobs.cluster``.
+
+    Writers take :meth:`lock` first, so that runs on the same profile
+    (a rebuild and queued updates) do not interleave.
+    """
+
+    async def lock(self, profile_id: int) -> None:
+        """Lock the profile's groups until the end of the transaction."""
+        await self.session.execute(select(func.pg_advisory_xact_lock(
+            func.hashtext(DuplicateGroup.table_name()), profile_id
+        )))
+
+    async def get_state(self, profile_id: int) -> Optional[DuplicateGroupState]:
+        return await self.get_one(
+            select(DuplicateGroupState).where(DuplicateGroupState.profile_id == profile_id)
+        )
+
+    async def save_state(
+        self,
+        profile_id: int,
+        last_image_id: int,
+        threshold: float,
+        phash_max_distance: int,
+        model_version: str,
+    ) -> None:
+        values = {
+            "last_image_id": last_image_id,
+            "threshold": threshold,
+            "phash_max_distance": phash_max_distance,
+            "model_version": model_version,
+            "updated_at": func.now(),
+        }
+        stmt = pg_insert(DuplicateGroupState).values(profile_id=profile_id, **values)
+        await self.session.execute(stmt.on_conflict_do_update(
+            index_elements=[DuplicateGroupState.profile_id], set_=values
+        ))
+
+    async def clear(self, profile_id: int) -> None:
+        """Delete the groups and the state of the profile."""
+        await self.session.execute(delete(DuplicateGroup).where(DuplicateGroup.profile_id == profile_id))
+        await self.session.execute(
+            delete(DuplicateGroupState).where(DuplicateGroupState.profile_id == profile_id)
+        )
+
+    async def replace_groups(self, profile_id: int, members: Iterable[Tuple[int, int]]) -> int:
+        """Replace the groups of the profile by ``(image_id, group_id)`` pairs.
+
+        Rows are copied in chunks when the driver is asyncpg (see
+        :meth:`app.services.images.ImageDataManager.insert_images`).
+        Returns the number of written rows.
+        """
+        await self.session.execute(delete(DuplicateGroup).where(DuplicateGroup.profile_id == profile_id))
+        connection = await self.session.connection()
+        raw = None
+        if connection.dialect.driver == "asyncpg":
+            raw = (await connection.get_raw_connection()).driver_connection
+        written = 0
+        chunk: List[Tuple[int, int, int]] = []
+        for image_id, group_id in members:
+            chunk.append((profile_id, int(image_id), int(group_id)))
+            if len(chunk) >= WRITE_CHUNK_ROWS:
+                written += await self._write_chunk(raw, chunk)
+                chunk = []
+        if chunk:
+            written += await self._write_chunk(raw, chunk)
+        return written
+
+    async def _write_chunk(self, raw, rows: List[Tuple[int, int, int]]) -> int:
+        if raw is not None:
+            await raw.copy_records_to_table(
+                DuplicateGroup.table_name(),
+                schema_name=DuplicateGroup.schema(),
+                columns=["profile_id", "image_id", "group_id"],
+                records=rows,
+            )
+        else:
+            await self.session.execute(insert(DuplicateGroup), [
+                {"profile_id": profile_id, "image_id": image_id, "group_id": group_id}
+                for profile_id, image_id, group_id in rows
+            ])
+        return len(rows)
+
+    async def get_group_ids(self, profile_id: int, image_ids: List[int]) -> Dict[int, int]:
+        """Group id of each of ``image_ids`` having a group."""
+        if not image_ids:
+            return {}
+        stmt = select(DuplicateGroup.image_id, DuplicateGroup.group_id).where(
+            DuplicateGroup.profile_id == profile_id, DuplicateGroup.image_id.in_(image_ids)
+        )
+        return {row.image_id: row.group_id for row in await self.session.execute(stmt)}
+
+    async def merge_groups(self, profile_id: int, group_ids: List[int], into: int) -> None:
+        """Move every member of ``group_ids`` to group ``into``."""
+        if not group_ids:
+            return
+        await self.session.execute(
+            update(DuplicateGroup)
+            .where(DuplicateGroup.profile_id == profile_id, DuplicateGroup.group_id.in_(group_ids))
+            .values(group_id=into)
+        )
+
+    async def upsert_members(self, profile_id: int, members: Dict[int, int]) -> None:
+        """Set the group of each image of ``members`` (``image_id: group_id``)."""
+        if not members:
+            return
+        stmt = pg_insert(DuplicateGroup)
+        await self.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[DuplicateGroup.profile_id, DuplicateGroup.image_id],
+                set_={"group_id": stmt.excluded.group_id},
+            ),
+            [
+                {"profile_id": profile_id, "image_id": image_id, "group_id": group_id}
+                for image_id, group_id in members.items()
+            ],
+        )
+
+    async def prune(self, profile_id: int) -> int:
+        """Delete members that are no longer stored, then groups left with one member.
+
+        Groups that a deleted image was the only link of stay whole until
+        the next rebuild. Returns the number of deleted rows.
+        """
+        gone = await self.session.execute(
+            delete(DuplicateGroup).where(
+                DuplicateGroup.profile_id == profile_id,
+                ~exists().where(and_(
+                    ImageRecord.profile_id == DuplicateGroup.profile_id,
+                    ImageRecord.id == DuplicateGroup.image_id,
+                )),
+            )
+        )
+        singletons = (
+            select(DuplicateGroup.group_id)
+            .where(DuplicateGroup.profile_id == profile_id)
+            .group_by(DuplicateGroup.group_id)
+            .having(func.count() == 1)
+        )
+        alone = await self.session.execute(
+            delete(DuplicateGroup).where(
+                DuplicateGroup.profile_id == profile_id,
+                DuplicateGroup.group_id.in_(singletons),
+            )
+        )
+        return gone.rowcount + alone.rowcount
+
+    async def get_groups(self, profile_id: int, after: int, limit: int) -> list:
+        """Return ``group_id`` and sorted ``image_ids`` of ``limit`` groups after ``after``."""
+        stmt = (
+            select(
+                DuplicateGroup.group_id,
+                func.array_agg(aggregate_order_by(DuplicateGroup.image_id, DuplicateGroup.image_id))
+                .label("image_ids"),
+            )
+            .where(DuplicateGroup.profile_id == profile_id, DuplicateGroup.group_id > after)
+            .group_by(DuplicateGroup.group_id)
+            .order_by(DuplicateGroup.group_id)
+            .limit(limit)
+        )
+        return (await self.session.execute(stmt)).all()
@@ -1,78 +1,1020 @@
-import io
-from typing import List, Union
+import asyncio
+import tarfile
+import zipfile
+from typing import IO, TYPE_CHECKING, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 import warnings
-from fastapi import UploadFile
-from sqlalchemy import select
-from app.services.base import BaseDataManager, BaseService
+from fastapi import HTTPException
+from sqlalchemy import BigInteger, bindparam, cast, func, insert, inspect as sa_inspect, literal_column, or_, select, text, true
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy.exc import SQLAlchemyError
+from app.services.base import AsyncBaseDataManager, AsyncBaseService
 from PIL import Image
 from pathlib import Path
 import numpy as np
 import imagehash
-import torchvision.transforms as T
-from app.core.embeder import feature_extractor
-import torch
+from app.core.cache import ImageFeatures, content_key, embedding_cache
+from app.core.embeder import embedder, model_version
+from app.core.executor import cpu_executor
+from app.core.metrics import timed
+from app.core.preprocess import DECODE_ERRORS, ImageTooLarge, decode_image, to_model_input
+from app.core.s3_storage import get_async_s3_manager
+from app.core.vector_index import normalize
 from app.models.images import ImageRecord, Profile
+from app.models.types import BIT as VECTOR_BIT, HALFVEC, Vector
+from app.const import EMBEDDING_DIM, PHASH_BANDS
+from app.core.config import config
+from app.schemas.images import BatchCheckResult, ImageMatch
+from app.services.search import get_search_backend
 
-transform = T.Compose([
-    T.Resize(256),
-    T.CenterCrop(224),
-    T.ToTensor(),
-    T.Normalize(mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225])
-])
-
-def extract_embedding(image: Image.Image) -> torch.Tensor:
-    img_t = transform(image).unsqueeze(0)
-    with torch.no_grad():
-        emb = feature_extractor(img_t)  # shape [1, 2048, 1, 1]
-    emb = emb.squeeze()  # [2048]
+if TYPE_CHECKING:
+    import torch
+
+def extract_embedding(image: Image.Image) -> "torch.Tensor":
+    # Прогон идёт батчами вместе с параллельными запросами
+    emb = embedder.embed(to_model_input(image))  # [2048]
     # Для косинусной близости можно нормализовать, но тут оставим "как есть".
     return emb
 
-class ImageService(BaseService):
-    def create_image(self, file: UploadFile):
+
+PHASH_BAND_BITS = 64 // PHASH_BANDS
+
+
+def phash_to_int(img_hash: imagehash.ImageHash) -> int:
+    """Convert 64-bit pHash to the signed value stored in ``bigint``."""
+    value = int(str(img_hash), 16)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def phash_to_hex(value: int) -> str:
+    """Inverse of :func:`phash_to_int`, same format as ``str(ImageHash)``."""
+    return format(value & ((1 << 64) - 1), "016x")
+
+
+def compute_phash(image: Image.Image) -> int:
+    return phash_to_int(imagehash.phash(image))
+
+
+def phash_band(value, band: int):
+    """Extract ``band``-th group of bits, as SQL expression or python int.
+
+    Shift and mask are rendered as literals so that the expression
+    matches the band indexes created in the ``add phash bands`` migration.
+    """
+    shift = 64 - PHASH_BAND_BITS * (band + 1)
+    mask = (1 << PHASH_BAND_BITS) - 1
+    if isinstance(value, int):
+        return (value >> shift) & mask
+    return value.op(">>")(literal_column(str(shift))).op("&")(literal_column(str(mask)))
+
+
+def quantize_binary(emb: np.ndarray) -> bytes:
+    """Pack embedding into ``bit(2048)``, one bit per dimension.
+
+    ResNet features are non-negative, so thresholding at zero (as
+    ``binary_quantize`` does) would set almost every bit. Each vector is
+    thresholded at its own mean instead; the backfill in the
+    ``compact embedding storage`` migration does the same in SQL.
+    """
+    return np.packbits(emb > emb.mean()).tobytes()
+
+
+def batch_duplicates(
+    keys: List[Optional[str]],
+    phashes: List[Optional[int]],
+    embeddings: List[Optional[np.ndarray]],
+    threshold: float,
+    max_distance: int,
+) -> List[Optional[int]]:
+    """Index of the first earlier image of a batch that each image duplicates.
+
+    Two images are duplicates if their bytes are the same, their pHashes
+    differ by at most ``max_distance`` bits and are at least ``threshold``
+    similar (``1 - distance / 64``, as pHash matches of
+    :meth:`ImageService.check_image`) or their embeddings are at least
+    ``threshold`` similar. ``None`` entries (unreadable images, images not
+    embedded) are left out of that comparison.
+    """
+    count = len(keys)
+    same = np.zeros((count, count), dtype=bool)
+    first = {}
+    for i, key in enumerate(keys):
+        if key is not None:
+            same[i, first.setdefault(key, i)] = True
+    hashed = [i for i, phash in enumerate(phashes) if phash is not None]
+    if hashed:
+        values = np.array([phashes[i] for i in hashed], dtype=np.int64).view(np.uint64)
+        distances = np.bitwise_count(values[:, None] ^ values[None, :])
+        same[np.ix_(hashed, hashed)] |= (distances <= max_distance) & (1 - distances / 64 >= threshold)
+    embedded = [i for i, emb in enumerate(embeddings) if emb is not None]
+    if embedded:
+        vectors = normalize(np.stack([embeddings[i] for i in embedded]))
+        same[np.ix_(embedded, embedded)] |= vectors @ vectors.T >= threshold
+    duplicates = []
+    for i in range(count):
+        earlier = np.flatnonzero(same[i, :i])
+        duplicates.append(int(earlier[0]) if len(earlier) else None)
+    return duplicates
+
+
+def embedding_columns(emb: np.ndarray) -> dict:
+    """Column values storing ``emb`` according to ``search.storage_mode``.
+
+    ``embedding_model_version`` is set along, so that the re-embedding job
+    can tell stale vectors.
+    """
+    mode = config.search.storage_mode
+    if mode == "full":
+        columns = {"mbedding": emb}
+    elif mode == "halfvec":
+        columns = {"mbedding_half": emb}
+    elif mode == "binary":
+        columns = {"mbedding": emb, "mbedding_bin": quantize_binary(emb)}
+    else:
+        raise ValueError(f"Unsupported storage mode: {mode}")
+    columns["embedding_model_version"] = model_version()
+    return columns
+
+
+class UploadItem(NamedTuple):
+    """One image to ingest, ``s3_key`` is set for images staged to S3."""
+
+    name: str
+    fileobj: IO[bytes]
+    s3_key: Optional[str] = None
+
+
+def iter_upload_members(filename: str, fileobj: IO[bytes]) -> Iterator[UploadItem]:
+    """Yield an :class:`UploadItem` for every image in an upload.
+
+    Zip and tar (optionally compressed) archives are expanded member by
+    member, any other upload is yielded as is. Members are only valid
+    until the next item is requested.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    yield UploadItem(f"{filename}/{info.filename}", member)
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.ReadError:
+        fileobj.seek(0)
+        yield UploadItem(filename, fileobj)
+        return
+    with archive:
+        for member in archive:
+            if member.isfile():
+                yield UploadItem(f"{filename}/{member.name}", archive.extractfile(member))
+
+
+class ImageService(AsyncBaseService):
+    async def create_image(self, data: bytes, filename: str, profile: str) -> ImageRecord:
         # fpath = Path(file.filename)
         # fpath.write_bytes(file.file.read())
-        image = Image.open(file.file).convert("RGB")
-        img_hash = str(imagehash.phash(image))
-        
-        emb = extract_embedding(image)
+        profile_id = await self.get_profile_id(profile)
+        return await self.store_image(data, filename, profile_id)
+
+    async def store_image(
+        self,
+        data: bytes,
+        filename: str,
+        profile_id: int,
+        s3_key: Optional[str] = None,
+        key: Optional[str] = None,
+    ) -> ImageRecord:
+        """Embed and store an image; ``key`` is its :func:`content_key` if already known."""
+        async with cpu_executor.slot():
+            if key is None:
+                with timed("content_key"):
+                    key = await cpu_executor.run(content_key, data)
+            features = None
+            # Rounded embeddings are not stored as the image's own
+            if embedding_cache.lossless:
+                with timed("cache_lookup"):
+                    features = await embedding_cache.get(key)
+            if features is None:
+                image = await self._decode(data)
+                with timed("phash"):
+                    phash = await cpu_executor.run(compute_phash, image)
+                features = await self._embed(key, image, phash)
         
-        # Превратим PyTorch-тензор в список (чтобы вставить в pgvector)
-        emb_list = emb.tolist()  # длина 2048
-        print(emb_list)
+        new_image = self._build_record(features.phash, filename, profile_id, s3_key)
+        # NumPy-массив уходит в pgvector в бинарном формате, без списка из 2048 float
+        for column, value in embedding_columns(features.embedding).items():
+            setattr(new_image, column, value)
         # Сохраняем запись в базу данных
-        new_image = ImageRecord(file_path=file.filename, hash=img_hash, mbedding=emb_list, profile_id=1)
-        ImageDataManager(self.session).add_one(new_image)
+        await ImageDataManager(self.session).add_one(new_image)
+        get_search_backend().changed(profile_id)
+        return new_image
 
-    def check_image(self, file: UploadFile):
-        image = Image.open(file.file).convert("RGB")
-        
-        emb = extract_embedding(image)
-        emb_list = emb.tolist()
-        return ImageDataManager(self.session).get_vector_distance(emb_list)
+    async def bulk_create_images(
+        self,
+        items: Iterator[UploadItem],
+        profile_id: int,
+    ) -> AsyncIterator[dict]:
+        """Ingest many images, yielding one result per item as it is stored.
+
+        Items are read, decoded, hashed and preprocessed on the CPU executor
+        as they arrive, then embedded in one batch and committed in one
+        transaction per ``ingest.chunk_size`` images.
+        """
+        chunk = []
+        while True:
+            item = await cpu_executor.run(self._prepare_next, items, profile_id)
+            if item is None:
+                break
+            chunk.append(item)
+            if len(chunk) >= config.ingest.chunk_size:
+                async for result in self._store_chunk(chunk):
+                    yield result
+                chunk = []
+        if chunk:
+            async for result in self._store_chunk(chunk):
+                yield result
+
+    def _prepare_next(
+        self,
+        items: Iterator[UploadItem],
+        profile_id: int,
+    ) -> Optional[Tuple[str, Union[Tuple[ImageRecord, np.ndarray], Exception]]]:
+        try:
+            item = next(items)
+        except StopIteration:
+            return None
+        try:
+            image = decode_image(item.fileobj)
+        except (ImageTooLarge, *DECODE_ERRORS) as exc:
+            return item.name, exc
+        record = self._build_record(compute_phash(image), item.name, profile_id, item.s3_key)
+        return item.name, (record, to_model_input(image))
+
+    async def _store_chunk(self, chunk: list) -> AsyncIterator[dict]:
+        prepared = [item for _, item in chunk if not isinstance(item, Exception)]
+        records = [record for record, _ in prepared]
+        with timed("embed_chunk"):
+            embeddings = await asyncio.gather(*[embedder.aembed(pixels) for _, pixels in prepared])
+        for record, emb in zip(records, embeddings):
+            for column, value in embedding_columns(emb.numpy()).items():
+                setattr(record, column, value)
+
+        error = None
+        try:
+            with timed("insert_chunk"):
+                await ImageDataManager(self.session).insert_images(records)
+                await self.session.commit()
+            if records:
+                get_search_backend().changed(records[0].profile_id)
+        except SQLAlchemyError as exc:
+            await self.session.rollback()
+            error = str(getattr(exc, "orig", None) or exc)
+
+        stored = iter(records)
+        for name, item in chunk:
+            if isinstance(item, ImageTooLarge):
+                yield {"file": name, "status": "error", "detail": str(item)}
+            elif isinstance(item, Exception):
+                yield {"file": name, "status": "error", "detail": f"Cannot decode image: {item}"}
+            elif error is not None:
+                yield {"file": name, "status": "error", "detail": error}
+            else:
+                yield {"file": name, "status": "created", "id": next(stored).id}
+
+    @staticmethod
+    def _build_record(
+        phash: int,
+        file_path: str,
+        profile_id: int,
+        s3_key: Optional[str] = None,
+    ) -> ImageRecord:
+        return ImageRecord(
+            file_path=file_path,
+            hash=phash_to_hex(phash),
+            phash=phash,
+            profile_id=profile_id,
+            s3_key=s3_key,
+        )
+
+    @staticmethod
+    async def _decode(data: bytes) -> Image.Image:
+        try:
+            with timed("decode"):
+                return await cpu_executor.run(decode_image, data)
+        except ImageTooLarge as exc:
+            raise HTTPException(status_code=413, detail=str(exc))
+        except DECODE_ERRORS:
+            raise HTTPException(status_code=400, detail="Cannot decode image")
+
+    @staticmethod
+    def _decode_and_hash(data: bytes) -> Tuple[Image.Image, int]:
+        image = decode_image(data)
+        return image, compute_phash(image)
+
+    @staticmethod
+    async def _embed(key: str, image: Image.Image, phash: int) -> ImageFeatures:
+        with timed("preprocess"):
+            pixels = await cpu_executor.run(to_model_input, image)
+        with timed("embed"):
+            emb = await embedder.aembed(pixels)
+        features = ImageFeatures(phash=phash, embedding=emb.numpy())
+        await embedding_cache.put(key, features)
+        return features
+
+    async def check_image(
+        self,
+        data: bytes,
+        profile: str,
+        threshold: float,
+        limit: Optional[int] = None,
+        key: Optional[str] = None,
+    ) -> List[ImageMatch]:
+        profile_id = await self.get_profile_id(profile)
+        limit = limit or config.search.top_k
+        manager = ImageDataManager(self.session)
+
+        async with cpu_executor.slot():
+            # Те же байты уже разбирались: берём pHash и эмбеддинг из кэша
+            if key is None:
+                with timed("content_key"):
+                    key = await cpu_executor.run(content_key, data)
+            with timed("cache_lookup"):
+                features = await embedding_cache.get(key)
+            if features is None:
+                image = await self._decode(data)
+                with timed("phash"):
+                    phash = await cpu_executor.run(compute_phash, image)
+            else:
+                phash = features.phash
+
+            # Повторные загрузки находятся по pHash без прогона через CNN;
+            # совпадения ниже порога не считаются, тогда идём в векторный поиск
+            if config.search.phash_prefilter:
+                with timed("phash_search"):
+                    matches = await manager.get_phash_matches(
+                        phash,
+                        profile_id=profile_id,
+                        max_distance=config.search.phash_max_distance,
+                        limit=limit,
+                    )
+                matches = [match for match in matches if match.similarity >= threshold]
+                if matches:
+                    return await self._attach_urls(matches)
+
+            if features is None:
+                features = await self._embed(key, image, phash)
+
+        with timed("vector_search"):
+            matches = await manager.get_vector_distance(
+                features.embedding,
+                profile_id=profile_id,
+                threshold=threshold,
+                limit=limit,
+            )
+        return await self._attach_urls(matches)
+
+    @staticmethod
+    async def _attach_urls(matches: List[ImageMatch]) -> List[ImageMatch]:
+        """Set ``url`` of the matches stored in S3, signed in one batch."""
+        stored = [match for match in matches if match.s3_key]
+        if stored and config.s3.bucket:
+            with timed("presign"):
+                urls = await get_async_s3_manager().presign_urls([match.s3_key for match in stored])
+            for match, url in zip(stored, urls):
+                match.url = url
+        return matches
+
+    async def check_images(
+        self,
+        items: List[Tuple[str, Union[bytes, Exception]]],
+        profile: str,
+        threshold: float,
+        limit: Optional[int] = None,
+    ) -> List[BatchCheckResult]:
+        """Check a batch of images against the profile and against each other.
+
+        Each image is checked as by :meth:`check_image`, but the work is
+        shared: cached features are looked up at once, misses are decoded in
+        parallel, images without a pHash match are embedded together (so the
+        inference engine runs full batches) and all pHash and all vector
+        searches run as one statement each. Items given as an exception,
+        e.g. an unreadable S3 object, are reported in ``detail``.
 
+        Duplicates within the batch are found by :func:`batch_duplicates`
+        with the same ``threshold``; images answered by the pHash prefilter
+        are not embedded and only compared by bytes and pHash. As in
+        :meth:`check_image`, pHash matches below ``threshold``, stored or
+        within the batch, are dropped.
+        """
+        profile_id = await self.get_profile_id(profile)
+        limit = limit or config.search.top_k
+        manager = ImageDataManager(self.session)
+        results = [BatchCheckResult(index=i, file=name) for i, (name, _) in enumerate(items)]
+        keys: List[Optional[str]] = [None] * len(items)
+        phashes: List[Optional[int]] = [None] * len(items)
+        features: Dict[int, ImageFeatures] = {}
+        images: Dict[int, Image.Image] = {}
 
-class ImageDataManager(BaseDataManager):
-    def get_vector_distance(self, vector: List[float]):
-        distances = self.session.scalars(select(ImageRecord.mbedding.cosine_distance(vector))).fetchall()
-        return list(map(lambda x: 1 - x, distances))
+        async with cpu_executor.slot():
+            readable = []
+            for i, (_, data) in enumerate(items):
+                if isinstance(data, Exception):
+                    results[i].detail = str(data)
+                else:
+                    readable.append(i)
+            with timed("content_key"):
+                found_keys = await asyncio.gather(*[cpu_executor.run(content_key, items[i][1]) for i in readable])
+            with timed("cache_lookup"):
+                cached = await embedding_cache.get_many(found_keys)
+            for i, key, hit in zip(readable, found_keys, cached):
+                keys[i] = key
+                if hit is not None:
+                    features[i] = hit
+                    phashes[i] = hit.phash
 
-class ProfileService(BaseService):
-    def create_profile(self, name):
+            missing = [i for i in readable if i not in features]
+            with timed("batch_decode"):
+                decoded = await asyncio.gather(
+                    *[cpu_executor.run(self._decode_and_hash, items[i][1]) for i in missing],
+                    return_exceptions=True,
+                )
+            for i, outcome in zip(missing, decoded):
+                if isinstance(outcome, ImageTooLarge):
+                    results[i].detail = str(outcome)
+                elif isinstance(outcome, DECODE_ERRORS):
+                    results[i].detail = f"Cannot decode image: {outcome}"
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+                else:
+                    images[i], phashes[i] = outcome
+
+            hashed = [i for i in readable if phashes[i] is not None]
+            if config.search.phash_prefilter:
+                with timed("batch_phash_search"):
+                    found = await manager.get_phash_matches_batch(
+                        [phashes[i] for i in hashed],
+                        profile_id=profile_id,
+                        max_distance=config.search.phash_max_distance,
+                        limit=limit,
+                    )
+                for i, matches in zip(hashed, found):
+                    results[i].matches = [match for match in matches if match.similarity >= threshold]
+
+            pending = [i for i in hashed if not results[i].matches]
+            to_embed = [i for i in pending if i not in features]
+            with timed("batch_embed"):
+                pixels = await asyncio.gather(*[cpu_executor.run(to_model_input, images.pop(i)) for i in to_embed])
+                embeddings = await asyncio.gather(*[embedder.aembed(image) for image in pixels])
+            computed = {}
+            for i, emb in zip(to_embed, embeddings):
+                features[i] = computed[keys[i]] = ImageFeatures(phash=phashes[i], embedding=emb.numpy())
+            if computed:
+                await embedding_cache.put_many(computed)
+
+        with timed("batch_vector_search"):
+            found = await manager.get_vector_distance_batch(
+                [features[i].embedding for i in pending],
+                profile_id=profile_id,
+                threshold=threshold,
+                limit=limit,
+            )
+        for i, matches in zip(pending, found):
+            results[i].matches = matches
+        await self._attach_urls([match for result in results for match in result.matches])
+
+        duplicates = await cpu_executor.run(
+            batch_duplicates,
+            keys,
+            phashes,
+            [features[i].embedding if i in features else None for i in range(len(items))],
+            threshold,
+            config.search.phash_max_distance,
+        )
+        for result, duplicate in zip(results, duplicates):
+            result.duplicate_of = duplicate
+        return results
+
+    async def get_profile_id(self, name: str) -> int:
+        profile = await ProfileDataManager(self.session).get_profile(name)
+        if profile is None:
+            raise HTTPException(status_code=404, detail=f"Profile '{name}' not found")
+        return profile.id
+
+
+def search_expression():
+    """Embedding expression covered by the vector index of the storage mode.
+
+    In ``"full"`` mode it must stay in sync with the index definition in
+    the ``add vector index`` migration, otherwise the planner falls back
+    to a sequential scan.
+    """
+    if config.search.storage_mode == "halfvec":
+        return ImageRecord.mbedding_half
+    return cast(ImageRecord.mbedding, HALFVEC(EMBEDDING_DIM))
+
+
+def search_column():
+    """Embedding column holding the full vectors of the storage mode."""
+    if config.search.storage_mode == "halfvec":
+        return ImageRecord.mbedding_half
+    return ImageRecord.mbedding
+
+
+class ImageDataManager(AsyncBaseDataManager):
+    async def get_phash_matches(
+        self,
+        phash: int,
+        profile_id: int,
+        max_distance: int,
+        limit: int,
+    ) -> List[ImageMatch]:
+        """Return images of the profile whose pHash is within ``max_distance`` bits.
+
+        Candidates are found through the band indexes (any band equal),
+        then filtered by the exact Hamming distance.
+        """
+        stmt = self._phash_stmt(phash, profile_id, max_distance, limit)
+        rows = (await self.session.execute(stmt)).all()
+        return [
+            ImageMatch(
+                id=row.id,
+                file_path=row.file_path,
+                similarity=1 - row.distance / 64,
+                hash_distance=row.distance,
+                s3_key=row.s3_key,
+            )
+            for row in rows
+        ]
+
+    async def configure_search(self) -> None:
+        """Apply query-time index parameters to the current transaction."""
+        ef_search = config.search.ef_search
+        if config.search.storage_mode == "binary":
+            # HNSW returns at most ef_search rows, all candidates are needed for rerank
+            ef_search = max(ef_search, config.search.rerank_candidates)
+        await self.session.execute(select(
+            func.set_config("hnsw.ef_search", str(ef_search), True),
+            func.set_config("ivfflat.probes", str(config.search.probes), True),
+        ))
+
+    async def get_vector_distance(
+        self,
+        vector: np.ndarray,
+        profile_id: int,
+        threshold: float,
+        limit: int,
+    ) -> List[ImageMatch]:
+        """Return top ``limit`` images of the profile with similarity >= ``threshold``.
+
+        The search runs in the ``search.backend`` (see ``app.services.search``).
+        """
+        return await get_search_backend().search(self, vector, profile_id, threshold, limit)
+
+    async def get_pgvector_matches(
+        self,
+        vector: np.ndarray,
+        profile_id: int,
+        threshold: float,
+        limit: int,
+    ) -> List[ImageMatch]:
+        """:meth:`get_vector_distance` by the vector index of Postgres.
+
+        Results are ordered by the index-backed distance, so the query reads
+        at most ``limit`` candidates (``search.rerank_candidates`` in binary
+        mode) instead of the whole table.
+        """
+        await self.configure_search()
+        rows = (await self.session.execute(self._vector_stmt(vector, profile_id, limit))).all()
+        return [
+            ImageMatch(
+                id=row.id,
+                file_path=row.file_path,
+                similarity=1 - row.distance,
+                s3_key=row.s3_key,
+            )
+            for row in rows
+            if 1 - row.distance >= threshold
+        ]
+
+    async def get_vector_distance_batch(
+        self,
+        vectors: List[np.ndarray],
+        profile_id: int,
+        threshold: float,
+        limit: int,
+    ) -> List[List[ImageMatch]]:
+        """:meth:`get_vector_distance` of each of ``vectors``, in their order."""
+        return await get_search_backend().search_many(self, vectors, profile_id, threshold, limit)
+
+    async def get_pgvector_matches_batch(
+        self,
+        vectors: List[np.ndarray],
+        profile_id: int,
+        threshold: float,
+        limit: int,
+    ) -> List[List[ImageMatch]]:
+        """:meth:`get_pgvector_matches` of each of ``vectors`` in a single statement."""
+        results: List[List[ImageMatch]] = [[] for _ in vectors]
+        if not vectors:
+            return results
+        await self.configure_search()
+        rows = await self.session.execute(self._vector_batch_stmt(vectors, profile_id, limit))
+        for row in rows:
+            if 1 - row.distance >= threshold:
+                results[row.ord - 1].append(ImageMatch(
+                    id=row.id,
+                    file_path=row.file_path,
+                    similarity=1 - row.distance,
+                    s3_key=row.s3_key,
+                ))
+        return results
+
+    async def get_phash_matches_batch(
+        self,
+        phashes: List[int],
+        profile_id: int,
+        max_distance: int,
+        limit: int,
+    ) -> List[List[ImageMatch]]:
+        """:meth:`get_phash_matches` of each of ``phashes`` in a single statement."""
+        results: List[List[ImageMatch]] = [[] for _ in phashes]
+        if not phashes:
+            return results
+        stmt = self._phash_batch_stmt(phashes, profile_id, max_distance, limit)
+        for row in await self.session.execute(stmt):
+            results[row.ord - 1].append(ImageMatch(
+                id=row.id,
+                file_path=row.file_path,
+                similarity=1 - row.distance / 64,
+                hash_distance=row.distance,
+                s3_key=row.s3_key,
+            ))
+        return results
+
+    async def get_embeddings(
+        self,
+        profile_id: int,
+        version: str,
+        after_id: int = 0,
+        limit: Optional[int] = None,
+        ids: Optional[List[int]] = None,
+    ) -> list:
+        """Return ``id``, float32 ``embedding``, ``current`` and ``phash`` of images of the profile.
+
+        Either the images of ``ids``, or ``limit`` images with ``id`` above
+        ``after_id`` in ``id`` order. ``current`` tells whether the
+        embedding is of ``version``; images without an embedding are left out.
+        """
+        column = search_column()
+        stmt = select(
+            ImageRecord.id,
+            ImageRecord.phash,
+            cast(column, Vector(EMBEDDING_DIM)).label("embedding"),
+            ImageRecord.embedding_model_version.is_not_distinct_from(version).label("current"),
+        ).where(ImageRecord.profile_id == profile_id, column.is_not(None))
+        if ids is not None:
+            stmt = stmt.where(ImageRecord.id.in_(ids))
+        else:
+            stmt = stmt.where(ImageRecord.id > after_id).order_by(ImageRecord.id).limit(limit)
+        return (await self.session.execute(stmt)).all()
+
+    async def get_phashes(self, profile_id: int, version: str, after_id: int, limit: int) -> list:
+        """Return ``id`` and ``phash`` of images of the profile with a ``version`` embedding.
+
+        Keyset pagination in ``id`` order, as :meth:`get_stale_embeddings`.
+        """
+        stmt = (
+            select(ImageRecord.id, ImageRecord.phash)
+            .where(
+                ImageRecord.profile_id == profile_id,
+                ImageRecord.id > after_id,
+                ImageRecord.embedding_model_version == version,
+                search_column().is_not(None),
+            )
+            .order_by(ImageRecord.id)
+            .limit(limit)
+        )
+        return (await self.session.execute(stmt)).all()
+
+    async def get_embedding_ids(self, profile_id: int, version: str) -> list:
+        """Return ``id`` and ``current`` of every image of the profile with an embedding."""
+        column = search_column()
+        stmt = select(
+            ImageRecord.id,
+            ImageRecord.embedding_model_version.is_not_distinct_from(version).label("current"),
+        ).where(ImageRecord.profile_id == profile_id, column.is_not(None))
+        return (await self.session.execute(stmt)).all()
+
+    async def count_embeddings(self, profile_id: int, version: str) -> dict:
+        """Number of images of the profile with an embedding, and of ``version``."""
+        column = search_column()
+        stmt = select(
+            func.count().label("total"),
+            func.count().filter(ImageRecord.embedding_model_version == version).label("current"),
+        ).where(ImageRecord.profile_id == profile_id, column.is_not(None))
+        row = (await self.session.execute(stmt)).one()
+        return {"total": row.total, "current": row.current}
+
+    async def get_images(self, ids: List[int], profile_id: int) -> list:
+        """Return ``id``, ``file_path`` and ``s3_key`` of the images of ``ids``."""
+        stmt = select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key).where(
+            ImageRecord.profile_id == profile_id, ImageRecord.id.in_(ids)
+        )
+        return (await self.session.execute(stmt)).all()
+
+    async def get_stale_embeddings(
+        self,
+        version: str,
+        after_id: int,
+        limit: int,
+        profile_id: Optional[int] = None,
+    ) -> list:
+        """Return images whose embedding is missing or not of ``version``.
+
+        Keyset pagination: ``limit`` rows with ``id`` above ``after_id`` in
+        ``id`` order, so every page is a range scan of the primary key
+        indexes however far the backfill has got.
+        """
+        stmt = (
+            select(ImageRecord.id, ImageRecord.profile_id, ImageRecord.s3_key)
+            .where(
+                ImageRecord.id > after_id,
+                ImageRecord.embedding_model_version.is_distinct_from(version),
+            )
+            .order_by(ImageRecord.id)
+            .limit(limit)
+        )
+        if profile_id is not None:
+            stmt = stmt.where(ImageRecord.profile_id == profile_id)
+        return (await self.session.execute(stmt)).all()
+
+    async def count_stale_embeddings(self, version: str, profile_id: Optional[int] = None) -> dict:
+        """Number of stale images, with and without an S3 original."""
+        stmt = select(
+            func.count().label("total"),
+            func.count(ImageRecord.s3_key).label("with_original"),
+        ).where(ImageRecord.embedding_model_version.is_distinct_from(version))
+        if profile_id is not None:
+            stmt = stmt.where(ImageRecord.profile_id == profile_id)
+        row = (await self.session.execute(stmt)).one()
+        return {"total": row.total, "with_original": row.with_original}
+
+    async def insert_images(self, records: List[ImageRecord], method: Optional[str] = None) -> None:
+        """Insert many new images with ``ingest.insert_method`` (or ``method``).
+
+        Ids are taken from the table's sequence up front, so every method
+        leaves them set on ``records`` as a flush would. The records are
+        not added to the session.
+        """
+        method = method or config.ingest.insert_method
+        if method == "orm":
+            await self.add_all(records)
+            return
+        if method not in ("copy", "executemany"):
+            raise ValueError(f"Unsupported insert method: {method}")
+        if not records:
+            return
+
+        ids = (await self.session.execute(
+            select(func.nextval(func.pg_get_serial_sequence(ImageRecord.__table__.fullname, "id")))
+            .select_from(func.generate_series(1, len(records)))
+        )).scalars().all()
+        for record, id_ in zip(records, ids):
+            record.id = id_
+
+        attributes = [(attr.key, attr.columns[0].name) for attr in sa_inspect(ImageRecord).column_attrs]
+        rows = [tuple(getattr(record, key) for key, _ in attributes) for record in records]
+        connection = await self.session.connection()
+        if method == "copy" and connection.dialect.driver == "asyncpg":
+            # asyncpg encodes rows with the binary codecs of the columns,
+            # pgvector's for the embeddings (see ``register_vector_types``)
+            raw = (await connection.get_raw_connection()).driver_connection
+            await raw.copy_records_to_table(
+                ImageRecord.table_name(),
+                schema_name=ImageRecord.schema(),
+                columns=[name for _, name in attributes],
+                records=rows,
+            )
+            return
+        await self.session.execute(
+            insert(ImageRecord),
+            [{key: value for (key, _), value in zip(attributes, row)} for row in rows],
+        )
+
+    async def update_columns(self, rows: List[dict]) -> None:
+        """Update many images with one ``UPDATE ... FROM (VALUES ...)``.
+
+        Every row holds ``id``, ``profile_id`` and the same set of other
+        columns. Values are bound with the column types and cast in SQL,
+        since the types of ``VALUES`` parameters are not inferred.
+        """
+        if not rows:
+            return
+        table = ImageRecord.__table__
+        names = ["id", "profile_id", *[name for name in rows[0] if name not in ("id", "profile_id")]]
+        types = {name: table.c[name].type for name in names}
+        casts = {name: types[name].compile(dialect=postgresql.dialect()) for name in names}
+        params, tuples = [], []
+        for i, row in enumerate(rows):
+            cells = []
+            for name in names:
+                params.append(bindparam(f"{name}_{i}", row[name], type_=types[name]))
+                cells.append(f"CAST(:{name}_{i} AS {casts[name]})")
+            tuples.append(f"({', '.join(cells)})")
+        assignments = ", ".join(f"{name} = v.{name}" for name in names[2:])
+        await self.session.execute(text(
+            f"UPDATE {ImageRecord.schema()}.{ImageRecord.table_name()} AS i SET {assignments} "
+            f"FROM (VALUES {', '.join(tuples)}) AS v ({', '.join(names)}) "
+            f"WHERE i.id = v.id AND i.profile_id = v.profile_id"
+        ).bindparams(*params))
+
+    @staticmethod
+    def _phash_stmt(phash: int, profile_id: int, max_distance: int, limit: int):
+        """pHash search of :meth:`get_phash_matches`."""
+        same_band = or_(*[
+            phash_band(ImageRecord.phash, band) == phash_band(phash, band)
+            for band in range(PHASH_BANDS)
+        ])
+        distance = func.bit_count(
+            cast(ImageRecord.phash.op("#")(phash), BIT(64))
+        ).label("distance")
+        return (
+            select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key, distance)
+            .where(ImageRecord.profile_id == profile_id, same_band)
+            .where(distance <= max_distance)
+            .order_by(distance, ImageRecord.id)
+            .limit(limit)
+        )
+
+    @classmethod
+    def _vector_stmt(cls, vector: np.ndarray, profile_id: int, limit: int):
+        """Index-backed search of :meth:`get_pgvector_matches` in the storage mode."""
+        if config.search.storage_mode == "binary":
+            return cls._binary_rerank_stmt(vector, profile_id, limit)
+        query = bindparam("query", vector, type_=HALFVEC(EMBEDDING_DIM))
+        distance = search_expression().cosine_distance(query).label("distance")
+        return (
+            select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key, distance)
+            .where(ImageRecord.profile_id == profile_id)
+            .order_by(distance)
+            .limit(limit)
+        )
+
+    @staticmethod
+    def _binary_rerank_stmt(vector: np.ndarray, profile_id: int, limit: int):
+        """Hamming search over ``mbedding_bin``, reranked by exact cosine distance."""
+        bits = bindparam("bits", quantize_binary(vector), type_=VECTOR_BIT(EMBEDDING_DIM))
+        candidates = (
+            select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key, ImageRecord.mbedding)
+            .where(ImageRecord.profile_id == profile_id)
+            .order_by(ImageRecord.mbedding_bin.hamming_distance(bits))
+            .limit(config.search.rerank_candidates)
+            .subquery("candidates")
+        )
+        query = bindparam("query", vector, type_=Vector(EMBEDDING_DIM))
+        distance = candidates.c.mbedding.cosine_distance(query).label("distance")
+        return (
+            select(candidates.c.id, candidates.c.file_path, candidates.c.s3_key, distance)
+            .order_by(distance)
+            .limit(limit)
+        )
+
+    @staticmethod
+    def _unnest_queries(**arrays):
+        """``unnest(...) WITH ORDINALITY AS queries(<names>, ord)`` of equally long arrays.
+
+        ``arrays`` maps a column name to ``(type, values)``; every value is
+        bound as its own parameter, so vectors keep their binary encoding.
+        """
+        elements = []
+        for name, (type_, values) in arrays.items():
+            elements.append(postgresql.array([
+                cast(bindparam(f"{name}_{i}", value, type_=type_), type_)
+                for i, value in enumerate(values)
+            ]))
+        return (
+            func.unnest(*elements)
+            .table_valued(*arrays, with_ordinality="ord")
+            .render_derived(name="queries")
+        )
+
+    @classmethod
+    def _vector_batch_stmt(cls, vectors: List[np.ndarray], profile_id: int, limit: int):
+        """:meth:`_vector_stmt` of every vector in one statement.
+
+        Each query vector is joined LATERAL to the same ordered, limited
+        index scan as a single search; rows come with the 1-based ``ord``
+        of their query.
+        """
+        if config.search.storage_mode == "binary":
+            return cls._binary_rerank_batch_stmt(vectors, profile_id, limit)
+        queries = cls._unnest_queries(query=(HALFVEC(EMBEDDING_DIM), vectors))
+        distance = search_expression().cosine_distance(queries.c.query).label("distance")
+        nearest = (
+            select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key, distance)
+            .where(ImageRecord.profile_id == profile_id)
+            .order_by(distance)
+            .limit(limit)
+            .lateral("nearest")
+        )
+        return (
+            select(queries.c.ord, nearest)
+            .select_from(queries.join(nearest, true()))
+            .order_by(queries.c.ord, nearest.c.distance)
+        )
+
+    @classmethod
+    def _binary_rerank_batch_stmt(cls, vectors: List[np.ndarray], profile_id: int, limit: int):
+        """:meth:`_binary_rerank_stmt` of every vector in one statement."""
+        queries = cls._unnest_queries(
+            bits=(VECTOR_BIT(EMBEDDING_DIM), [quantize_binary(vector) for vector in vectors]),
+            query=(Vector(EMBEDDING_DIM), vectors),
+        )
+        candidates = (
+            select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key, ImageRecord.mbedding)
+            .where(ImageRecord.profile_id == profile_id)
+            .order_by(ImageRecord.mbedding_bin.hamming_distance(queries.c.bits))
+            .limit(config.search.rerank_candidates)
+            .lateral("candidates")
+        )
+        distance = candidates.c.mbedding.cosine_distance(queries.c.query).label("distance")
+        nearest = (
+            select(candidates.c.id, candidates.c.file_path, candidates.c.s3_key, distance)
+            .order_by(distance)
+            .limit(limit)
+            .lateral("nearest")
+        )
+        return (
+            select(queries.c.ord, nearest)
+            .select_from(queries.join(nearest, true()))
+            .order_by(queries.c.ord, nearest.c.distance)
+        )
+
+    @classmethod
+    def _phash_batch_stmt(cls, phashes: List[int], profile_id: int, max_distance: int, limit: int):
+        """:meth:`_phash_stmt` of every pHash in one statement, rows with their ``ord``."""
+        queries = cls._unnest_queries(phash=(BigInteger(), phashes))
+        same_band = or_(*[
+            phash_band(ImageRecord.phash, band) == phash_band(queries.c.phash, band)
+            for band in range(PHASH_BANDS)
+        ])
+        distance = func.bit_count(
+            cast(ImageRecord.phash.op("#")(queries.c.phash), BIT(64))
+        ).label("distance")
+        nearest = (
+            select(ImageRecord.id, ImageRecord.file_path, ImageRecord.s3_key, distance)
+            .where(ImageRecord.profile_id == profile_id, same_band)
+            .where(distance <= max_distance)
+            .order_by(distance, ImageRecord.id)
+            .limit(limit)
+            .lateral("nearest")
+        )
+        return (
+            select(queries.c.ord, nearest)
+            .select_from(queries.join(nearest, true()))
+            .order_by(queries.c.ord, nearest.c.distance, nearest.c.id)
+        )
+
+class ProfileService(AsyncBaseService):
+    async def create_profile(self, name) -> Profile:
         profile = Profile(name=name)
-        ProfileDataManager(self.session).add_one(profile)
+        manager = ProfileDataManager(self.session)
+        await manager.add_all([profile])
+        await manager.create_partition(profile.id)
+        await self.session.commit()
+        return profile
 
-    def get_profiles(self):
-        return ProfileDataManager(self.session).get_all_profiles()
+    async def get_profiles(self):
+        return await ProfileDataManager(self.session).get_all_profiles()
     
-    def delete_profile(self, name:str):
-        profile = ProfileDataManager(self.session).get_profile(name)
-        ProfileDataManager(self.session).delete_one(profile)
+    async def delete_profile(self, name:str):
+        profile = await ProfileDataManager(self.session).get_profile(name)
+        await ProfileDataManager(self.session).delete_one(profile)
+        get_search_backend().drop(profile.id)
+
+class ProfileDataManager(AsyncBaseDataManager):
+    async def get_profile(self, name: str):
+        return await self.get_one(select(Profile).where(Profile.name==name))
+
+    async def get_all_profiles(self):
+        return await self.get_all(select(Profile))
 
-class ProfileDataManager(BaseDataManager):
-    def get_profile(self, name: str):
-        return self.get_one(select(Profile).where(Profile.name==name))
+    async def create_partition(self, profile_id: int) -> None:
+        """Create partition of ``public.images`` holding the profile's images.
 
-    def get_all_profiles(self):
-        return self.get_all(select(Profile))
\ No newline at end of file
+        Indexes defined on ``public.images`` (vector and pHash band ones)
+        are created on the new partition automatically. Creating a partition
+        locks the parent table, so the transaction should be committed
+        right away.
+        """
+        partition = f"{ImageRecord.schema()}.{ImageRecord.table_name()}_p{int(profile_id)}"
+        await self.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition} "
+            f"PARTITION OF {ImageRecord.schema()}.{ImageRecord.table_name()} "
+            f"FOR VALUES IN ({int(profile_id)})"
+        ))
@@ -0,0 +1,257 @@
+"""Search backends behind ``ImageDataManager.get_vector_distance``.
+
+``search.backend`` selects where the nearest images of a profile are
+found: ``"pgvector"`` runs the index scan in Postgres, ``"memory"`` keeps
+every profile's embeddings in a :class:`~app.core.vector_index.ProfileIndex`
+of the process and only goes to the database for the rows of the matches
+that pass the threshold, and to keep the index in sync.
+"""
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import numpy as np
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+from app.core.embeder import model_version
+from app.core.executor import cpu_executor
+from app.core.vector_index import ProfileIndex
+from app.schemas.images import ImageMatch
+
+if TYPE_CHECKING:
+    from app.services.images import ImageDataManager
+
+BACKENDS = ("pgvector", "memory")
+
+# Rows read per query while loading or catching up an index
+SYNC_PAGE_ROWS = 5000
+
+
+class SearchBackend(ABC):
+    """Finds the images of a profile nearest to an embedding.
+
+    Backends implement :meth:`search`; the other methods are hooks with
+    working defaults.
+    """
+
+    name = ""
+
+    @abstractmethod
+    async def search(
+        self,
+        manager: "ImageDataManager",
+        vector: np.ndarray,
+        profile_id: int,
+        threshold: float,
+        limit: int,
+    ) -> List[ImageMatch]:
+        """Images at least ``threshold`` similar to ``vector``, most similar first."""
+
+    async def search_many(
+        self,
+        manager: "ImageDataManager",
+        vectors: List[np.ndarray],
+        profile_id: int,
+        threshold: float,
+        limit: int,
+    ) -> List[List[ImageMatch]]:
+        """:meth:`search` for each of ``vectors``, in their order."""
+        return [await self.search(manager, vector, profile_id, threshold, limit) for vector in vectors]
+
+    def changed(self, profile_id: int) -> None:
+        """Images of the profile were stored or removed by this process."""
+
+    def drop(self, profile_id: int) -> None:
+        """The profile was deleted."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class PgvectorBackend(SearchBackend):
+    name = "pgvector"
+
+    async def search(self, manager, vector, profile_id, threshold, limit):
+        return await manager.get_pgvector_matches(vector, profile_id, threshold, limit)
+
+    async def search_many(self, manager, vectors, profile_id, threshold, limit):
+        return await manager.get_pgvector_matches_batch(vectors, profile_id, threshold, limit)
+
+
+class MemoryBackend(SearchBackend):
+    """Exact search over per-profile matrices loaded from the table.
+
+    A profile's index is loaded on its first search and synced again once
+    ``refresh`` seconds old, or on the next search after this process
+    stored images of the profile. A sync appends the rows above the index's
+    ``max_id`` and compares the number of rows (and of rows of the current
+    model version) with the table; on a mismatch, left by transactions
+    that committed out of id order, deleted images or re-embedded ones,
+    the ids are diffed and only the differing rows are reloaded. Searches
+    arriving during a sync use the index as it was.
+
+    Profiles with more than ``max_rows`` embeddings are searched by
+    ``fallback`` instead.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        fallback: SearchBackend,
+        dtype: str = "float32",
+        directory: str = "",
+        refresh: float = 5.0,
+        max_rows: int = 200_000,
+    ) -> None:
+        self.fallback = fallback
+        self.dtype = dtype
+        self.directory = directory
+        self.refresh = refresh
+        self.max_rows = max_rows
+        self.indexes: Dict[int, ProfileIndex] = {}
+        self.too_large: Dict[int, float] = {}
+        self.locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.syncs = 0
+        self.diffs = 0
+
+    async def search(self, manager, vector, profile_id, threshold, limit):
+        index = await self.get_index(manager, profile_id)
+        if index is None:
+            return await self.fallback.search(manager, vector, profile_id, threshold, limit)
+        ids, similarities = await cpu_executor.run(index.search, vector, limit)
+        return (await self._matches(manager, profile_id, [(ids, similarities)], threshold))[0]
+
+    async def search_many(self, manager, vectors, profile_id, threshold, limit):
+        if not vectors:
+            return []
+        index = await self.get_index(manager, profile_id)
+        if index is None:
+            return await self.fallback.search_many(manager, vectors, profile_id, threshold, limit)
+        found = await cpu_executor.run(index.search_many, np.stack(vectors), limit)
+        return await self._matches(manager, profile_id, found, threshold)
+
+    @staticmethod
+    async def _matches(manager: "ImageDataManager", profile_id: int, found: list, threshold: float) -> List[List[ImageMatch]]:
+        """Matches of the ``(ids, similarities)`` of every query, rows read in one query."""
+        hits = [
+            {int(id_): float(similarity) for id_, similarity in zip(ids, similarities) if similarity >= threshold}
+            for ids, similarities in found
+        ]
+        wanted = sorted(set().union(*hits))
+        if not wanted:
+            return [[] for _ in hits]
+        # Images removed since the last sync are not found and drop out
+        rows = {row.id: row for row in await manager.get_images(wanted, profile_id)}
+        results = []
+        for query_hits in hits:
+            matches = [
+                ImageMatch(id=id_, file_path=rows[id_].file_path, similarity=similarity, s3_key=rows[id_].s3_key)
+                for id_, similarity in query_hits.items()
+                if id_ in rows
+            ]
+            matches.sort(key=lambda match: (-match.similarity, match.id))
+            results.append(matches)
+        return results
+
+    async def get_index(self, manager: "ImageDataManager", profile_id: int) -> Optional[ProfileIndex]:
+        """The synced index of the profile, ``None`` if it is too large."""
+        index = self.indexes.get(profile_id)
+        lock = self.locks[profile_id]
+        if index is not None and (time.monotonic() - index.synced_at < self.refresh or lock.locked()):
+            return index
+        async with lock:
+            index = self.indexes.get(profile_id)
+            now = time.monotonic()
+            if index is not None and now - index.synced_at < self.refresh:
+                return index
+            if now - self.too_large.get(profile_id, -self.refresh) < self.refresh:
+                return None
+            version = model_version()
+            counts = await manager.count_embeddings(profile_id, version)
+            if counts["total"] > self.max_rows:
+                self.indexes.pop(profile_id, None)
+                self.too_large[profile_id] = now
+                return None
+            self.too_large.pop(profile_id, None)
+            if index is None:
+                index = ProfileIndex(EMBEDDING_DIM, self.dtype, self.directory)
+                self.indexes[profile_id] = index
+            await self._sync(manager, profile_id, index, version)
+            index.synced_at = now
+            return index
+
+    async def _sync(self, manager: "ImageDataManager", profile_id: int, index: ProfileIndex, version: str) -> None:
+        self.syncs += 1
+        while True:
+            rows = await manager.get_embeddings(profile_id, version, after_id=index.max_id, limit=SYNC_PAGE_ROWS)
+            await self._append(index, rows)
+            if len(rows) < SYNC_PAGE_ROWS:
+                break
+        counts = await manager.count_embeddings(profile_id, version)
+        if (counts["total"], counts["current"]) == (index.size, index.current_count):
+            return
+
+        self.diffs += 1
+        rows = await manager.get_embedding_ids(profile_id, version)
+        db_ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        db_current = np.fromiter((row.current for row in rows), dtype=bool, count=len(rows))
+        snapshot = index.snapshot
+        # A row is up to date if both its id and version flag match
+        local_keys = snapshot.ids * 2 + snapshot.current
+        db_keys = db_ids * 2 + db_current
+        await cpu_executor.run(index.remove, snapshot.ids[~np.isin(local_keys, db_keys)])
+        missing = db_ids[~np.isin(db_keys, local_keys)]
+        for start in range(0, len(missing), SYNC_PAGE_ROWS):
+            chunk = missing[start:start + SYNC_PAGE_ROWS].tolist()
+            await self._append(index, await manager.get_embeddings(profile_id, version, ids=chunk))
+
+    @staticmethod
+    async def _append(index: ProfileIndex, rows: list) -> None:
+        if not rows:
+            return
+        ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        current = np.fromiter((row.current for row in rows), dtype=bool, count=len(rows))
+        vectors = np.stack([row.embedding for row in rows])
+        await cpu_executor.run(index.append, ids, vectors, current)
+
+    def changed(self, profile_id: int) -> None:
+        index = self.indexes.get(profile_id)
+        if index is not None:
+            index.synced_at = 0.0
+        self.too_large.pop(profile_id, None)
+
+    def drop(self, profile_id: int) -> None:
+        self.indexes.pop(profile_id, None)
+        self.too_large.pop(profile_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "dtype": self.dtype,
+            "profiles": {str(profile_id): index.stats() for profile_id, index in self.indexes.items()},
+            "fallback_profiles": len(self.too_large),
+            "bytes": sum(index.nbytes for index in self.indexes.values()),
+            "syncs": self.syncs,
+            "diffs": self.diffs,
+        }
+
+
+@lru_cache
+def get_search_backend() -> SearchBackend:
+    backend = config.search.backend
+    if backend == "pgvector":
+        return PgvectorBackend()
+    if backend == "memory":
+        return MemoryBackend(
+            PgvectorBackend(),
+            dtype=config.search.memory_dtype,
+            directory=config.search.memory_dir,
+            refresh=config.search.memory_refresh,
+            max_rows=config.search.memory_max_rows,
+        )
+    raise ValueError(f"Unsupported search backend: {backend}; expected one of {BACKENDS}")
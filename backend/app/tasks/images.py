@@ -0,0 +1,99 @@
+"""Image ingestion and clustering tasks.
+
+Uploads are staged to S3 by the API and ingested here. Run workers with
+the thread pool, e.g.::
+
+    celery -A app.core.celery_app worker -P threads -c 16
+
+Tasks executing concurrently in one worker share its ``embedder``, so
+their images are embedded in common batches; more throughput is had by
+adding worker processes.
+"""
+import asyncio
+import logging
+import uuid
+from pathlib import PurePath
+
+from botocore.exceptions import BotoCoreError
+from celery.signals import worker_ready
+from PIL import UnidentifiedImageError
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from app.core.celery_app import celery_app
+from app.core.config import config
+from app.core.embeder import embedder
+from app.core.s3_storage import get_s3_manager
+from app.core.session import task_session_scope
+from app.jobs.cluster import cluster_profile as cluster_profile_groups
+from app.schemas.images import TaskStatus
+from app.services.images import ImageService
+
+
+@worker_ready.connect
+def warm_up_embedder(**kwargs) -> None:
+    if config.embedder.warmup:
+        embedder.warmup()
+
+
+async def _ingest_image(data: bytes, filename: str, profile_id: int, s3_key: str) -> dict:
+    async with task_session_scope() as session:
+        record = await ImageService(session).store_image(data, filename, profile_id, s3_key)
+        return {"id": record.id, "file": filename, "s3_key": s3_key}
+
+
+@celery_app.task(
+    name="images.ingest_image",
+    autoretry_for=(OSError, BotoCoreError, OperationalError, InterfaceError),
+    dont_autoretry_for=(UnidentifiedImageError,),
+    retry_backoff=True,
+    max_retries=config.celery.max_retries,
+)
+def ingest_image(s3_key: str, filename: str, profile_id: int) -> dict:
+    """Embed an image staged to S3 and store it in the profile."""
+    data = get_s3_manager().read_object(s3_key)
+    result = asyncio.run(_ingest_image(data, filename, profile_id, s3_key))
+    enqueue_clustering(profile_id)
+    return result
+
+
+@celery_app.task(
+    name="images.cluster_profile",
+    autoretry_for=(OSError, OperationalError, InterfaceError),
+    retry_backoff=True,
+    max_retries=config.celery.max_retries,
+)
+def cluster_profile(profile_id: int) -> dict:
+    """Join the profile's new images into its duplicate groups.
+
+    Groups that have to be rebuilt are rebuilt through the search
+    backend (``--method index`` of ``app.jobs.cluster``), which keeps the
+    worker's memory flat.
+    """
+    return asyncio.run(cluster_profile_groups(profile_id, method="index"))
+
+
+def staging_key(filename: str, profile_id: int) -> str:
+    """S3 key of a new upload to the profile, keeping the file's extension."""
+    suffix = PurePath(filename or "").suffix
+    return f"{config.s3.upload_prefix}{profile_id}/{uuid.uuid4().hex}{suffix}"
+
+
+def enqueue_ingestion(s3_key: str, filename: str, profile_id: int) -> TaskStatus:
+    """Queue the ingestion of an image staged to S3. Blocking."""
+    task = ingest_image.delay(s3_key, filename, profile_id)
+    return TaskStatus(task_id=task.id, status=task.state)
+
+
+def enqueue_clustering(profile_id: int) -> None:
+    """Queue an update of the profile's duplicate groups if ``cluster.on_load``. Blocking.
+
+    The update runs ``cluster.on_load_delay`` seconds later, so that it
+    covers the images loaded in the meantime too. A broker failure is
+    logged rather than failing the load.
+    """
+    if not config.cluster.on_load:
+        return
+    try:
+        cluster_profile.apply_async((profile_id,), countdown=config.cluster.on_load_delay)
+    except Exception:
+        logging.warning("Cannot queue clustering of profile %s", profile_id, exc_info=True)
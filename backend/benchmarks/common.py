@@ -0,0 +1,65 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks are run from the ``backend`` directory, e.g.
+``python -m benchmarks.embedding_throughput --output results.json``.
+Every script prints its results and optionally writes them as JSON,
+so that runs on different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+
+def make_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    return parser
+
+
+def timeit(fn: Callable[[], Any], repeat: int = 10, warmup: int = 2) -> List[float]:
+    """Run ``fn`` ``warmup + repeat`` times, return the last ``repeat`` durations in seconds."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    return {
+        "mean_ms": statistics.fmean(durations) * 1000,
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p95_ms": percentile(durations, 95) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+    }
+
+
+def write_results(name: str, results: Any, output: Optional[str] = None) -> None:
+    payload = {
+        "benchmark": name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    text = json.dumps(payload, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as fp:
+            fp.write(text)
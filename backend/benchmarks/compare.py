@@ -0,0 +1,64 @@
+"""Compare two results files written with ``--output``.
+
+Prints every numeric result present in both runs, the ratio of the new
+value to the old one and, with ``--threshold``, marks the ratios that
+moved by more than that fraction::
+
+    python -m benchmarks.stages --output before.json
+    git checkout feature && python -m benchmarks.stages --output after.json
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+"""
+import json
+from typing import Any, Dict
+
+from benchmarks.common import make_parser
+
+
+def flatten(value: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of ``value`` keyed by their dotted path."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    else:
+        return {}
+    leaves = {}
+    for key, item in items:
+        leaves.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return leaves
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.0, help="Mark changes larger than this fraction.")
+    args = parser.parse_args()
+
+    runs = []
+    for path in (args.before, args.after):
+        with open(path) as fileobj:
+            runs.append(json.load(fileobj))
+    before, after = (run["results"] for run in runs)
+    if runs[0]["benchmark"] != runs[1]["benchmark"]:
+        print(f"Warning: comparing {runs[0]['benchmark']} with {runs[1]['benchmark']}")
+
+    old, new = flatten(before), flatten(after)
+    keys = [key for key in old if key in new]
+    width = max((len(key) for key in keys), default=0)
+    rows = []
+    for key in keys:
+        ratio = new[key] / old[key] if old[key] else None
+        mark = "*" if ratio is not None and args.threshold and abs(ratio - 1) > args.threshold else ""
+        ratio_text = f"{ratio:8.3f}" if ratio is not None else "       -"
+        print(f"{key:<{width}}  {old[key]:>14.4f}  {new[key]:>14.4f}  {ratio_text} {mark}")
+        rows.append({"key": key, "before": old[key], "after": new[key], "ratio": ratio})
+    if args.output:
+        with open(args.output, "w") as fileobj:
+            json.dump(rows, fileobj, indent=2)
+
+
+if __name__ == "__main__":
+    main()
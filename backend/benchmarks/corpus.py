@@ -0,0 +1,97 @@
+"""Synthetic image corpus with near-duplicates.
+
+Draws ``--originals`` pictures (shapes and gradients, so that pHash and
+embeddings have structure to work with) and derives near-duplicates of
+each: ``resize`` (half size), ``recompress`` (JPEG quality 30) and
+``crop`` (central 80%). ``--distinct`` more pictures are kept apart, as
+queries that should match nothing. The same seed gives the same corpus::
+
+    python -m benchmarks.corpus --out corpus --originals 500 --distinct 100
+
+Layout: ``originals/``, ``variants/``, ``distinct/`` and ``manifest.json``
+listing every file relative to ``--out``, variants with their original.
+``benchmarks.seed`` loads the originals, ``benchmarks.load`` queries with
+variants and distinct pictures.
+"""
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from benchmarks.common import make_parser, write_results
+
+SIZE = (640, 480)
+VARIANTS = ("resize", "recompress", "crop")
+
+
+def draw_image(rng: np.random.Generator, size=SIZE) -> Image.Image:
+    width, height = size
+    start, end = rng.integers(0, 256, (2, 3))
+    ramp = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    background = (start + (end - start) * ramp).astype(np.uint8)
+    image = Image.fromarray(np.repeat(background, height, axis=0))
+    draw = ImageDraw.Draw(image)
+    for _ in range(int(rng.integers(4, 12))):
+        x0, x1 = sorted(rng.integers(0, width, 2))
+        y0, y1 = sorted(rng.integers(0, height, 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+
+def make_variant(image: Image.Image, kind: str) -> Image.Image:
+    width, height = image.size
+    if kind == "resize":
+        return image.resize((width // 2, height // 2), Image.BILINEAR)
+    if kind == "crop":
+        dx, dy = width // 10, height // 10
+        return image.crop((dx, dy, width - dx, height - dy))
+    if kind == "recompress":
+        return image
+    raise ValueError(f"Unknown variant: {kind}")
+
+
+def generate(out: Path, originals: int, distinct: int, seed: int) -> Dict[str, List]:
+    rng = np.random.default_rng(seed)
+    for folder in ("originals", "variants", "distinct"):
+        (out / folder).mkdir(parents=True, exist_ok=True)
+    manifest: Dict[str, List] = {"originals": [], "variants": [], "distinct": []}
+    for i in range(originals):
+        image = draw_image(rng)
+        name = f"originals/{i:06d}.jpg"
+        image.save(out / name, quality=90)
+        manifest["originals"].append(name)
+        for kind in VARIANTS:
+            variant = f"variants/{i:06d}_{kind}.jpg"
+            make_variant(image, kind).save(out / variant, quality=30 if kind == "recompress" else 90)
+            manifest["variants"].append({"file": variant, "original": name, "kind": kind})
+    for i in range(distinct):
+        name = f"distinct/{i:06d}.jpg"
+        draw_image(rng).save(out / name, quality=90)
+        manifest["distinct"].append(name)
+    (out / "manifest.json").write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+def load_manifest(corpus: str) -> Dict[str, List]:
+    return json.loads((Path(corpus) / "manifest.json").read_text())
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--out", default="corpus")
+    parser.add_argument("--originals", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = generate(Path(args.out), args.originals, args.distinct, args.seed)
+    write_results("corpus", {key: len(value) for key, value in manifest.items()}, args.output)
+
+
+if __name__ == "__main__":
+    main()
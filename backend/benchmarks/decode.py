@@ -0,0 +1,148 @@
+"""Decode time and peak memory of large uploads, full vs reduced decode.
+
+Decodes every image with ``decode.reduce`` off (full resolution, as before
+draft mode) and on, and times pHash and ``to_model_input`` of the result. Each
+mode and format runs in a fresh interpreter so that peak RSS is its own::
+
+    python -m benchmarks.decode --megapixels 12 48
+    python -m benchmarks.decode --corpus ~/photos --repeat 3
+
+Without ``--corpus`` a synthetic JPEG, PNG and WebP image is generated
+per size.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import make_parser, summarize, write_results
+
+FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+# Memory is read from /proc (Linux only): ru_maxrss of a child process
+# starts from the parent's RSS.
+PROBE = """
+import json, sys, time
+from app.core.preprocess import decode_image, to_model_input
+from app.services.images import compute_phash
+
+def memory_kb(field):
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith(field))
+
+paths, repeat = json.loads(sys.argv[1]), int(sys.argv[2])
+blobs = [open(path, "rb").read() for path in paths]
+# Current RSS rather than the peak so far, which reading the files may have raised
+baseline = memory_kb("VmRSS:")
+
+decode, phash = [], []
+for data in blobs:
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = decode_image(data)
+        decoded = time.perf_counter()
+        compute_phash(image)
+        decode.append(decoded - start)
+        phash.append(time.perf_counter() - decoded)
+        del image
+peak = memory_kb("VmHWM:")
+
+images = [decode_image(data) for data in blobs]
+preprocess = []
+for image in images:
+    for _ in range(repeat):
+        start = time.perf_counter()
+        to_model_input(image)
+        preprocess.append(time.perf_counter() - start)
+print(json.dumps({
+    "decode": decode,
+    "phash": phash,
+    "model_input": preprocess,
+    "peak_rss_delta_mb": (peak - baseline) / 1024,
+}))
+"""
+
+
+def synthetic_image(megapixels: float, rng: np.random.Generator) -> Image.Image:
+    """Smooth gradients with mild noise, compressing roughly like a photo."""
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [
+        128 + 100 * np.sin(x / (40 + 30 * c) + y / (70 + 20 * c)) + rng.normal(0, 6, (height, width))
+        for c in range(3)
+    ]
+    return Image.fromarray(np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8))
+
+
+def generate_corpus(directory: Path, sizes: List[float], seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    for megapixels in sizes:
+        image = synthetic_image(megapixels, rng)
+        for suffix in (".jpg", ".png", ".webp"):
+            image.save(directory / f"synthetic_{megapixels:g}mp{suffix}", quality=90)
+
+
+def run_probe(paths: List[str], repeat: int, reduce: bool) -> dict:
+    # Budgets are lifted so that large corpus files are measured, not rejected
+    env = {
+        **os.environ,
+        "MYAPI_DECODE__REDUCE": str(reduce).lower(),
+        "MYAPI_DECODE__MAX_BYTES": str(1 << 40),
+        "MYAPI_DECODE__MAX_PIXELS": str(1 << 40),
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, json.dumps(paths), str(repeat)],
+        check=True, capture_output=True, text=True, env=env,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return {
+        "decode": summarize(result["decode"]),
+        "phash": summarize(result["phash"]),
+        "model_input": summarize(result["model_input"]),
+        "peak_rss_delta_mb": result["peak_rss_delta_mb"],
+    }
+
+
+def bench(directory: Path, repeat: int) -> List[Dict]:
+    groups = defaultdict(list)
+    for path in sorted(directory.rglob("*")):
+        if path.suffix.lower() in FORMATS:
+            groups[FORMATS[path.suffix.lower()]].append(str(path))
+    results = []
+    for image_format, paths in groups.items():
+        results.append({
+            "format": image_format,
+            "files": len(paths),
+            "full": run_probe(paths, repeat, reduce=False),
+            "reduced": run_probe(paths, repeat, reduce=True),
+        })
+    return results
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--corpus", help="Directory of JPEG/PNG/WebP images.")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[12, 48])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.corpus:
+        results = bench(Path(args.corpus), args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            generate_corpus(Path(tmp), args.megapixels, args.seed)
+            results = bench(Path(tmp), args.repeat)
+    write_results("decode", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
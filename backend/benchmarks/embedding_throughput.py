@@ -0,0 +1,62 @@
+"""Embedding throughput on CPU.
+
+Measures images/sec of a direct forward pass at fixed batch sizes and of
+the micro-batching engine fed by concurrent single-image callers::
+
+    python -m benchmarks.embedding_throughput --batch-sizes 1 8 32 64
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from app.core.config import config
+from app.core.embeder import BatchingEmbedder
+from app.core.inference import build_feature_extractor
+from benchmarks.common import make_parser, summarize, timeit, write_results
+
+
+def bench_forward(engine: BatchingEmbedder, batch_size: int, repeat: int) -> dict:
+    batch = torch.randn(batch_size, 3, 224, 224)
+    durations = timeit(lambda: engine.forward(batch), repeat=repeat)
+    return {
+        "batch_size": batch_size,
+        "images_per_sec": batch_size * len(durations) / sum(durations),
+        **summarize(durations),
+    }
+
+
+def bench_concurrent(engine: BatchingEmbedder, clients: int, images: int) -> dict:
+    pixels = [np.random.randint(0, 256, (224, 224, 3), dtype=np.uint8) for _ in range(images)]
+    engine.embed_batch(pixels[:clients])  # warmup
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        durations = timeit(lambda: list(pool.map(engine.embed, pixels)), repeat=3, warmup=0)
+    return {
+        "clients": clients,
+        "max_batch_size": engine.max_batch_size,
+        "images_per_sec": images * len(durations) / sum(durations),
+    }
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads, 0 keeps default")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    feature_extractor = build_feature_extractor(config.embedder.weights_path, config.embedder.mmap_weights)
+    results = {"torch_threads": torch.get_num_threads(), "forward": [], "engine": []}
+    for batch_size in args.batch_sizes:
+        engine = BatchingEmbedder(feature_extractor, max_batch_size=batch_size)
+        results["forward"].append(bench_forward(engine, batch_size, args.repeat))
+        results["engine"].append(bench_concurrent(engine, args.clients, args.clients * 4))
+    write_results("embedding_throughput", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
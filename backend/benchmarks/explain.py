@@ -0,0 +1,153 @@
+"""Check that the search queries are served by their indexes.
+
+Runs ``EXPLAIN (FORMAT JSON)`` on the statements of
+:meth:`ImageDataManager.get_pgvector_matches` (in the configured storage
+mode) and :meth:`ImageDataManager.get_phash_matches`, single and batched
+(``/images/check/batch``), for a profile of the configured database, and
+asserts that:
+
+* the vector searches scan an ``hnsw`` or ``ivfflat`` index;
+* the pHash searches scan the btree band indexes;
+* neither reads an images partition by a sequential scan.
+
+Exits with status 1 if a check fails, so it can guard a deploy or a
+migration. On small partitions the planner rightly prefers a sequential
+scan; ``--force-index`` sets ``enable_seqscan = off`` to check that the
+indexes are usable at all::
+
+    python -m benchmarks.explain --profile bench-0
+"""
+import asyncio
+import json
+import sys
+from typing import Dict, Iterator, List
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+from app.core.session import task_session_scope
+from app.models.images import ImageRecord
+from app.services.images import ImageDataManager, ProfileDataManager
+from benchmarks.common import make_parser, write_results
+
+VECTOR_METHODS = {"hnsw", "ivfflat"}
+CHECKS = ("vector", "phash", "vector_batch", "phash_batch")
+
+
+async def explain(session: AsyncSession, stmt) -> dict:
+    """``EXPLAIN (FORMAT JSON)`` of ``stmt`` with its parameters bound."""
+    compiled = stmt.compile(dialect=session.bind.dialect)
+    params = compiled.construct_params()
+    values = [params[name] for name in compiled.positiontup]
+    # Through the driver, since EXPLAIN is not a statement SQLAlchemy can build
+    connection = await (await session.connection()).get_raw_connection()
+    plan = await connection.driver_connection.fetchval(f"EXPLAIN (FORMAT JSON) {compiled.string}", *values)
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+def walk(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+async def access_methods(session: AsyncSession, names: List[str]) -> Dict[str, str]:
+    connection = await (await session.connection()).get_raw_connection()
+    rows = await connection.driver_connection.fetch(
+        "SELECT c.relname, a.amname FROM pg_class c JOIN pg_am a ON a.oid = c.relam "
+        "WHERE c.relname = ANY($1::text[])",
+        names,
+    )
+    return {row["relname"]: row["amname"] for row in rows}
+
+
+async def check(session: AsyncSession, plan: dict, methods: set, condition: str = "") -> dict:
+    """Whether ``plan`` scans an index of ``methods`` (with ``condition`` in its
+    index condition) and no images partition sequentially."""
+    nodes = list(walk(plan))
+    indexes = sorted({
+        node["Index Name"]
+        for node in nodes
+        if "Index Name" in node and condition in node.get("Index Cond", "")
+    })
+    used = await access_methods(session, indexes)
+    seq_scans = sorted({
+        node.get("Relation Name", "")
+        for node in nodes
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name", "").startswith(ImageRecord.table_name())
+    })
+    failures = []
+    if not any(method in methods for method in used.values()):
+        failures.append(f"no {'/'.join(sorted(methods))} index scanned")
+    if seq_scans:
+        failures.append(f"sequential scan of {', '.join(seq_scans)}")
+    return {
+        "ok": not failures,
+        "failures": failures,
+        "indexes": used,
+        "nodes": [node["Node Type"] for node in nodes],
+        "total_cost": plan["Total Cost"],
+    }
+
+
+async def run(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    vector = rng.gamma(0.5, 1.0, EMBEDDING_DIM).astype(np.float32)
+    phash = int(rng.integers(-(1 << 63), (1 << 63) - 1))
+    limit = config.search.top_k
+
+    async with task_session_scope() as session:
+        profile = await ProfileDataManager(session).get_profile(args.profile)
+        if profile is None:
+            raise SystemExit(f"Profile '{args.profile}' not found")
+        manager = ImageDataManager(session)
+        await manager.configure_search()
+        if args.force_index:
+            await session.execute(text("SET LOCAL enable_seqscan = off"))
+        max_distance = config.search.phash_max_distance
+        plans = {
+            "vector": await explain(session, manager._vector_stmt(vector, profile.id, limit)),
+            "phash": await explain(session, manager._phash_stmt(phash, profile.id, max_distance, limit)),
+            "vector_batch": await explain(
+                session, manager._vector_batch_stmt([vector, vector[::-1].copy()], profile.id, limit)
+            ),
+            "phash_batch": await explain(
+                session, manager._phash_batch_stmt([phash, ~phash], profile.id, max_distance, limit)
+            ),
+        }
+        results = {
+            "profile": args.profile,
+            "storage_mode": config.search.storage_mode,
+            "force_index": args.force_index,
+        }
+        for name in CHECKS:
+            plan = plans[name]
+            if name.startswith("vector"):
+                results[name] = await check(session, plan, VECTOR_METHODS)
+            else:
+                # The profile_id index is a btree too, only band conditions count
+                results[name] = await check(session, plan, {"btree"}, condition="phash")
+            if args.plans:
+                results[name]["plan"] = plan
+        await session.rollback()
+    return results
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--profile", default="bench-0")
+    parser.add_argument("--force-index", action="store_true", help="Disable sequential scans for the checks.")
+    parser.add_argument("--plans", action="store_true", help="Include the full plans in the results.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    write_results("explain", results, args.output)
+    if not all(results[name]["ok"] for name in CHECKS):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
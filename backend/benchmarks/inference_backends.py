@@ -0,0 +1,73 @@
+"""Latency, throughput and parity of the inference backends.
+
+Runs every backend whose artifact exists (export them first with
+``python -m app.jobs.export_model``) at fixed batch sizes and compares its
+embeddings with the eager model::
+
+    python -m benchmarks.inference_backends --batch-sizes 1 8 32
+    python -m benchmarks.inference_backends --backends eager onnx int8
+"""
+import logging
+
+import torch
+
+from app.core.config import config
+from app.core.inference import (
+    ARTIFACTS,
+    BACKENDS,
+    artifact_path,
+    build_feature_extractor,
+    compare_outputs,
+    load_backend,
+)
+from benchmarks.common import make_parser, summarize, timeit, write_results
+
+
+def bench_backend(model, batch_sizes, repeat) -> list:
+    results = []
+    for batch_size in batch_sizes:
+        batch = torch.randn(batch_size, 3, 224, 224)
+
+        def forward():
+            with torch.inference_mode():
+                model(batch)
+
+        durations = timeit(forward, repeat=repeat)
+        results.append({
+            "batch_size": batch_size,
+            "images_per_sec": batch_size * len(durations) / sum(durations),
+            **summarize(durations),
+        })
+    return results
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--artifact-dir", default=config.embedder.artifact_dir)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 keeps default")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    eager = build_feature_extractor(config.embedder.weights_path, config.embedder.mmap_weights)
+    parity_batch = torch.randn(8, 3, 224, 224)
+    results = {"torch_threads": torch.get_num_threads(), "backends": []}
+    for backend in args.backends:
+        if backend in ARTIFACTS and not artifact_path(backend, args.artifact_dir).exists():
+            logging.warning("Skipping %s: no artifact in %s", backend, args.artifact_dir)
+            continue
+        model = load_backend(backend, args.artifact_dir, args.threads, model=eager)
+        results["backends"].append({
+            "backend": backend,
+            "parity": compare_outputs(eager, model, parity_batch),
+            "forward": bench_backend(model, args.batch_sizes, args.repeat),
+        })
+    write_results("inference_backends", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Rows per second of the bulk insert methods of ``ImageDataManager``.
+
+Inserts ``--rows`` synthetic images in chunks of ``--chunk-size`` (one
+transaction each, as the bulk endpoint does) with every
+``ingest.insert_method`` into a temporary profile of the configured
+database, which is dropped afterwards::
+
+    python -m benchmarks.insert_methods --rows 5000 --chunk-size 64
+    MYAPI_SEARCH__STORAGE_MODE=binary python -m benchmarks.insert_methods
+
+Vector indexes of the storage mode are maintained on insert, so absolute
+numbers depend on the table size; compare methods within one run.
+"""
+import asyncio
+import time
+import uuid
+
+import numpy as np
+from sqlalchemy import delete, text
+
+from app.const import EMBEDDING_DIM
+from app.core.session import task_session_scope
+from app.models.images import ImageRecord, Profile
+from app.services.images import ImageDataManager, ImageService, ProfileService, embedding_columns
+from benchmarks.common import make_parser, write_results
+
+METHODS = ("orm", "executemany", "copy")
+
+
+def make_records(profile_id: int, count: int, rng: np.random.Generator) -> list:
+    records = []
+    for i in range(count):
+        phash = int(rng.integers(-(1 << 63), (1 << 63) - 1))
+        record = ImageService._build_record(phash, f"benchmark/{i}.jpg", profile_id)
+        emb = rng.gamma(0.5, 1.0, EMBEDDING_DIM).astype(np.float32)
+        for column, value in embedding_columns(emb).items():
+            setattr(record, column, value)
+        records.append(record)
+    return records
+
+
+async def bench_method(method: str, profile_id: int, rows: int, chunk_size: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    elapsed = 0.0
+    for start in range(0, rows, chunk_size):
+        records = make_records(profile_id, min(chunk_size, rows - start), rng)
+        began = time.perf_counter()
+        async with task_session_scope() as session:
+            await ImageDataManager(session).insert_images(records, method=method)
+        elapsed += time.perf_counter() - began
+        assert all(record.id is not None for record in records)
+    return {"method": method, "seconds": elapsed, "rows_per_sec": rows / elapsed}
+
+
+async def run(args) -> dict:
+    async with task_session_scope() as session:
+        profile = await ProfileService(session).create_profile(f"benchmark-{uuid.uuid4().hex[:8]}")
+    try:
+        results = []
+        for method in args.methods:
+            results.append(await bench_method(method, profile.id, args.rows, args.chunk_size, args.seed))
+            async with task_session_scope() as session:
+                await session.execute(delete(ImageRecord).where(ImageRecord.profile_id == profile.id))
+        return {"rows": args.rows, "chunk_size": args.chunk_size, "methods": results}
+    finally:
+        async with task_session_scope() as session:
+            await session.execute(text(
+                f"DROP TABLE IF EXISTS {ImageRecord.schema()}.{ImageRecord.table_name()}_p{int(profile.id)}"
+            ))
+            await session.execute(delete(Profile).where(Profile.id == profile.id))
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_results("insert_methods", asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
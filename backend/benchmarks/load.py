@@ -0,0 +1,206 @@
+"""Concurrent HTTP load against ``/api/images/check``.
+
+``--concurrency`` clients send corpus pictures in a closed loop for
+``--duration`` seconds (or ``--requests`` in total): near-duplicate
+variants of the originals seeded by ``benchmarks.seed``, and with
+``--distinct-fraction`` pictures that should match nothing. Reports
+throughput, latency percentiles overall and by variant kind, status
+codes, and how often the original was the top match (``hit_rate``) or
+anything matched a distinct picture (``false_match_rate``).
+
+With ``--batch-size`` every request sends that many pictures to
+``/api/images/check/batch`` instead; latencies are then per request and
+``images_per_sec`` counts pictures.
+
+Without ``--url`` the app is started as ``uvicorn app.main:app`` with the
+current configuration on a free port and stopped afterwards; requests
+are sent once ``/ready`` answers::
+
+    python -m benchmarks.load --corpus corpus --profile bench-0 --concurrency 16 --duration 30
+    python -m benchmarks.load --url http://localhost:8000 --profile bench-0
+    python -m benchmarks.load --profile bench-0 --concurrency 2 --batch-size 100
+
+Needs ``httpx`` (``pip install -r benchmarks/requirements.txt``).
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import config
+from benchmarks.common import make_parser, summarize, write_results
+from benchmarks.corpus import load_manifest
+
+# (kind, file name, expected top match or None, bytes)
+Query = Tuple[str, str, Optional[str], bytes]
+
+
+def load_queries(corpus: str, distinct_fraction: float, seed: int) -> List[Query]:
+    manifest = load_manifest(corpus)
+    queries = [
+        (item["kind"], item["file"], item["original"], Path(corpus, item["file"]).read_bytes())
+        for item in manifest["variants"]
+    ]
+    distinct = [("distinct", name, None, Path(corpus, name).read_bytes()) for name in manifest["distinct"]]
+    if distinct and distinct_fraction > 0:
+        # Repeated so that distinct pictures make up the requested share
+        count = round(len(queries) * distinct_fraction / (1 - distinct_fraction))
+        queries += [distinct[i % len(distinct)] for i in range(count)]
+    random.Random(seed).shuffle(queries)
+    return queries
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(timeout: float) -> Iterator[str]:
+    """Run ``app.main:app`` in a child uvicorn, yield its base URL."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=os.environ.copy(),
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        # /ready only turns ready after the warmup
+        probe = "/ready" if config.embedder.warmup else "/health"
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise SystemExit(f"uvicorn exited with {process.returncode}")
+            try:
+                response = httpx.get(url + probe, timeout=2)
+                if response.status_code == 200:
+                    break
+                if response.json().get("status") == "failed":
+                    raise SystemExit(f"Embedder failed to load: {response.json().get('detail')}")
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"{url} is not ready after {timeout}s")
+            time.sleep(0.5)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+async def drive(url: str, args, queries: List[Query]) -> dict:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Counter = Counter()
+    outcomes: Counter = Counter()
+    params = {
+        "profile": args.profile,
+        "threshhold": args.threshold,
+        "limit": args.limit,
+    }
+    next_query = iter(range(args.requests or sys.maxsize))
+    deadline = time.monotonic() + args.duration
+
+    def count(expected: Optional[str], matches: list) -> None:
+        if expected is None:
+            outcomes["distinct_matched" if matches else "distinct_clean"] += 1
+        else:
+            outcomes["hit" if matches and matches[0]["file_path"] == expected else "miss"] += 1
+
+    async def client(http: httpx.AsyncClient) -> None:
+        for i in next_query:
+            if time.monotonic() > deadline:
+                break
+            kind, name, expected, data = queries[i % len(queries)]
+            start = time.perf_counter()
+            response = await http.post(
+                "/api/images/check",
+                params=params,
+                files={"file": (Path(name).name, data, "image/jpeg")},
+            )
+            latencies[kind].append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                count(expected, response.json())
+
+    async def batch_client(http: httpx.AsyncClient) -> None:
+        for i in next_query:
+            if time.monotonic() > deadline:
+                break
+            batch = [queries[(i * args.batch_size + j) % len(queries)] for j in range(args.batch_size)]
+            start = time.perf_counter()
+            response = await http.post(
+                "/api/images/check/batch",
+                params=params,
+                files=[("files", (Path(name).name, data, "image/jpeg")) for _, name, _, data in batch],
+            )
+            latencies["batch"].append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                for (_, _, expected, _), result in zip(batch, response.json()):
+                    count(expected, result["matches"])
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as http:
+        start = time.perf_counter()
+        worker = batch_client if args.batch_size else client
+        await asyncio.gather(*[worker(http) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+
+    total = sum(statuses.values())
+    variants = outcomes["hit"] + outcomes["miss"]
+    distinct = outcomes["distinct_matched"] + outcomes["distinct_clean"]
+    return {
+        "url": url,
+        "profile": args.profile,
+        "concurrency": args.concurrency,
+        "requests": total,
+        "seconds": elapsed,
+        "requests_per_sec": total / elapsed,
+        "batch_size": args.batch_size,
+        "images_per_sec": total * max(args.batch_size, 1) / elapsed,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "hit_rate": outcomes["hit"] / variants if variants else None,
+        "false_match_rate": outcomes["distinct_matched"] / distinct if distinct else None,
+        "latency": summarize([value for values in latencies.values() for value in values]),
+        "latency_by_kind": {kind: summarize(values) for kind, values in sorted(latencies.items())},
+    }
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--url", help="Base URL of a running API, started here if not given.")
+    parser.add_argument("--corpus", default="corpus")
+    parser.add_argument("--profile", default="bench-0")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests, 0 is unlimited.")
+    parser.add_argument("--batch-size", type=int, default=0, help="Pictures per /check/batch request, 0 uses /check.")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--limit", type=int, default=config.search.top_k)
+    parser.add_argument("--distinct-fraction", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queries = load_queries(args.corpus, args.distinct_fraction, args.seed)
+    if args.url:
+        results = asyncio.run(drive(args.url, args, queries))
+    else:
+        with serve(args.ready_timeout) as url:
+            results = asyncio.run(drive(url, args, queries))
+    write_results("load", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
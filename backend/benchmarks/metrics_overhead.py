@@ -0,0 +1,105 @@
+"""Cost of the Prometheus instrumentation per request.
+
+Measures one :func:`app.core.metrics.timed` block with metrics enabled
+and disabled, then requests to a FastAPI endpoint entering ``--stages``
+timed blocks (about as many as ``/images/check`` does) sent straight to
+the ASGI app, with :class:`MetricsMiddleware` and metrics enabled vs
+without both. Also times rendering ``/metrics``. No server, database or
+model is needed::
+
+    python -m benchmarks.metrics_overhead --requests 5000
+"""
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from app.core import metrics
+from app.core.config import config
+from benchmarks.common import make_parser, summarize, timeit, write_results
+
+
+def make_app(stages: int, middleware: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/images/{name}")
+    async def endpoint(name: str):
+        for i in range(stages):
+            with metrics.timed(f"benchmark_{i}"):
+                pass
+        return {"name": name}
+
+    if middleware:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+async def call(app: FastAPI) -> None:
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/images/a",
+        "raw_path": b"/images/a",
+        "query_string": b"",
+        "headers": [],
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("benchmark", 80),
+        "client": ("benchmark", 1),
+        "root_path": "",
+    }
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        pass
+
+    await app(scope, receive, send)
+
+
+async def time_requests(app: FastAPI, requests: int) -> float:
+    for _ in range(100):
+        await call(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return (time.perf_counter() - start) / requests
+
+
+def time_block(calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        with metrics.timed("benchmark_block"):
+            pass
+    return (time.perf_counter() - start) / calls
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--stages", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+
+    config.metrics.enabled = True
+    block_enabled = time_block(args.calls)
+    instrumented = asyncio.run(time_requests(make_app(args.stages, middleware=True), args.requests))
+    config.metrics.enabled = False
+    block_disabled = time_block(args.calls)
+    bare = asyncio.run(time_requests(make_app(args.stages, middleware=False), args.requests))
+    config.metrics.enabled = True
+
+    results = {
+        "timed_block_us": {"enabled": block_enabled * 1e6, "disabled": block_disabled * 1e6},
+        "request_us": {"bare": bare * 1e6, "instrumented": instrumented * 1e6},
+        "overhead_per_request_us": (instrumented - bare) * 1e6,
+        "stages": args.stages,
+        "render_metrics": summarize(timeit(metrics.render, repeat=50)),
+        "metrics_bytes": len(metrics.render()),
+    }
+    write_results("metrics_overhead", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
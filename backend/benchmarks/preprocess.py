@@ -0,0 +1,94 @@
+"""Model input preprocessing: torchvision chain vs uint8 batching.
+
+Checks that ``to_model_input`` + ``InputBatcher`` match the torchvision
+``Resize -> CenterCrop -> ToTensor -> Normalize`` chain within
+``--tolerance`` (exits with 1 otherwise), then times both per image and
+per batch::
+
+    python -m benchmarks.preprocess --batch-sizes 8 32
+"""
+import sys
+
+import numpy as np
+import torch
+import torchvision.transforms as T
+from PIL import Image
+
+from app.core.preprocess import CROP_SIZE, MEAN, RESIZE_SIZE, STD, InputBatcher, to_model_input
+from benchmarks.common import make_parser, summarize, timeit, write_results
+
+# Decoded sizes: reduced JPEG drafts, small uploads, portrait and odd shapes
+SIZES = [(500, 375), (375, 500), (640, 480), (1024, 768), (257, 999), (800, 800)]
+
+reference = T.Compose([
+    T.Resize(RESIZE_SIZE),
+    T.CenterCrop(CROP_SIZE),
+    T.ToTensor(),
+    T.Normalize(mean=MEAN, std=STD),
+])
+
+
+def random_images(count: int, rng: np.random.Generator) -> list:
+    images = []
+    for i in range(count):
+        width, height = SIZES[i % len(SIZES)]
+        images.append(Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)))
+    return images
+
+
+def max_difference(images: list) -> float:
+    expected = torch.stack([reference(image) for image in images])
+    actual = InputBatcher()([to_model_input(image) for image in images])
+    return (expected - actual).abs().max().item()
+
+
+def rate(durations: list, images: int) -> dict:
+    return {"images_per_sec": images * len(durations) / sum(durations), **summarize(durations)}
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = random_images(max(args.batch_sizes), rng)
+    difference = max_difference(images)
+
+    image = images[0]
+    results = {
+        "max_abs_difference": difference,
+        "per_image": {
+            "torchvision": rate(timeit(lambda: reference(image), repeat=args.repeat), 1),
+            "uint8": rate(timeit(lambda: InputBatcher()([to_model_input(image)]), repeat=args.repeat), 1),
+        },
+        "per_batch": [],
+    }
+    batcher = InputBatcher()
+    for batch_size in args.batch_sizes:
+        batch = images[:batch_size]
+        pixels = [to_model_input(image) for image in batch]
+        results["per_batch"].append({
+            "batch_size": batch_size,
+            "torchvision": rate(
+                timeit(lambda: torch.stack([reference(image) for image in batch]), repeat=args.repeat),
+                batch_size,
+            ),
+            "uint8": rate(
+                timeit(lambda: batcher([to_model_input(image) for image in batch]), repeat=args.repeat),
+                batch_size,
+            ),
+            # Normalization alone, as done by the embedder on already resized images
+            "uint8_batching_only": rate(timeit(lambda: batcher(pixels), repeat=args.repeat), batch_size),
+        })
+    write_results("preprocess", results, args.output)
+    if difference > args.tolerance:
+        print(f"Max difference {difference} exceeds tolerance {args.tolerance}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cost of presigning the URLs of a match list.
+
+Compares botocore's ``generate_presigned_url`` per item with
+``S3Manager.presign_urls`` on a cold and a warm URL cache, and checks that
+the offline signature equals botocore's for the same signing time. No
+network access is needed, dummy credentials are used unless configured::
+
+    python -m benchmarks.presign --matches 10 50 200
+"""
+import os
+import urllib.parse
+from datetime import datetime, timezone
+
+from app.core.config import config
+from app.core.s3_storage import S3Manager
+from benchmarks.common import make_parser, summarize, timeit, write_results
+
+
+def check_parity(manager: S3Manager, keys) -> bool:
+    for key in keys:
+        reference = manager.s3_client.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": manager.bucket_name, "Key": key},
+            ExpiresIn=manager.expiration,
+        )
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(reference).query))
+        signed_at = datetime.strptime(query["X-Amz-Date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        if manager.url_cache.sign(key, signed_at, manager.expiration) != reference:
+            return False
+    return True
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--matches", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    manager = S3Manager(
+        bucket_name=config.s3.bucket or "difmag-benchmark",
+        region_name=config.s3.region,
+        endpoint_url=config.s3.endpoint_url,
+        url_cache_size=max(args.matches) * (args.repeat + 2),
+    )
+    results = {"parity": check_parity(manager, ["uploads/1/a b+ü.jpg", "uploads/1/x~(1).png"]), "sizes": []}
+    for size in args.matches:
+        keys = [f"{config.s3.upload_prefix}1/{i:08x}.jpg" for i in range(size)]
+
+        def botocore():
+            for key in keys:
+                manager.s3_client.generate_presigned_url(
+                    ClientMethod="get_object",
+                    Params={"Bucket": manager.bucket_name, "Key": key},
+                    ExpiresIn=manager.expiration,
+                )
+
+        def cold():
+            manager.url_cache._items.clear()
+            manager.presign_urls(keys)
+
+        results["sizes"].append({
+            "matches": size,
+            "botocore": summarize(timeit(botocore, repeat=args.repeat)),
+            "offline_cold": summarize(timeit(cold, repeat=args.repeat)),
+            "cached": summarize(timeit(lambda: manager.presign_urls(keys), repeat=args.repeat)),
+        })
+    write_results("presign", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Sequential vs batched S3 operations, against MinIO or a moto server.
+
+Uploads ``--objects`` objects of ``--kilobytes`` each, reads them back one
+by one and with ``AsyncS3Manager.read_objects``, then deletes them with
+one ``delete_object`` per key and with ``delete_objects``. Contents are
+checked, so the run doubles as a smoke test of the storage layer::
+
+    docker compose --profile s3 up -d minio
+    MYAPI_S3__ENDPOINT_URL=http://localhost:9000 MYAPI_S3__ACCESS_KEY_ID=minioadmin \\
+        MYAPI_S3__SECRET_ACCESS_KEY=minioadmin python -m benchmarks.s3_batch
+
+    python -m benchmarks.s3_batch --moto   # needs `pip install "moto[server]"`
+
+The bucket (``s3.bucket``, default ``difmag-benchmark``) is created if
+missing. A local stand-in has no network latency, so the gap between the
+sequential and batched numbers is far larger against real S3.
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Callable, List
+
+from app.core.config import config
+from app.core.s3_storage import AsyncS3Manager, S3Manager
+from benchmarks.common import make_parser, write_results
+
+
+def timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def make_manager(endpoint_url: str, bucket: str) -> S3Manager:
+    manager = S3Manager(
+        bucket_name=bucket,
+        region_name=config.s3.region,
+        aws_access_key_id=config.s3.access_key_id,
+        aws_secret_access_key=config.s3.secret_access_key,
+        endpoint_url=endpoint_url,
+        max_pool_connections=config.s3.max_pool_connections,
+    )
+    existing = {item["Name"] for item in manager.s3_client.list_buckets()["Buckets"]}
+    if bucket not in existing:
+        manager.s3_client.create_bucket(Bucket=bucket)
+    return manager
+
+
+def put_objects(manager: S3Manager, keys: List[str], payloads: List[bytes]) -> None:
+    for key, payload in zip(keys, payloads):
+        multipart = manager.multipart_upload(key)
+        multipart.complete(payload)
+
+
+def bench(manager: S3Manager, objects: int, size: int) -> dict:
+    storage = AsyncS3Manager(manager)
+    prefix = f"benchmark/{uuid.uuid4().hex}/"
+    keys = [f"{prefix}{i}" for i in range(objects)]
+    payloads = [os.urandom(size) for _ in range(objects)]
+    try:
+        put_objects(manager, keys, payloads)
+
+        sequential = []
+        read_sequential = timed(lambda: sequential.extend(manager.read_object(key) for key in keys))
+        batched = []
+        read_batched = timed(lambda: batched.extend(asyncio.run(storage.read_objects(keys))))
+        assert sequential == payloads and batched == payloads
+
+        half = objects // 2
+
+        def delete_sequential() -> None:
+            for key in keys[:half]:
+                manager.s3_client.delete_object(Bucket=manager.bucket_name, Key=key)
+
+        failed = []
+        delete_one_by_one = timed(delete_sequential)
+        delete_batched = timed(lambda: failed.extend(asyncio.run(storage.delete_objects(keys[half:]))))
+        remaining = manager.s3_client.list_objects_v2(Bucket=manager.bucket_name, Prefix=prefix)
+        assert not failed and remaining.get("KeyCount", 0) == 0
+    finally:
+        storage.close()
+    return {
+        "objects": objects,
+        "kilobytes": size / 1024,
+        "read_sequential_per_sec": objects / read_sequential,
+        "read_objects_per_sec": objects / read_batched,
+        "delete_object_per_sec": half / delete_one_by_one,
+        "delete_objects_per_sec": (objects - half) / delete_batched,
+    }
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--moto", action="store_true", help="Run against an in-process moto server.")
+    parser.add_argument("--objects", type=int, default=200)
+    parser.add_argument("--kilobytes", type=int, default=256)
+    args = parser.parse_args()
+
+    bucket = config.s3.bucket or "difmag-benchmark"
+    if not args.moto:
+        results = bench(make_manager(config.s3.endpoint_url, bucket), args.objects, args.kilobytes * 1024)
+    else:
+        from moto.server import ThreadedMotoServer
+
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        server = ThreadedMotoServer(port=0)
+        server.start()
+        try:
+            host, port = server.get_host_and_port()
+            manager = make_manager(f"http://{host}:{port}", bucket)
+            results = bench(manager, args.objects, args.kilobytes * 1024)
+        finally:
+            server.stop()
+    write_results("s3_batch", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Top-k latency and recall of the search backends by profile size.
+
+For every ``--sizes`` value, synthetic embeddings (clustered, non-negative
+like pooled ResNet features) are generated in chunks and searched with
+perturbed copies of stored rows, i.e. near-duplicates:
+
+* ``memory``: a :class:`~app.core.vector_index.ProfileIndex` of every
+  ``--dtypes`` value, optionally memory-mapped from ``--memory-dir``;
+* ``pgvector``: a temporary table with the HNSW index of the ``"full"``
+  storage mode, queried like ``search.backend="pgvector"`` does (needs
+  the configured database).
+
+Recall is against exact float32 search. The memory backend additionally
+reads the rows of the matches above the threshold from the database,
+which is not measured here::
+
+    python -m benchmarks.search_backends --sizes 10000 100000 --backends memory
+    python -m benchmarks.search_backends --sizes 10000 100000 1000000 \\
+        --dtypes float16 --memory-dir /var/tmp
+
+A float32 matrix takes 8 KiB per row, 8 GiB at 1M rows.
+"""
+import asyncio
+import time
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+from app.core.vector_index import ProfileIndex, normalize
+from benchmarks.common import make_parser, summarize, write_results
+
+D = EMBEDDING_DIM
+CHUNK_ROWS = 10000
+CENTERS = 1000
+
+
+def chunks(size: int, seed: int) -> Iterator[Tuple[int, np.ndarray]]:
+    """``(start, rows)`` of the synthetic embeddings, the same on every call."""
+    centers = np.random.default_rng(seed).gamma(0.5, 1.0, size=(CENTERS, D)).astype(np.float32)
+    for start in range(0, size, CHUNK_ROWS):
+        rng = np.random.default_rng([seed, start])
+        count = min(CHUNK_ROWS, size - start)
+        noise = rng.normal(0, 0.3, size=(count, D)).astype(np.float32)
+        yield start, np.maximum(centers[rng.integers(0, CENTERS, count)] + noise, 0)
+
+
+def make_queries(size: int, count: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng([seed, size])
+    picked = set(rng.choice(size, count, replace=False).tolist())
+    rows = [emb for start, block in chunks(size, seed) for i, emb in enumerate(block, start) if i in picked]
+    return np.stack(rows) * rng.normal(1, noise, size=(count, D)).astype(np.float32)
+
+
+def exact_top_k(size: int, queries: np.ndarray, k: int, seed: int) -> np.ndarray:
+    """Ids (row numbers) of the exact float32 top-k, computed chunk by chunk."""
+    queries = normalize(queries)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for start, block in chunks(size, seed):
+        scores = np.concatenate([best_scores, queries @ normalize(block).T], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    return best_ids
+
+
+def recall(found: List[np.ndarray], truth: np.ndarray) -> float:
+    hits = sum(len(set(ids.tolist()) & set(expected.tolist())) for ids, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def bench_memory(size, dtype, directory, queries, truth, k, seed) -> dict:
+    index = ProfileIndex(D, dtype, directory)
+    start = time.perf_counter()
+    for offset, block in chunks(size, seed):
+        index.append(np.arange(offset, offset + len(block)), block, np.ones(len(block), dtype=bool))
+    build = time.perf_counter() - start
+    # Warm up page cache and BLAS
+    index.search(queries[0], k)
+    durations, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = index.search(query, k)
+        durations.append(time.perf_counter() - start)
+        found.append(ids)
+    return {
+        "backend": "memory",
+        "dtype": dtype,
+        "mmap": bool(directory),
+        "build_seconds": build,
+        "megabytes": index.nbytes / 2**20,
+        "recall_at_k": recall(found, truth),
+        **summarize(durations),
+    }
+
+
+async def bench_pgvector(size, queries, truth, k, seed) -> dict:
+    import asyncpg
+    from pgvector.asyncpg import register_vector
+
+    conn = await asyncpg.connect(config.database.dsn)
+    try:
+        await register_vector(conn)
+        await conn.execute(f"CREATE TEMP TABLE bench_search (id bigint PRIMARY KEY, vec vector({D}))")
+        start = time.perf_counter()
+        for offset, block in chunks(size, seed):
+            await conn.copy_records_to_table(
+                "bench_search", records=[(offset + i, emb) for i, emb in enumerate(block)]
+            )
+        search = config.search
+        await conn.execute(
+            f"CREATE INDEX ON bench_search USING hnsw ((vec::halfvec({D})) halfvec_cosine_ops) "
+            f"WITH (m = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction})"
+        )
+        await conn.execute("ANALYZE bench_search")
+        build = time.perf_counter() - start
+        await conn.execute(f"SET hnsw.ef_search = {max(search.ef_search, k)}")
+        statement = await conn.prepare(
+            f"SELECT id FROM bench_search ORDER BY vec::halfvec({D}) <=> $1::vector({D})::halfvec({D}) LIMIT $2"
+        )
+        await statement.fetch(queries[0], k)
+        durations, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            records = await statement.fetch(query, k)
+            durations.append(time.perf_counter() - start)
+            found.append(np.array([record["id"] for record in records]))
+        return {
+            "backend": "pgvector",
+            "build_seconds": build,
+            "recall_at_k": recall(found, truth),
+            **summarize(durations),
+        }
+    finally:
+        await conn.close()
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--backends", nargs="+", choices=["memory", "pgvector"], default=["memory", "pgvector"])
+    parser.add_argument("--dtypes", nargs="+", choices=["float32", "float16"], default=["float32", "float16"])
+    parser.add_argument("--memory-dir", default=config.search.memory_dir)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=config.search.top_k)
+    parser.add_argument("--noise", type=float, default=0.05, help="relative noise applied to queries")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        queries = make_queries(size, args.queries, args.noise, args.seed)
+        truth = exact_top_k(size, queries, args.k, args.seed)
+        runs = []
+        if "memory" in args.backends:
+            for dtype in args.dtypes:
+                runs.append(bench_memory(size, dtype, args.memory_dir, queries, truth, args.k, args.seed))
+        if "pgvector" in args.backends:
+            runs.append(asyncio.run(bench_pgvector(size, queries, truth, args.k, args.seed)))
+        results.append({"rows": size, "runs": runs})
+    write_results("search_backends", {"queries": args.queries, "k": args.k, "sizes": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Seed benchmark profiles into the configured pgvector database.
+
+Creates ``--profiles`` profiles named ``<prefix><i>`` holding ``--images``
+images each:
+
+* ``--embed model``: the corpus originals go through the ingestion path
+  of ``/images/bulk`` (decode, pHash, batched embedding, bulk insert),
+  so that ``benchmarks.load`` finds their near-duplicates;
+* ``--embed synthetic``: no model is run, only synthetic vectors and
+  pHashes are inserted, for search at scale.
+
+Rows beyond the corpus are synthetic either way. Existing profiles of the
+prefix are deleted first with ``--reset``::
+
+    python -m benchmarks.seed --corpus corpus --profiles 2 --images 5000 --reset
+    python -m benchmarks.seed --embed synthetic --profiles 1 --images 200000
+"""
+import asyncio
+import time
+from pathlib import Path
+from typing import Iterator, List
+
+import numpy as np
+from sqlalchemy import delete, select, text
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+from app.core.session import task_session_scope
+from app.models.images import ImageRecord, Profile
+from app.services.images import (
+    ImageDataManager,
+    ImageService,
+    ProfileService,
+    UploadItem,
+    embedding_columns,
+)
+from benchmarks.common import make_parser, write_results
+from benchmarks.corpus import load_manifest
+
+
+def synthetic_records(profile_id: int, start: int, count: int, rng: np.random.Generator) -> List[ImageRecord]:
+    records = []
+    for i in range(start, start + count):
+        phash = int(rng.integers(-(1 << 63), (1 << 63) - 1))
+        record = ImageService._build_record(phash, f"synthetic/{i:08d}.jpg", profile_id)
+        emb = rng.gamma(0.5, 1.0, EMBEDDING_DIM).astype(np.float32)
+        for column, value in embedding_columns(emb).items():
+            setattr(record, column, value)
+        records.append(record)
+    return records
+
+
+def corpus_items(corpus: str, names: List[str]) -> Iterator[UploadItem]:
+    # Like archive members, a file is only open until the next one is requested
+    for name in names:
+        with open(Path(corpus, name), "rb") as fileobj:
+            yield UploadItem(name, fileobj)
+
+
+async def drop_profile(profile: Profile) -> None:
+    async with task_session_scope() as session:
+        await session.execute(text(
+            f"DROP TABLE IF EXISTS {ImageRecord.schema()}.{ImageRecord.table_name()}_p{int(profile.id)}"
+        ))
+        await session.execute(delete(Profile).where(Profile.id == profile.id))
+
+
+async def reset(prefix: str) -> int:
+    async with task_session_scope() as session:
+        stmt = select(Profile).where(Profile.name.startswith(prefix, autoescape=True))
+        profiles = (await session.execute(stmt)).scalars().all()
+    for profile in profiles:
+        await drop_profile(profile)
+    return len(profiles)
+
+
+async def seed_profile(name: str, args, originals: List[str], rng: np.random.Generator) -> dict:
+    async with task_session_scope() as session:
+        profile = await ProfileService(session).create_profile(name)
+    start = time.perf_counter()
+    counts = {"created": 0, "error": 0}
+
+    if args.embed == "model" and originals:
+        async with task_session_scope() as session:
+            items = corpus_items(args.corpus, originals[:args.images])
+            async for result in ImageService(session).bulk_create_images(items, profile.id):
+                counts[result["status"]] += 1
+    corpus_seconds = time.perf_counter() - start
+
+    for offset in range(counts["created"] + counts["error"], args.images, args.chunk_size):
+        records = synthetic_records(profile.id, offset, min(args.chunk_size, args.images - offset), rng)
+        async with task_session_scope() as session:
+            await ImageDataManager(session).insert_images(records)
+        counts["created"] += len(records)
+
+    async with task_session_scope() as session:
+        await session.execute(text(f"ANALYZE {ImageRecord.schema()}.{ImageRecord.table_name()}_p{int(profile.id)}"))
+    elapsed = time.perf_counter() - start
+    return {
+        "profile": name,
+        "profile_id": profile.id,
+        **counts,
+        "corpus_seconds": corpus_seconds,
+        "seconds": elapsed,
+        "rows_per_sec": counts["created"] / elapsed if elapsed else 0.0,
+    }
+
+
+async def run(args) -> dict:
+    removed = await reset(args.prefix) if args.reset else 0
+    originals = load_manifest(args.corpus)["originals"] if args.embed == "model" else []
+    rng = np.random.default_rng(args.seed)
+    profiles = [
+        await seed_profile(f"{args.prefix}{i}", args, originals, rng)
+        for i in range(args.profiles)
+    ]
+    return {
+        "embed": args.embed,
+        "storage_mode": config.search.storage_mode,
+        "insert_method": config.ingest.insert_method,
+        "removed_profiles": removed,
+        "profiles": profiles,
+    }
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--corpus", default="corpus")
+    parser.add_argument("--embed", choices=["model", "synthetic"], default="model")
+    parser.add_argument("--profiles", type=int, default=1)
+    parser.add_argument("--images", type=int, default=1000)
+    parser.add_argument("--prefix", default="bench-")
+    parser.add_argument("--reset", action="store_true", help="Delete profiles of the prefix first.")
+    parser.add_argument("--chunk-size", type=int, default=config.ingest.chunk_size * 16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_results("seed", asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Latency of every stage of ``/images/check``, one image at a time.
+
+Runs the stages of :meth:`ImageService.check_image` in isolation over
+corpus pictures (or freshly drawn ones without ``--corpus``): content
+hash, decode, pHash, preprocessing, embedding (through the batching
+engine, alone) and, with ``--profile``, the pHash and vector searches
+against that profile of the configured database::
+
+    python -m benchmarks.stages --corpus corpus --profile bench-0
+    python -m benchmarks.stages --images 20 --skip embed
+"""
+import asyncio
+import io
+import itertools
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from app.core.cache import content_key
+from app.core.config import config
+from app.core.preprocess import decode_image, to_model_input
+from app.core.session import task_session_scope
+from app.services.images import ImageDataManager, ProfileDataManager, compute_phash
+from benchmarks.common import make_parser, summarize, timeit, write_results
+from benchmarks.corpus import draw_image, load_manifest
+
+STAGES = ("content_key", "decode", "phash", "preprocess", "embed", "phash_search", "vector_search")
+
+
+def load_blobs(corpus: str, count: int, seed: int) -> List[bytes]:
+    if corpus:
+        names = load_manifest(corpus)["originals"][:count]
+        return [Path(corpus, name).read_bytes() for name in names]
+    rng = np.random.default_rng(seed)
+    blobs = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        draw_image(rng).save(buffer, format="JPEG", quality=90)
+        blobs.append(buffer.getvalue())
+    return blobs
+
+
+def cycling(fn: Callable, inputs: list) -> Callable[[], object]:
+    """Call ``fn`` on the next input at every call."""
+    inputs = itertools.cycle(inputs)
+    return lambda: fn(next(inputs))
+
+
+async def time_async(fn: Callable, inputs: list, repeat: int) -> List[float]:
+    durations = []
+    for value in itertools.islice(itertools.cycle(inputs), repeat + 2):
+        start = time.perf_counter()
+        await fn(value)
+        durations.append(time.perf_counter() - start)
+    return durations[2:]
+
+
+async def db_stages(profile: str, phashes: List[int], embeddings: List[np.ndarray], repeat: int, skip: set) -> Dict[str, dict]:
+    async with task_session_scope() as session:
+        found = await ProfileDataManager(session).get_profile(profile)
+        if found is None:
+            raise SystemExit(f"Profile '{profile}' not found")
+        manager = ImageDataManager(session)
+        limit = config.search.top_k
+
+        async def phash_search(phash: int):
+            return await manager.get_phash_matches(phash, found.id, config.search.phash_max_distance, limit)
+
+        async def vector_search(emb: np.ndarray):
+            return await manager.get_vector_distance(emb, found.id, 0.0, limit)
+
+        results = {}
+        if "phash_search" not in skip:
+            results["phash_search"] = summarize(await time_async(phash_search, phashes, repeat))
+        if "vector_search" not in skip:
+            results["vector_search"] = summarize(await time_async(vector_search, embeddings, repeat))
+        return results
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--corpus", default="", help="Corpus of benchmarks.corpus, drawn pictures if empty.")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--profile", default="", help="Profile searched by the database stages.")
+    parser.add_argument("--skip", nargs="*", choices=STAGES, default=[])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    skip = set(args.skip)
+    if not args.profile:
+        skip.update({"phash_search", "vector_search"})
+
+    blobs = load_blobs(args.corpus, args.images, args.seed)
+    images = [decode_image(data) for data in blobs]
+    pixels = [to_model_input(image) for image in images]
+    phashes = [compute_phash(image) for image in images]
+    stages = {
+        "content_key": cycling(content_key, blobs),
+        "decode": cycling(decode_image, blobs),
+        "phash": cycling(compute_phash, images),
+        "preprocess": cycling(to_model_input, images),
+    }
+    results: Dict[str, dict] = {}
+    for stage, fn in stages.items():
+        if stage not in skip:
+            results[stage] = summarize(timeit(fn, repeat=args.repeat))
+
+    embeddings: List[np.ndarray] = []
+    if "embed" not in skip or "vector_search" not in skip:
+        from app.core.embeder import embedder
+
+        embedder.warmup()
+        if "embed" not in skip:
+            results["embed"] = summarize(timeit(cycling(embedder.embed, pixels), repeat=args.repeat))
+        embeddings = [emb.numpy() for emb in embedder.embed_batch(pixels)]
+    if "phash_search" not in skip or "vector_search" not in skip:
+        results.update(asyncio.run(db_stages(args.profile, phashes, embeddings, args.repeat, skip)))
+
+    write_results("stages", {
+        "images": len(blobs),
+        "backend": config.embedder.backend,
+        "decode_reduce": config.decode.reduce,
+        "storage_mode": config.search.storage_mode,
+        "search_backend": config.search.backend,
+        "stages_ms": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Process startup cost: app import, model warmup and first request.
+
+Every probe runs in a fresh interpreter, the way an API or Celery worker
+starts, and is repeated ``--runs`` times::
+
+    python -m benchmarks.startup --runs 5
+    MYAPI_EMBEDDER__WEIGHTS_PATH=artifacts/resnet50_imagenet1k_v2.pth python -m benchmarks.startup
+
+``import`` is the time to import ``app.main`` (and which heavy modules it
+pulled in), ``warmup`` the time of ``embedder.warmup()`` right after it,
+``first_request`` / ``second_request`` the embedding of one JPEG in a
+process that skipped the warmup.
+"""
+import json
+import subprocess
+import sys
+
+from benchmarks.common import make_parser, summarize, write_results
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("torch", "torchvision", "onnxruntime") if name in sys.modules]
+print(json.dumps({"seconds": elapsed, "heavy_modules": heavy}))
+"""
+
+WARMUP_PROBE = """
+import json, time
+import app.main
+from app.core.embeder import embedder
+start = time.perf_counter()
+embedder.warmup()
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+REQUEST_PROBE = """
+import io, json, time
+from PIL import Image
+from app.services.images import decode_image, extract_embedding
+buffer = io.BytesIO()
+Image.new("RGB", (640, 480), (120, 80, 40)).save(buffer, format="JPEG")
+data = buffer.getvalue()
+durations = []
+for _ in range(2):
+    start = time.perf_counter()
+    extract_embedding(decode_image(data))
+    durations.append(time.perf_counter() - start)
+print(json.dumps({"first": durations[0], "second": durations[1]}))
+"""
+
+
+def probe(code: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    imports = [probe(IMPORT_PROBE) for _ in range(args.runs)]
+    warmups = [probe(WARMUP_PROBE) for _ in range(args.runs)]
+    requests = [probe(REQUEST_PROBE) for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "import": {
+            **summarize([run["seconds"] for run in imports]),
+            "heavy_modules": imports[-1]["heavy_modules"],
+        },
+        "warmup": summarize([run["seconds"] for run in warmups]),
+        "first_request": summarize([run["first"] for run in requests]),
+        "second_request": summarize([run["second"] for run in requests]),
+    }
+    write_results("startup", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Recall vs latency of the embedding storage modes.
+
+Loads embeddings into a temporary table holding all three representations
+(float32 ``vector``, ``halfvec`` and mean-thresholded ``bit``), builds the same
+HNSW indexes as the migrations and compares each ``search.storage_mode``
+against exact float32 search computed in NumPy. Queries are perturbed copies
+of stored rows, i.e. near-duplicates::
+
+    python -m benchmarks.storage_modes --rows 20000 --queries 200
+    python -m benchmarks.storage_modes --source db  # sample public.images
+"""
+import asyncio
+import time
+
+import asyncpg
+import numpy as np
+from pgvector.asyncpg import register_vector
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+from app.services.images import quantize_binary
+from benchmarks.common import make_parser, summarize, write_results
+
+D = EMBEDDING_DIM
+
+QUERIES = {
+    "full": (
+        f"SELECT id FROM bench_embeddings "
+        f"ORDER BY full_vec::halfvec({D}) <=> $1::vector({D})::halfvec({D}) LIMIT $2"
+    ),
+    "halfvec": f"SELECT id FROM bench_embeddings ORDER BY half_vec <=> $1::halfvec({D}) LIMIT $2",
+    "binary": (
+        f"SELECT id FROM ("
+        f"  SELECT id, full_vec FROM bench_embeddings"
+        f"  ORDER BY bin_vec <~> $3::bit({D}) LIMIT $4"
+        f") candidates ORDER BY full_vec <=> $1::vector({D}) LIMIT $2"
+    ),
+}
+
+
+def synthetic_embeddings(rows: int, rng: np.random.Generator) -> np.ndarray:
+    """Non-negative clustered vectors, shaped like pooled ResNet features."""
+    centers = rng.gamma(0.5, 1.0, size=(max(rows // 50, 1), D)).astype(np.float32)
+    labels = rng.integers(0, len(centers), rows)
+    noise = rng.normal(0, 0.3, size=(rows, D)).astype(np.float32)
+    return np.maximum(centers[labels] + noise, 0)
+
+
+async def load_embeddings(conn, source: str, rows: int, rng) -> np.ndarray:
+    if source == "db":
+        records = await conn.fetch(
+            "SELECT mbedding FROM public.images WHERE mbedding IS NOT NULL LIMIT $1", rows
+        )
+        return np.stack([record["mbedding"] for record in records]).astype(np.float32)
+    return synthetic_embeddings(rows, rng)
+
+
+async def prepare_table(conn, embeddings: np.ndarray) -> None:
+    await conn.execute(
+        f"CREATE TEMP TABLE bench_embeddings "
+        f"(id int PRIMARY KEY, full_vec vector({D}), half_vec halfvec({D}), bin_vec bit({D}))"
+    )
+    await conn.copy_records_to_table(
+        "bench_embeddings",
+        records=[(i, emb, emb, quantize_binary(emb)) for i, emb in enumerate(embeddings)],
+    )
+    search = config.search
+    options = f"WITH (m = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction})"
+    await conn.execute(
+        f"CREATE INDEX ON bench_embeddings USING hnsw "
+        f"((full_vec::halfvec({D})) halfvec_cosine_ops) {options}"
+    )
+    await conn.execute(f"CREATE INDEX ON bench_embeddings USING hnsw (half_vec halfvec_cosine_ops) {options}")
+    await conn.execute(f"CREATE INDEX ON bench_embeddings USING hnsw (bin_vec bit_hamming_ops) {options}")
+    await conn.execute("ANALYZE bench_embeddings")
+
+
+async def row_sizes(conn) -> dict:
+    row = await conn.fetchrow(
+        "SELECT avg(pg_column_size(full_vec)) AS full, "
+        "avg(pg_column_size(half_vec)) AS halfvec, "
+        "avg(pg_column_size(bin_vec)) AS binary FROM bench_embeddings"
+    )
+    return {key: float(value) for key, value in row.items()}
+
+
+async def bench_mode(conn, mode, queries, truth, k, candidates) -> dict:
+    ef_search = max(config.search.ef_search, candidates if mode == "binary" else k)
+    await conn.execute(f"SET hnsw.ef_search = {ef_search}")
+    durations, hits = [], 0
+    for query, expected in zip(queries, truth):
+        args = [query, k] + ([quantize_binary(query), candidates] if mode == "binary" else [])
+        start = time.perf_counter()
+        records = await conn.fetch(QUERIES[mode], *args)
+        durations.append(time.perf_counter() - start)
+        hits += len({record["id"] for record in records} & set(expected.tolist()))
+    return {"mode": mode, "recall_at_k": hits / (len(queries) * k), **summarize(durations)}
+
+
+async def run(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    conn = await asyncpg.connect(config.database.dsn)
+    try:
+        await register_vector(conn)
+        embeddings = await load_embeddings(conn, args.source, args.rows, rng)
+        await prepare_table(conn, embeddings)
+
+        picked = rng.choice(len(embeddings), args.queries, replace=False)
+        queries = embeddings[picked] * rng.normal(1, args.noise, size=(args.queries, D)).astype(np.float32)
+        normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+        truth = np.argsort(-scores, axis=1)[:, :args.k]
+
+        modes = [
+            await bench_mode(conn, mode, queries, truth, args.k, args.candidates)
+            for mode in QUERIES
+        ]
+        return {
+            "rows": len(embeddings),
+            "queries": args.queries,
+            "k": args.k,
+            "rerank_candidates": args.candidates,
+            "bytes_per_row": await row_sizes(conn),
+            "modes": modes,
+        }
+    finally:
+        await conn.close()
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=config.search.rerank_candidates)
+    parser.add_argument("--noise", type=float, default=0.05, help="relative noise applied to queries")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_results("storage_modes", asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
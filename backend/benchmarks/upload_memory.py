@@ -0,0 +1,150 @@
+"""Memory and time of reading concurrent large uploads, form vs streaming.
+
+Feeds ``--concurrency`` multipart bodies of ``--megabytes`` each through
+ASGI requests at once, in 64 KiB chunks like uvicorn, and reads them:
+
+* ``form``: ``request.form()`` and ``UploadFile.read()``, as the
+  ``UploadFile`` endpoints did (the file is spooled to disk first);
+* ``stream``: :func:`app.core.uploads.receive_upload`, keeping the bytes
+  for decoding;
+* ``stage``: ``receive_upload`` streaming to a multipart upload that
+  discards its parts, as ``/images/load?enqueue=true`` does to S3.
+
+Peak memory is traced Python allocations (``tracemalloc``) above the
+request bodies themselves::
+
+    python -m benchmarks.upload_memory --megabytes 40 --concurrency 8
+"""
+import asyncio
+import os
+import time
+import tracemalloc
+
+from starlette.requests import Request
+
+from app.core.config import config
+from app.core.uploads import receive_upload
+from benchmarks.common import make_parser, summarize, write_results
+
+BOUNDARY = "benchmarkboundary"
+CHUNK_SIZE = 64 * 1024
+
+
+def multipart_body(payload: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="image.jpg"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def make_request(body: bytes) -> Request:
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/images/load",
+        "headers": [
+            (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    }
+    view = memoryview(body)
+    offsets = iter(range(0, len(body), CHUNK_SIZE))
+
+    async def receive() -> dict:
+        offset = next(offsets, None)
+        if offset is None:
+            return {"type": "http.disconnect"}
+        chunk = bytes(view[offset:offset + CHUNK_SIZE])
+        # Yield to the other requests, as a socket read would
+        await asyncio.sleep(0)
+        return {"type": "http.request", "body": chunk, "more_body": offset + CHUNK_SIZE < len(body)}
+
+    return Request(scope, receive)
+
+
+class DiscardUpload:
+    """Stands in for ``AsyncS3MultipartUpload``, dropping every part."""
+
+    s3_key = "discarded"
+
+    async def upload_part(self, data: bytes) -> None:
+        pass
+
+    async def complete(self, data: bytes = b"") -> str:
+        return self.s3_key
+
+    async def abort(self) -> None:
+        pass
+
+
+async def read_form(request: Request) -> int:
+    form = await request.form()
+    try:
+        return len(await form["file"].read())
+    finally:
+        await form.close()
+
+
+async def read_stream(request: Request) -> int:
+    return len((await receive_upload(request)).data)
+
+
+async def read_staged(request: Request) -> int:
+    return (await receive_upload(request, keep=False, stage=lambda filename: DiscardUpload())).size
+
+
+MODES = {"form": read_form, "stream": read_stream, "stage": read_staged}
+
+
+async def run_mode(mode: str, body: bytes, concurrency: int) -> dict:
+    requests = [make_request(body) for _ in range(concurrency)]
+    latencies = []
+
+    async def timed(request: Request) -> int:
+        start = time.perf_counter()
+        size = await MODES[mode](request)
+        latencies.append(time.perf_counter() - start)
+        return size
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    sizes = await asyncio.gather(*[timed(request) for request in requests])
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert all(size == len(body) - len(multipart_body(b"")) for size in sizes)
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "megabytes_per_sec": concurrency * len(body) / elapsed / 2**20,
+        "peak_mb": peak / 2**20,
+        "peak_mb_per_request": peak / concurrency / 2**20,
+        **summarize(latencies),
+    }
+
+
+def main() -> None:
+    parser = make_parser(__doc__)
+    parser.add_argument("--megabytes", type=float, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.megabytes * 2**20))
+    body = multipart_body(payload)
+    del payload
+    # Measure the reading, not the limit
+    config.decode.max_bytes = len(body)
+
+    results = {
+        "megabytes": args.megabytes,
+        "concurrency": args.concurrency,
+        "part_size_mb": config.s3.part_size / 2**20,
+        "modes": [asyncio.run(run_mode(mode, body, args.concurrency)) for mode in args.modes],
+    }
+    write_results("upload_memory", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
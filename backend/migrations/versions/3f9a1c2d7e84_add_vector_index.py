@@ -0,0 +1,49 @@
+"""add vector index
+
+Revision ID: 3f9a1c2d7e84
+Revises: 65422322c423
+Create Date: 2025-02-10 12:14:05.418230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c2d7e84'
+down_revision: Union[str, None] = '65422322c423'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = 'ix__images__mbedding'
+
+
+def upgrade() -> None:
+    # pgvector can only index ``vector`` columns up to 2000 dimensions,
+    # so the 2048-d embedding is indexed through a halfvec expression.
+    # Queries must order by the very same expression to use the index.
+    search = config.search
+    if search.index_type == 'hnsw':
+        method = 'hnsw'
+        options = f'm = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction}'
+    elif search.index_type == 'ivfflat':
+        method = 'ivfflat'
+        options = f'lists = {search.ivfflat_lists}'
+    else:
+        raise ValueError(f'Unsupported vector index type: {search.index_type}')
+
+    op.execute(
+        f'CREATE INDEX {INDEX_NAME} ON public.images '
+        f'USING {method} ((mbedding::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops) '
+        f'WITH ({options})'
+    )
+    op.create_index('ix__images__profile_id', 'images', ['profile_id'], schema='public')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__images__profile_id', table_name='images', schema='public')
+    op.execute(f'DROP INDEX IF EXISTS public.{INDEX_NAME}')
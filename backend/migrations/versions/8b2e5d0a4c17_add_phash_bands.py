@@ -0,0 +1,47 @@
+"""add phash bands
+
+Revision ID: 8b2e5d0a4c17
+Revises: 3f9a1c2d7e84
+Create Date: 2025-02-14 18:32:41.907113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.const import PHASH_BANDS
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e5d0a4c17'
+down_revision: Union[str, None] = '3f9a1c2d7e84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BAND_BITS = 64 // PHASH_BANDS
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('phash', sa.BigInteger(), nullable=True), schema='public')
+    # ``hash`` keeps the hex string produced by imagehash
+    op.execute(
+        "UPDATE public.images "
+        "SET phash = ('x' || lpad(hash, 16, '0'))::bit(64)::bigint "
+        "WHERE hash IS NOT NULL"
+    )
+    # Multi-index hashing: two pHashes within PHASH_BANDS - 1 bits
+    # share at least one band exactly, so each band gets a btree index.
+    # The expressions must match ``phash_band`` in app.services.images.
+    for band in range(PHASH_BANDS):
+        shift = 64 - BAND_BITS * (band + 1)
+        op.execute(
+            f'CREATE INDEX ix__images__phash_band{band} ON public.images '
+            f'(profile_id, ((phash >> {shift}) & {2 ** BAND_BITS - 1}))'
+        )
+
+
+def downgrade() -> None:
+    for band in range(PHASH_BANDS):
+        op.execute(f'DROP INDEX IF EXISTS public.ix__images__phash_band{band}')
+    op.drop_column('images', 'phash', schema='public')
@@ -0,0 +1,50 @@
+"""add duplicate groups
+
+Revision ID: 9d4b7e2c5a18
+Revises: f2c8d4a61b37
+Create Date: 2025-03-21 16:05:44.310927
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4b7e2c5a18'
+down_revision: Union[str, None] = 'f2c8d4a61b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Only images with at least one duplicate have a row; ``group_id`` is
+    # the smallest image id of the group. Written by ``python -m app.jobs.cluster``
+    op.create_table('duplicate_groups',
+    sa.Column('profile_id', sa.Integer(), nullable=False),
+    sa.Column('image_id', sa.Integer(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['profile_id'], ['public.profiles.id'], name=op.f('fk__duplicate_groups__profile_id__profiles'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('profile_id', 'image_id', name=op.f('pk__duplicate_groups')),
+    schema='public'
+    )
+    op.create_index('ix__duplicate_groups__profile_id_group_id', 'duplicate_groups', ['profile_id', 'group_id'], schema='public')
+    # Parameters and progress of the last clustering of every profile
+    op.create_table('duplicate_group_state',
+    sa.Column('profile_id', sa.Integer(), nullable=False),
+    sa.Column('last_image_id', sa.Integer(), nullable=False),
+    sa.Column('threshold', sa.Float(), nullable=False),
+    sa.Column('phash_max_distance', sa.Integer(), nullable=False),
+    sa.Column('model_version', sa.String(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.ForeignKeyConstraint(['profile_id'], ['public.profiles.id'], name=op.f('fk__duplicate_group_state__profile_id__profiles'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('profile_id', name=op.f('pk__duplicate_group_state')),
+    schema='public'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('duplicate_group_state', schema='public')
+    op.drop_index('ix__duplicate_groups__profile_id_group_id', table_name='duplicate_groups', schema='public')
+    op.drop_table('duplicate_groups', schema='public')
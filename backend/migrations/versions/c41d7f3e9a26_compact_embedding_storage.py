@@ -0,0 +1,71 @@
+"""compact embedding storage
+
+Revision ID: c41d7f3e9a26
+Revises: 8b2e5d0a4c17
+Create Date: 2025-02-21 15:07:53.226718
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pgvector
+
+from app.const import EMBEDDING_DIM
+from app.core.config import config
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7f3e9a26'
+down_revision: Union[str, None] = '8b2e5d0a4c17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('mbedding_half', pgvector.sqlalchemy.HALFVEC(dim=EMBEDDING_DIM), nullable=True), schema='public')
+    op.add_column('images', sa.Column('mbedding_bin', pgvector.sqlalchemy.BIT(length=EMBEDDING_DIM), nullable=True), schema='public')
+
+    # Backfill the representation used by the configured storage mode
+    mode = config.search.storage_mode
+    if mode == 'halfvec':
+        op.execute(
+            f'UPDATE public.images '
+            f'SET mbedding_half = mbedding::halfvec({EMBEDDING_DIM}), mbedding = NULL '
+            f'WHERE mbedding IS NOT NULL'
+        )
+    elif mode == 'binary':
+        # Same as app.services.images.quantize_binary: every dimension
+        # is compared with the mean of its own vector
+        op.execute(
+            f'UPDATE public.images SET mbedding_bin = binary_quantize('
+            f'mbedding - array_fill('
+            f'(SELECT avg(x) FROM unnest(mbedding::real[]) AS x)::real, '
+            f'ARRAY[{EMBEDDING_DIM}])::vector({EMBEDDING_DIM})'
+            f')::bit({EMBEDDING_DIM}) '
+            f'WHERE mbedding IS NOT NULL'
+        )
+
+    # NULLs are not indexed, so indexes of unused modes stay empty
+    search = config.search
+    op.execute(
+        f'CREATE INDEX ix__images__mbedding_half ON public.images '
+        f'USING hnsw (mbedding_half halfvec_cosine_ops) '
+        f'WITH (m = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction})'
+    )
+    op.execute(
+        f'CREATE INDEX ix__images__mbedding_bin ON public.images '
+        f'USING hnsw (mbedding_bin bit_hamming_ops) '
+        f'WITH (m = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction})'
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS public.ix__images__mbedding_bin')
+    op.execute('DROP INDEX IF EXISTS public.ix__images__mbedding_half')
+    op.execute(
+        f'UPDATE public.images SET mbedding = mbedding_half::vector({EMBEDDING_DIM}) '
+        f'WHERE mbedding IS NULL AND mbedding_half IS NOT NULL'
+    )
+    op.drop_column('images', 'mbedding_bin', schema='public')
+    op.drop_column('images', 'mbedding_half', schema='public')
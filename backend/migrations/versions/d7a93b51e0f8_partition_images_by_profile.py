@@ -0,0 +1,119 @@
+"""partition images by profile
+
+Revision ID: d7a93b51e0f8
+Revises: c41d7f3e9a26
+Create Date: 2025-03-02 11:46:20.583164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.const import EMBEDDING_DIM, PHASH_BANDS
+from app.core.config import config
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a93b51e0f8'
+down_revision: Union[str, None] = 'c41d7f3e9a26'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, profile_id, file_path, hash, phash, mbedding, mbedding_half, mbedding_bin'
+
+COLUMN_DEFINITIONS = f'''
+    id integer NOT NULL DEFAULT nextval('public.images_id_seq'),
+    profile_id integer NOT NULL,
+    file_path varchar NOT NULL,
+    hash varchar,
+    phash bigint,
+    mbedding vector({EMBEDDING_DIM}),
+    mbedding_half halfvec({EMBEDDING_DIM}),
+    mbedding_bin bit({EMBEDDING_DIM})
+'''
+
+
+def index_statements() -> list:
+    """Indexes created by the previous migrations, defined on ``public.images``.
+
+    On the partitioned table every statement creates a partitioned index:
+    each partition gets its own copy, including partitions created later.
+    """
+    search = config.search
+    if search.index_type == 'ivfflat':
+        vector_index = f"ivfflat ((mbedding::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops) WITH (lists = {search.ivfflat_lists})"
+    else:
+        vector_index = (
+            f"hnsw ((mbedding::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops) "
+            f"WITH (m = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction})"
+        )
+    hnsw_options = f'WITH (m = {search.hnsw_m}, ef_construction = {search.hnsw_ef_construction})'
+    band_bits = 64 // PHASH_BANDS
+    statements = [
+        'CREATE INDEX ix__images__profile_id ON public.images (profile_id)',
+        f'CREATE INDEX ix__images__mbedding ON public.images USING {vector_index}',
+        f'CREATE INDEX ix__images__mbedding_half ON public.images USING hnsw (mbedding_half halfvec_cosine_ops) {hnsw_options}',
+        f'CREATE INDEX ix__images__mbedding_bin ON public.images USING hnsw (mbedding_bin bit_hamming_ops) {hnsw_options}',
+    ]
+    for band in range(PHASH_BANDS):
+        shift = 64 - band_bits * (band + 1)
+        statements.append(
+            f'CREATE INDEX ix__images__phash_band{band} ON public.images '
+            f'(profile_id, ((phash >> {shift}) & {2 ** band_bits - 1}))'
+        )
+    return statements
+
+
+def detach_legacy_table() -> None:
+    """Rename current table out of the way, releasing names reused by the new one."""
+    op.execute('ALTER TABLE public.images RENAME TO images_legacy')
+    op.execute('ALTER TABLE public.images_legacy DROP CONSTRAINT pk__images')
+    op.execute('ALTER TABLE public.images_legacy DROP CONSTRAINT img2profile')
+    op.execute('ALTER SEQUENCE public.images_id_seq OWNED BY NONE')
+    for index in ['profile_id', 'mbedding', 'mbedding_half', 'mbedding_bin'] + [
+        f'phash_band{band}' for band in range(PHASH_BANDS)
+    ]:
+        op.execute(f'DROP INDEX IF EXISTS public.ix__images__{index}')
+
+
+def upgrade() -> None:
+    detach_legacy_table()
+    op.execute(
+        f'CREATE TABLE public.images ({COLUMN_DEFINITIONS}, '
+        f'CONSTRAINT pk__images PRIMARY KEY (id, profile_id), '
+        f'CONSTRAINT img2profile FOREIGN KEY (profile_id) REFERENCES public.profiles (id)'
+        f') PARTITION BY LIST (profile_id)'
+    )
+    op.execute('ALTER SEQUENCE public.images_id_seq OWNED BY public.images.id')
+    op.execute('CREATE TABLE public.images_default PARTITION OF public.images DEFAULT')
+
+    # New profiles get their partition from ProfileService.create_profile
+    profile_ids = op.get_bind().execute(sa.text('SELECT id FROM public.profiles')).scalars().all()
+    for profile_id in profile_ids:
+        op.execute(
+            f'CREATE TABLE public.images_p{profile_id} '
+            f'PARTITION OF public.images FOR VALUES IN ({profile_id})'
+        )
+
+    op.execute(f'INSERT INTO public.images ({COLUMNS}) SELECT {COLUMNS} FROM public.images_legacy')
+    op.execute('DROP TABLE public.images_legacy')
+
+    # Indexes are built after the data load, one per partition
+    for statement in index_statements():
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    detach_legacy_table()
+    op.execute(
+        f'CREATE TABLE public.images ({COLUMN_DEFINITIONS}, '
+        f'CONSTRAINT pk__images PRIMARY KEY (id), '
+        f'CONSTRAINT img2profile FOREIGN KEY (profile_id) REFERENCES public.profiles (id))'
+    )
+    op.execute('ALTER SEQUENCE public.images_id_seq OWNED BY public.images.id')
+    op.execute(f'INSERT INTO public.images ({COLUMNS}) SELECT {COLUMNS} FROM public.images_legacy')
+    # Drops all partitions as well
+    op.execute('DROP TABLE public.images_legacy')
+    for statement in index_statements():
+        op.execute(statement)
@@ -0,0 +1,27 @@
+"""add image s3 key
+
+Revision ID: e5b18c7f2a93
+Revises: d7a93b51e0f8
+Create Date: 2025-03-09 10:21:37.402518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b18c7f2a93'
+down_revision: Union[str, None] = 'd7a93b51e0f8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Added to every partition as well
+    op.add_column('images', sa.Column('s3_key', sa.String(), nullable=True), schema='public')
+
+
+def downgrade() -> None:
+    op.drop_column('images', 's3_key', schema='public')
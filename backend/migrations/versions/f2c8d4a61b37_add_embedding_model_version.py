@@ -0,0 +1,28 @@
+"""add embedding model version
+
+Revision ID: f2c8d4a61b37
+Revises: e5b18c7f2a93
+Create Date: 2025-03-14 11:42:08.915263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c8d4a61b37'
+down_revision: Union[str, None] = 'e5b18c7f2a93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Left NULL on existing rows: their preprocessing is unknown, so
+    # ``python -m app.jobs.reembed`` treats them as stale
+    op.add_column('images', sa.Column('embedding_model_version', sa.String(), nullable=True), schema='public')
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'embedding_model_version', schema='public')
@@ -0,0 +1,62 @@
+"""Tests of :class:`app.core.embeder.BatchingEmbedder` with a fake model."""
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from app.core.embeder import BatchingEmbedder
+from app.core.preprocess import CROP_SIZE
+
+
+def fake_model(batch):
+    # [N, 3, H, W] -> [N, 3, 1, 1], flattened by the embedder
+    return batch.mean(dim=(2, 3), keepdim=True)
+
+
+def pixels() -> np.ndarray:
+    return np.zeros((CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+
+
+def test_lazy_load_without_warmup_sets_ready():
+    loads = []
+
+    def loader():
+        loads.append(threading.current_thread().name)
+        return fake_model
+
+    embedder = BatchingEmbedder(loader=loader, max_wait_ms=1)
+    assert not embedder.ready
+
+    async def check():
+        return await asyncio.gather(*[embedder.aembed(pixels()) for _ in range(3)])
+
+    embeddings = asyncio.run(asyncio.wait_for(check(), timeout=30))
+
+    assert [tuple(emb.shape) for emb in embeddings] == [(3,)] * 3
+    # Loaded once, by the worker thread rather than the event loop
+    assert loads == ["embedder"]
+    assert embedder.ready
+    assert embedder.load_seconds is not None
+    assert embedder.load_error is None
+
+
+def test_failed_load_is_reported_and_retried():
+    attempts = []
+
+    def loader():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("weights missing")
+        return fake_model
+
+    embedder = BatchingEmbedder(loader=loader, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="weights missing"):
+        embedder.submit(pixels()).result(timeout=30)
+    assert not embedder.ready
+    assert embedder.load_error == "weights missing"
+
+    embedder.warmup()
+    assert embedder.ready
+    assert embedder.load_error is None
+    assert len(attempts) == 2
@@ -0,0 +1,35 @@
+"""Tests of the pure helpers of :mod:`app.services.images`."""
+import numpy as np
+
+from app.services.images import batch_duplicates
+
+BASE = 0x0F0F0F0F0F0F0F0F
+# Three bits away: pHash similarity 1 - 3/64, about 0.953
+CLOSE = BASE ^ 0b111
+
+
+def test_phash_pair_within_distance_and_threshold():
+    duplicates = batch_duplicates(
+        keys=["a", "b"], phashes=[BASE, CLOSE], embeddings=[None, None], threshold=0.9, max_distance=3
+    )
+    assert duplicates == [None, 0]
+
+
+def test_phash_pair_below_threshold_is_not_a_duplicate():
+    # Within max_distance, but check_image drops such matches at this threshold
+    duplicates = batch_duplicates(
+        keys=["a", "b"], phashes=[BASE, CLOSE], embeddings=[None, None], threshold=0.99, max_distance=3
+    )
+    assert duplicates == [None, None]
+
+
+def test_same_bytes_and_similar_embeddings():
+    vector = np.ones(8, dtype=np.float32)
+    duplicates = batch_duplicates(
+        keys=["a", "a", "c", "d"],
+        phashes=[None, None, None, None],
+        embeddings=[None, None, vector, vector * 2],
+        threshold=0.99,
+        max_distance=3,
+    )
+    assert duplicates == [None, 0, None, 2]
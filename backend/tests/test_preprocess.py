@@ -0,0 +1,56 @@
+"""Tests of :mod:`app.core.preprocess`, run from ``backend`` with ``python -m pytest tests``."""
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from app.core.config import config
+from app.core.preprocess import DECODE_ERRORS, ImageTooLarge, decode_image
+
+
+def png_header(width: int, height: int) -> bytes:
+    """PNG declaring ``width`` x ``height`` RGB pixels, with almost no data."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"\0" * 64))
+        + chunk(b"IEND", b"")
+    )
+
+
+def jpeg(width: int = 600, height: int = 400) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_decode_reduces_to_model_size():
+    image = decode_image(jpeg(1200, 800))
+    assert image.mode == "RGB"
+    assert min(image.size) >= 256
+
+
+def test_declared_pixels_over_budget(monkeypatch):
+    monkeypatch.setattr(config.decode, "max_pixels", 1000 * 1000)
+    with pytest.raises(ImageTooLarge):
+        decode_image(png_header(2000, 1000))
+
+
+def test_decompression_bomb_is_too_large():
+    # Over twice Image.MAX_IMAGE_PIXELS, rejected by PIL inside Image.open
+    assert 20000 * 10000 > 2 * Image.MAX_IMAGE_PIXELS
+    with pytest.raises(ImageTooLarge):
+        decode_image(png_header(20000, 10000))
+
+
+@pytest.mark.parametrize("data", [jpeg()[:300], b"not an image"], ids=["truncated", "garbage"])
+def test_undecodable_upload(data):
+    with pytest.raises(DECODE_ERRORS):
+        decode_image(data)